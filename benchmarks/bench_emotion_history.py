@@ -0,0 +1,84 @@
+"""
+Microbenchmark: per-frame cost of the emotion history average
+
+Compares the old deque-of-dicts implementation (np.linspace weights rebuilt
+and a Python generator per emotion on every frame) with the NumPy ring
+buffer `EmotionHistory` used by `modules/face_analysis.py`.
+
+Usage:
+    python -m benchmarks.bench_emotion_history [frames]
+"""
+import sys
+import time
+import random
+from collections import deque
+import numpy as np
+from modules.config import HISTORY_SIZE, ANALYSIS_INTERVAL
+from modules.face_analysis import (
+    EMOTION_KEYS, EmotionHistory, danger_score_from_vector, vector_to_emotions_dict
+)
+
+
+def _legacy_average(history):
+    """Copy of the previous get_average_emotions() + calculate_danger_score()."""
+    if not history:
+        return {}, "neutral", 0.0
+    n = len(history)
+    weights = np.linspace(0.5, 1.0, n)
+    weights = weights / weights.sum()
+    avg_emotions = {}
+    for key in history[0].keys():
+        avg_emotions[key] = sum(e[key] * w for e, w in zip(history, weights))
+    total = sum(avg_emotions.values())
+    if total > 0:
+        avg_emotions = {k: (v / total) * 100 for k, v in avg_emotions.items()}
+    main_emotion = max(avg_emotions, key=avg_emotions.get)
+    if avg_emotions[main_emotion] < 30.0:
+        main_emotion = "neutral"
+    danger = sum(avg_emotions.get(k, 0) for k in ["angry", "fear", "disgust"])
+    return avg_emotions, main_emotion, danger
+
+
+def _random_emotions(rng):
+    raw = [rng.random() for _ in EMOTION_KEYS]
+    total = sum(raw)
+    return {k: v / total * 100.0 for k, v in zip(EMOTION_KEYS, raw)}
+
+
+def run(frames=100000):
+    rng = random.Random(0)
+    samples = [_random_emotions(rng) for _ in range(frames // ANALYSIS_INTERVAL + 1)]
+
+    # Legacy: deque of dicts, full recomputation every frame
+    legacy = deque(maxlen=HISTORY_SIZE)
+    start = time.perf_counter()
+    for i in range(frames):
+        if i % ANALYSIS_INTERVAL == 0:
+            legacy.append(samples[i // ANALYSIS_INTERVAL])
+        _legacy_average(legacy)
+    legacy_s = time.perf_counter() - start
+
+    # Ring buffer: incremental update on append, O(1) read per frame
+    history = EmotionHistory(HISTORY_SIZE)
+    start = time.perf_counter()
+    for i in range(frames):
+        if i % ANALYSIS_INTERVAL == 0:
+            history.append_dict(samples[i // ANALYSIS_INTERVAL])
+        history.average()
+        history.danger_score()
+    ring_s = time.perf_counter() - start
+
+    # Sanity check: both produce the same average
+    avg, _ = history.average()
+    expected, _, expected_danger = _legacy_average(legacy)
+    got = vector_to_emotions_dict(avg)
+    assert all(abs(got[k] - expected[k]) < 1e-6 for k in EMOTION_KEYS)
+    assert abs(danger_score_from_vector(avg) - expected_danger) < 1e-6
+
+    print(f"frames: {frames}, history: {HISTORY_SIZE}, analysis interval: {ANALYSIS_INTERVAL}")
+    print(f"legacy deque/dict : {legacy_s / frames * 1e6:8.2f} µs/frame")
+    print(f"EmotionHistory    : {ring_s / frames * 1e6:8.2f} µs/frame  ({legacy_s / ring_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
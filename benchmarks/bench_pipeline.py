@@ -0,0 +1,289 @@
+"""
+Pipeline benchmark suite with regression thresholds
+
+Times the frame pipeline stage by stage and end to end over the `test/*.png`
+images and synthetic frames at several resolutions, and reports throughput
+and p50 / p99 latency per stage:
+
+    preprocess      face_analysis.preprocess_face (crop + CLAHE + resize)
+    analyze         face_analysis.analyze_emotions (DeepFace; --skip-deepface)
+    represent       face_analysis.get_face_embedding (DeepFace; --skip-deepface)
+    average         face_analysis.get_average_emotions
+    smoother        TemporalSmoother.update
+    registry_match  FaceRegistry.match against --registry-size embeddings
+    mesh            MediaPipe face mesh + landmark drawing
+    overlay         emotion / status text drawing
+    encode          cv2.imencode('.jpg')
+    end_to_end      FrameProcessor.process + encode (danger capture disabled,
+                    analysis every ANALYSIS_INTERVAL frames as in production)
+    replay          with --recording: decode + end_to_end over every frame of
+                    a recording (modules/recording.py), read as fast as possible
+
+Results are written as JSON (stage -> stats, plus machine / config info) so
+runs can be compared; with --baseline the run fails (exit 1) when a stage's
+p50 is more than --threshold (default 20 %, per stage with
+--stage-threshold analyze=0.5) slower than in the baseline.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--iterations 50] [--resolutions 640x480,1280x720]
+        [--skip-deepface] [--recording field.frec] [--out results.json]
+        [--baseline old.json] [--threshold 0.2]
+    python -m benchmarks.bench_pipeline compare old.json new.json [--threshold 0.2]
+
+INFERENCE_PROCESSES=0 measures DeepFace in-process; otherwise the analyze /
+represent stages include the inference pool round trip.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+import cv2
+
+DEFAULT_RESOLUTIONS = "320x240,640x480,1024x768,1280x720"
+
+
+def load_inputs(resolutions, test_dir="test"):
+    """{label: BGR frame} for the test images and synthetic frames per resolution."""
+    images = [cv2.imread(p) for p in sorted(glob.glob(os.path.join(test_dir, "*.png")))]
+    images = [img for img in images if img is not None]
+    inputs = {f"test/{i + 1}": img for i, img in enumerate(images)}
+    rng = np.random.default_rng(0)
+    for w, h in resolutions:
+        if images:
+            # A real face scaled to the resolution, plus sensor-like noise
+            frame = cv2.resize(images[0], (w, h), interpolation=cv2.INTER_AREA)
+            noise = rng.integers(-8, 9, frame.shape, dtype=np.int16)
+            frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        else:
+            frame = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        inputs[f"synthetic/{w}x{h}"] = frame
+    return inputs
+
+
+def summarize(samples):
+    """Stats of a list of durations (seconds)."""
+    arr = np.asarray(samples) * 1000.0
+    total = float(np.sum(arr)) / 1000.0
+    return {
+        "n": len(samples),
+        "mean_ms": round(float(np.mean(arr)), 4),
+        "p50_ms": round(float(np.percentile(arr, 50)), 4),
+        "p99_ms": round(float(np.percentile(arr, 99)), 4),
+        "max_ms": round(float(np.max(arr)), 4),
+        "per_s": round(len(samples) / total, 2) if total > 0 else None,
+    }
+
+
+def measure(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def run(iterations=50, resolutions=DEFAULT_RESOLUTIONS, skip_deepface=False, registry_size=1000,
+        recording=None):
+    from modules import camera, face_analysis
+    from modules.config import ANALYSIS_INTERVAL
+    from modules.face_analysis import (
+        EMOTION_KEYS, EmotionHistory, FaceRegistry, TemporalSmoother, preprocess_face,
+        get_average_emotions, analyze_emotions, get_face_embedding,
+    )
+    from modules.session import SourceSession
+
+    sizes = [tuple(int(v) for v in r.split("x")) for r in resolutions.split(",") if r]
+    inputs = load_inputs(sizes)
+    rng = np.random.default_rng(1)
+    results = {}
+
+    def record(name, stats):
+        results[name] = stats
+        print(f"  {name:<36} p50 {stats['p50_ms']:9.3f} ms  p99 {stats['p99_ms']:9.3f} ms  "
+              f"{stats['per_s'] or 0:10.1f}/s")
+
+    # Frame-independent stages
+    history = EmotionHistory()
+    for _ in range(history.size):
+        history.append(rng.dirichlet(np.ones(len(EMOTION_KEYS))) * 100.0)
+    record("average", measure(lambda: get_average_emotions(history), iterations * 20))
+
+    smoother = TemporalSmoother()
+    vectors = rng.dirichlet(np.ones(len(EMOTION_KEYS)), size=64)
+    counter = iter(range(10 ** 9))
+    record("smoother", measure(lambda: smoother.update(vectors[next(counter) % 64]), iterations * 20))
+    smoother.close()
+
+    registry = FaceRegistry()
+    for i, emb in enumerate(rng.normal(size=(registry_size, 128))):
+        registry.register(f"p{i}", emb)
+    probe = rng.normal(size=128)
+    record(f"registry_match@{registry_size}", measure(lambda: registry.match(probe), iterations * 20))
+
+    # Frame stages
+    mesh = camera.mp_face_mesh.FaceMesh(refine_landmarks=True, max_num_faces=1)
+    avg_emotions = face_analysis.vector_to_emotions_dict(vectors[0])
+    for label, frame in inputs.items():
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        h, w = frame.shape[:2]
+        tag = f"{label}:{w}x{h}" if label.startswith("test/") else label
+        record(f"preprocess@{tag}", measure(lambda: preprocess_face(frame), iterations))
+        record(f"mesh@{tag}", measure(lambda: camera.draw_face_mesh(mesh, frame.copy(), rgb), iterations))
+        record(f"overlay@{tag}", measure(lambda: (camera.draw_emotion_info(frame.copy(), "happy", avg_emotions),
+                                                 camera.draw_detection_status(frame.copy(), False)), iterations))
+        record(f"encode@{tag}", measure(lambda: cv2.imencode('.jpg', frame), iterations))
+        if not skip_deepface:
+            session_history = EmotionHistory()
+            record(f"analyze@{tag}", measure(lambda: analyze_emotions(rgb, session_history), max(5, iterations // 5)))
+            record(f"represent@{tag}", measure(lambda: get_face_embedding(rgb), max(5, iterations // 5)))
+
+    # End to end: the production frame path (danger capture would write files)
+    danger_threshold = camera.DANGER_THRESHOLD
+    camera.DANGER_THRESHOLD = float("inf")
+    try:
+        for label, frame in inputs.items():
+            if not label.startswith("synthetic/"):
+                continue
+            processor = camera.FrameProcessor(SourceSession(f"bench-{label}"), mesh=mesh)
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+            def frame_path():
+                work = frame.copy()
+                processor.process(work, rgb, not skip_deepface)
+                cv2.imencode('.jpg', work)
+
+            record(f"end_to_end@{label}", measure(frame_path, max(ANALYSIS_INTERVAL * 3, iterations)))
+
+        if recording:
+            # The same footage on every build: one pass over the whole recording
+            from modules.recording import ReplaySource
+            replay = ReplaySource(recording, speed=0)
+            processor = camera.FrameProcessor(SourceSession(replay.source_id), mesh=mesh)
+            samples = []
+            for _ts, jpeg in replay.player():
+                start = time.perf_counter()
+                frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                processor.process(frame, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), not skip_deepface)
+                cv2.imencode('.jpg', frame)
+                samples.append(time.perf_counter() - start)
+            record(f"replay@{os.path.basename(recording)}", summarize(samples))
+            replay.close()
+    finally:
+        camera.DANGER_THRESHOLD = danger_threshold
+    return results
+
+
+def machine_info():
+    from modules import config
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "inference_processes": config.INFERENCE_PROCESSES,
+        "analysis_interval": config.ANALYSIS_INTERVAL,
+    }
+
+
+def compare(baseline, current, threshold=0.2, thresholds=None):
+    """Returns [(stage, baseline p50, current p50, ratio)] of stages slower than allowed.
+
+    `thresholds` overrides the relative threshold per stage name prefix
+    (e.g. {"analyze": 0.5} for the noisier DeepFace stages).
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base or not base["p50_ms"]:
+            continue
+        limit = thresholds.get(name.split("@")[0], threshold)
+        ratio = stats["p50_ms"] / base["p50_ms"]
+        if ratio > 1.0 + limit:
+            regressions.append((name, base["p50_ms"], stats["p50_ms"], ratio))
+    return regressions
+
+
+def print_comparison(baseline, current, threshold, thresholds=None):
+    print(f"{'stage':<38}{'base p50':>11}{'new p50':>11}{'change':>9}")
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if base and base["p50_ms"]:
+            change = stats["p50_ms"] / base["p50_ms"] - 1.0
+            print(f"{name:<38}{base['p50_ms']:>10.3f} {stats['p50_ms']:>10.3f} {change:>+8.1%}")
+    regressions = compare(baseline, current, threshold, thresholds)
+    for name, base, new, ratio in regressions:
+        print(f"❌ {name}: p50 {base:.3f} -> {new:.3f} ms ({ratio - 1:+.1%})")
+    if not regressions:
+        print(f"✓ No stage regressed by more than {threshold:.0%}")
+    return regressions
+
+
+def _stage_thresholds(items):
+    return {name: float(value) for name, value in (item.split("=", 1) for item in items)}
+
+
+def _load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["compare"]:
+        parser = argparse.ArgumentParser(prog="bench_pipeline compare")
+        parser.add_argument("baseline")
+        parser.add_argument("current")
+        parser.add_argument("--threshold", type=float, default=0.2)
+        parser.add_argument("--stage-threshold", action="append", default=[], metavar="STAGE=R")
+        args = parser.parse_args(argv[1:])
+        regressions = print_comparison(_load(args.baseline), _load(args.current), args.threshold,
+                                       _stage_thresholds(args.stage_threshold))
+        return 1 if regressions else 0
+
+    parser = argparse.ArgumentParser(description="Pipeline benchmark suite")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS)
+    parser.add_argument("--skip-deepface", action="store_true", help="skip the analyze / represent stages")
+    parser.add_argument("--registry-size", type=int, default=1000)
+    parser.add_argument("--recording", default=None, help="also run end to end over this recording (.frec)")
+    parser.add_argument("--out", default=None, help="write results JSON here")
+    parser.add_argument("--baseline", default=None, help="fail on regressions against this results JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative p50 slowdown")
+    parser.add_argument("--stage-threshold", action="append", default=[], metavar="STAGE=R",
+                        help="per-stage threshold, e.g. analyze=0.5 (repeatable)")
+    args = parser.parse_args(argv)
+
+    info = machine_info()
+    print(f"commit {info['commit']}, {info['cpu_count']} cores, python {info['python']}, "
+          f"inference processes {info['inference_processes']}")
+    results = {"meta": info, "results": run(args.iterations, args.resolutions,
+                                            args.skip_deepface, args.registry_size, args.recording)}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"✓ Results written to {args.out}")
+    if args.baseline:
+        return 1 if print_comparison(_load(args.baseline), results, args.threshold,
+                                     _stage_thresholds(args.stage_threshold)) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Microbenchmark: per-step cost of smoothing N emotion streams
+
+Compares advancing every stream of a `SmootherBank` with `update_row` (one
+call per stream, as each live source does on its own thread) against the
+batched `update(values, mask)` step over all rows, and checks that both
+produce the same outputs.
+
+Usage:
+    python -m benchmarks.bench_smoother [steps] [streams]
+"""
+import sys
+import time
+import numpy as np
+from modules.face_analysis import EMOTION_KEYS, SmootherBank
+
+
+def _bank(streams):
+    bank = SmootherBank(capacity=streams)
+    for _ in range(streams):
+        bank.acquire()
+    return bank
+
+
+def run(steps=20000, streams=16):
+    rng = np.random.default_rng(0)
+    # 64 input blocks, some rows without a new vector (mask off / all zero)
+    inputs = (rng.random((64, streams, len(EMOTION_KEYS))) ** 3).astype(np.float32)
+    masks = rng.random((64, streams)) > 0.2
+    inputs[~masks] = 0.0
+
+    rows = _bank(streams)
+    start = time.perf_counter()
+    for i in range(steps):
+        values, mask = inputs[i % 64], masks[i % 64]
+        for slot in range(streams):
+            if mask[slot]:
+                rows.update_row(slot, values[slot])
+    row_s = time.perf_counter() - start
+
+    batched = _bank(streams)
+    start = time.perf_counter()
+    for i in range(steps):
+        batched.update(inputs[i % 64], masks[i % 64])
+    batch_s = time.perf_counter() - start
+
+    # Sanity check: both paths end in the same state
+    assert np.allclose(rows._out[:streams], batched._out[:streams], atol=1e-5)
+    assert (rows._dominant[:streams] == batched._dominant[:streams]).all()
+
+    print(f"steps: {steps}, streams: {streams}")
+    print(f"update_row x N : {row_s / steps * 1e6:8.2f} µs/step")
+    print(f"update (batch) : {batch_s / steps * 1e6:8.2f} µs/step  ({row_s / batch_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 16)
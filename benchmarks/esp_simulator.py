@@ -0,0 +1,311 @@
+"""
+ESP32-CAM simulator
+
+Stand-in for the firmware in `esp_system/app_httpd.cpp`, so the remote
+camera path can be run and load-tested without hardware:
+
+    port P:     GET /capture, GET /status, GET /control?var=&val=, POST /face_mood
+    port P+1:   GET /stream  (multipart MJPEG, the firmware's port 81)
+
+`esp_client.stream_url("127.0.0.1:P")` resolves to the stream port, so the
+app, the sync/async ESP clients and `test_esp.py` can all be pointed at
+`127.0.0.1:P`. With `--port 80` the stream is on 81 like the real board.
+
+Frames come from `test/*.png` (default), an image directory or a video
+clip and are resized/encoded per the current `framesize` / `quality`
+settings. FPS, latency, jitter and failures are configurable.
+
+Usage:
+    python -m benchmarks.esp_simulator [--port 8080] [--fps 15] [--framesize 8]
+        [--source test|<dir>|<clip>] [--latency 0.02] [--jitter 0.01]
+        [--failure-rate 0.05] [--stream-drop-after 30]
+"""
+import os
+import glob
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import cv2
+import numpy as np
+
+PART_BOUNDARY = "123456789000000000000987654321"
+
+# framesize index -> (width, height), see ESP_FRAMESIZE_OPTIONS in modules/config.py
+FRAMESIZES = {
+    1: (160, 120), 2: (240, 176), 3: (176, 144), 4: (320, 240), 5: (352, 288),
+    6: (640, 480), 7: (800, 600), 8: (1024, 768), 9: (1280, 1024), 10: (1600, 1200),
+}
+
+# Settings reported by the firmware's /status handler (vflip is settable but not reported)
+DEFAULT_SETTINGS = {
+    "xclk": 20, "pixformat": 4, "framesize": 8, "quality": 12, "brightness": 0,
+    "contrast": 0, "saturation": 0, "sharpness": 0, "special_effect": 0, "wb_mode": 0,
+    "awb": 1, "awb_gain": 1, "aec": 1, "aec2": 0, "ae_level": 0, "aec_value": 204,
+    "agc": 1, "agc_gain": 0, "gainceiling": 0, "bpc": 0, "wpc": 1, "raw_gma": 1,
+    "lenc": 1, "hmirror": 0, "dcw": 1, "colorbar": 0, "led_intensity": -1, "face_detect": 0,
+}
+CONTROL_ONLY = {"vflip"}
+
+
+def load_frames(source="test", limit=300):
+    """Loads BGR frames from an image directory (png/jpg) or a video clip."""
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, "*.png")) + glob.glob(os.path.join(source, "*.jpg")))
+        frames = [f for f in (cv2.imread(p) for p in paths) if f is not None]
+    else:
+        cap = cv2.VideoCapture(source)
+        frames = []
+        while len(frames) < limit:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        # No source available: synthetic gradient frames
+        base = np.linspace(0, 255, 640, dtype=np.uint8)
+        frames = [np.dstack([np.tile(np.roll(base, i * 40), (480, 1))] * 3) for i in range(8)]
+    return frames
+
+
+class ESP32Simulator:
+    """Simulated ESP32-CAM (control server on `port`, stream server on `port + 1`)."""
+
+    def __init__(self, host="127.0.0.1", port=8080, source="test", fps=15.0, framesize=None,
+                 latency=0.0, jitter=0.0, failure_rate=0.0, stream_drop_after=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.stream_drop_after = stream_drop_after
+        self.frames = load_frames(source)
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings["vflip"] = 0
+        if framesize is not None:
+            self.settings["framesize"] = framesize
+        self.oled = {"emotion": None, "confidence": 0.0, "updates": 0}
+        self.counters = {"capture": 0, "status": 0, "control": 0, "face_mood": 0,
+                         "stream_clients": 0, "stream_frames": 0, "failures": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._jpeg_cache = {}
+        self._servers = []
+
+    # ---- simulated device ------------------------------------------------
+
+    @property
+    def address(self):
+        """Value to use as the ESP "ip" (host:port)."""
+        return f"{self.host}:{self.port}"
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _should_fail(self):
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self._count("failures")
+            return True
+        return False
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counters[key] += n
+
+    def jpeg(self, index):
+        """Encoded frame `index` for the current settings (cached)."""
+        s = self.settings
+        key = (index % len(self.frames), s["framesize"], s["quality"], s["hmirror"], s["vflip"])
+        data = self._jpeg_cache.get(key)
+        if data is None:
+            frame = self.frames[key[0]]
+            size = FRAMESIZES.get(s["framesize"], FRAMESIZES[8])
+            if (frame.shape[1], frame.shape[0]) != size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            if s["hmirror"]:
+                frame = cv2.flip(frame, 1)
+            if s["vflip"]:
+                frame = cv2.flip(frame, 0)
+            # Firmware quality: 0 (best) .. 63 (worst)
+            quality = int(np.clip(100 - s["quality"] * 1.5, 10, 95))
+            ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            data = buffer.tobytes()
+            with self._lock:
+                if len(self._jpeg_cache) > 256:
+                    self._jpeg_cache.clear()
+                self._jpeg_cache[key] = data
+        return data
+
+    def set(self, var, val):
+        """Applies a /control setting. Returns False for unknown variables."""
+        if var not in self.settings:
+            return False
+        self.settings[var] = val
+        return True
+
+    def status(self):
+        return {k: v for k, v in self.settings.items() if k not in CONTROL_ONLY}
+
+    # ---- servers ---------------------------------------------------------
+
+    def _handler(self, stream):
+        sim = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body=b"", content_type="text/html"):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _fail(self):
+                # Either an HTTP 500 or a dropped connection
+                if sim._random.random() < 0.5:
+                    self._send(500)
+                else:
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if stream:
+                    if url.path == "/stream":
+                        return self._stream()
+                    return self._send(404)
+                sim._delay()
+                if url.path in ("/capture", "/status", "/control") and sim._should_fail():
+                    return self._fail()
+                if url.path == "/capture":
+                    sim._count("capture")
+                    index = int(time.time() * sim.fps)
+                    return self._send(200, sim.jpeg(index), "image/jpeg")
+                if url.path == "/status":
+                    sim._count("status")
+                    return self._send(200, json.dumps(sim.status()).encode(), "application/json")
+                if url.path == "/control":
+                    sim._count("control")
+                    query = parse_qs(url.query)
+                    try:
+                        var, val = query["var"][0], int(query["val"][0])
+                    except (KeyError, ValueError):
+                        return self._send(404)
+                    return self._send(200 if sim.set(var, val) else 500)
+                if url.path == "/sim":
+                    with sim._lock:
+                        body = {"counters": dict(sim.counters), "oled": dict(sim.oled)}
+                    return self._send(200, json.dumps(body).encode(), "application/json")
+                return self._send(404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if stream or url.path != "/face_mood":
+                    return self._send(404)
+                sim._delay()
+                if sim._should_fail():
+                    return self._fail()
+                try:
+                    data = json.loads(body or b"{}")
+                except ValueError:
+                    data = {}
+                with sim._lock:
+                    sim.counters["face_mood"] += 1
+                    sim.oled["emotion"] = data.get("emotion", "unknown")
+                    sim.oled["confidence"] = float(data.get("confidence", 0.0))
+                    sim.oled["updates"] += 1
+                return self._send(200, b'{"status":"ok"}', "application/json")
+
+            def _stream(self):
+                sim._count("stream_clients")
+                self.close_connection = True
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/x-mixed-replace;boundary=" + PART_BOUNDARY)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                start = time.time()
+                interval = 1.0 / sim.fps if sim.fps > 0 else 0.0
+                next_time = start
+                index = 0
+                try:
+                    while True:
+                        now = time.time()
+                        if sim.stream_drop_after and now - start > sim.stream_drop_after:
+                            return
+                        jpeg = sim.jpeg(index)
+                        header = ("\r\n--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %u\r\n"
+                                  "X-Timestamp: %.6f\r\n\r\n" % (PART_BOUNDARY, len(jpeg), now))
+                        self.wfile.write(header.encode() + jpeg)
+                        sim._count("stream_frames")
+                        index += 1
+                        next_time += interval
+                        if sim.jitter:
+                            next_time += sim._random.uniform(0, sim.jitter)
+                        time.sleep(max(0.0, next_time - time.time()))
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+
+        return Handler
+
+    def start(self):
+        """Starts both servers on background threads. Returns self."""
+        for port, stream in ((self.port, False), (self.port + 1, True)):
+            server = ThreadingHTTPServer((self.host, port), self._handler(stream))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f"esp-sim-{port}", daemon=True).start()
+            self._servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESP32-CAM simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="control port (stream on port+1)")
+    parser.add_argument("--source", default="test", help="image directory or video clip")
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--framesize", type=int, default=None, help="initial framesize index (8 = XGA)")
+    parser.add_argument("--latency", type=float, default=0.0, help="added response latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency / frame interval jitter (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability of a failed request")
+    parser.add_argument("--stream-drop-after", type=float, default=0.0, help="end streams after N s")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    sim = ESP32Simulator(args.host, args.port, args.source, args.fps, args.framesize, args.latency,
+                         args.jitter, args.failure_rate, args.stream_drop_after, args.seed).start()
+    print(f"✓ ESP32 simulator: http://{sim.address} (stream http://{args.host}:{args.port + 1}/stream), "
+          f"{len(sim.frames)} frames")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
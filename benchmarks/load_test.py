@@ -0,0 +1,321 @@
+"""
+HTTP load test of a running app instance
+
+Drives concurrent `/video_feed` viewers together with `/current_emotions`,
+`/captured` and `/esp_status` pollers against a running `main.py` /
+`serve.py`, with the ESP side played by the simulator
+(benchmarks/esp_simulator.py) by default. The number of viewers is ramped
+stage by stage; for every stage it reports:
+
+- delivered FPS per viewer (median / min) and time to first frame,
+- latency percentiles and error rate per polled endpoint,
+- server CPU % and RSS (with --server-pid; psutil if installed, else /proc),
+
+and stops at the saturation point: the first stage where the median viewer
+FPS drops below --min-fps-ratio of the first stage's, the error rate
+exceeds --max-error-rate or poll p99 exceeds --max-p99.
+
+Usage:
+    python main.py &            # or: python serve.py
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --server-pid $! \\
+        [--start 1] [--step 4] [--max-viewers 64] [--stage-seconds 15] [--out load.json]
+
+`--esp host:port` uses an already running ESP (or simulator) instead of
+starting one; `--default-feed` watches `/video_feed` without `?ip=` (the
+source selected with /set_camera_source) instead of the orchestrator path.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import aiohttp
+from modules.esp_client import MJPEGParser
+
+POLL_ENDPOINTS = ("/current_emotions", "/captured", "/esp_status")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+class ProcessSampler:
+    """CPU time and RSS of the server process(es) and their children."""
+
+    def __init__(self, pids):
+        self.pids = pids
+        try:
+            import psutil
+            self._psutil = psutil
+        except ImportError:
+            self._psutil = None
+
+    def _processes(self):
+        procs = []
+        for pid in self.pids:
+            try:
+                proc = self._psutil.Process(pid)
+                procs += [proc] + proc.children(recursive=True)
+            except self._psutil.Error:
+                continue
+        return procs
+
+    def sample(self):
+        """(cpu seconds, rss bytes) summed over the processes, or None."""
+        if not self.pids:
+            return None
+        cpu = rss = 0.0
+        if self._psutil is not None:
+            for proc in self._processes():
+                try:
+                    times = proc.cpu_times()
+                    cpu += times.user + times.system
+                    rss += proc.memory_info().rss
+                except self._psutil.Error:
+                    continue
+            return cpu, rss
+        # Linux without psutil: the given pids only
+        ticks = os.sysconf("SC_CLK_TCK")
+        page = os.sysconf("SC_PAGE_SIZE")
+        for pid in self.pids:
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            rss += int(fields[21]) * page
+        return cpu, rss
+
+
+class Viewer:
+    def __init__(self, index):
+        self.index = index
+        self.frames = 0
+        self.first_frame = None
+        self.errors = 0
+        self.started = None
+
+
+class LoadTest:
+    def __init__(self, url, feed_path, esp, poll_interval=0.5, pollers=1, timeout=10.0):
+        self.url = url.rstrip("/")
+        self.feed_path = feed_path
+        # /esp_status answers 400 without the ESP to report on
+        self.poll_queries = {"/esp_status": f"?ip={esp}"}
+        self.poll_interval = poll_interval
+        self.pollers = pollers
+        self.timeout = timeout
+        self.viewers = []
+        self.latencies = {path: [] for path in POLL_ENDPOINTS}
+        self.requests = {path: 0 for path in POLL_ENDPOINTS}
+        self.errors = {path: 0 for path in POLL_ENDPOINTS}
+        self._tasks = []
+
+    async def _view(self, session, viewer):
+        while True:
+            viewer.started = time.perf_counter()
+            try:
+                timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+                async with session.get(self.url + self.feed_path, timeout=timeout) as r:
+                    if r.status != 200:
+                        raise aiohttp.ClientResponseError(r.request_info, (), status=r.status)
+                    parser = MJPEGParser()
+                    async for chunk in r.content.iter_any():
+                        n = len(parser.feed(chunk))
+                        if n:
+                            if viewer.first_frame is None:
+                                viewer.first_frame = time.perf_counter() - viewer.started
+                            viewer.frames += n
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                viewer.errors += 1
+                await asyncio.sleep(0.5)
+
+    async def _poll(self, session, path):
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        while True:
+            start = time.perf_counter()
+            try:
+                async with session.get(self.url + path + self.poll_queries.get(path, ""), timeout=timeout) as r:
+                    await r.read()
+                    ok = 200 <= r.status < 300
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            self.requests[path] += 1
+            if ok:
+                self.latencies[path].append(time.perf_counter() - start)
+            else:
+                self.errors[path] += 1
+            await asyncio.sleep(max(0.0, self.poll_interval - (time.perf_counter() - start)))
+
+    def add_viewers(self, session, n):
+        for _ in range(n):
+            viewer = Viewer(len(self.viewers))
+            self.viewers.append(viewer)
+            self._tasks.append(asyncio.ensure_future(self._view(session, viewer)))
+
+    def start_pollers(self, session):
+        for path in POLL_ENDPOINTS:
+            for _ in range(self.pollers):
+                self._tasks.append(asyncio.ensure_future(self._poll(session, path)))
+
+    def snapshot(self):
+        return {
+            "frames": [v.frames for v in self.viewers],
+            "viewer_errors": sum(v.errors for v in self.viewers),
+            "latency_index": {p: len(l) for p, l in self.latencies.items()},
+            "requests": dict(self.requests),
+            "errors": dict(self.errors),
+        }
+
+    def stage_report(self, before, elapsed):
+        """Stats of the stage since the `before` snapshot."""
+        frames = [v.frames - (before["frames"][v.index] if v.index < len(before["frames"]) else 0)
+                  for v in self.viewers]
+        fps = [f / elapsed for f in frames]
+        polls = {}
+        total_requests = total_errors = 0
+        for path in POLL_ENDPOINTS:
+            latencies = self.latencies[path][before["latency_index"][path]:]
+            requests = self.requests[path] - before["requests"][path]
+            errors = self.errors[path] - before["errors"][path]
+            total_requests += requests
+            total_errors += errors
+            polls[path] = {
+                "requests": requests,
+                "errors": errors,
+                "p50_ms": _ms(percentile(latencies, 50)),
+                "p95_ms": _ms(percentile(latencies, 95)),
+                "p99_ms": _ms(percentile(latencies, 99)),
+            }
+        first = [v.first_frame for v in self.viewers if v.first_frame is not None]
+        viewer_errors = sum(v.errors for v in self.viewers) - before["viewer_errors"]
+        return {
+            "viewers": len(self.viewers),
+            "fps_median": round(statistics.median(fps), 2) if fps else 0.0,
+            "fps_min": round(min(fps), 2) if fps else 0.0,
+            "first_frame_p50_ms": _ms(percentile(first, 50)),
+            "viewer_errors": viewer_errors,
+            "polls": polls,
+            "error_rate": round((total_errors + viewer_errors) / max(1, total_requests + len(self.viewers)), 4),
+            "poll_p99_ms": max((p["p99_ms"] or 0.0) for p in polls.values()),
+        }
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000.0, 2)
+
+
+async def ramp(args, feed_path, esp):
+    test = LoadTest(args.url, feed_path, esp, args.poll_interval, args.pollers)
+    sampler = ProcessSampler(args.server_pid)
+    connector = aiohttp.TCPConnector(limit=0)
+    stages = []
+    saturated = None
+    async with aiohttp.ClientSession(connector=connector) as session:
+        test.start_pollers(session)
+        target = args.start
+        baseline_fps = None
+        try:
+            while target <= args.max_viewers:
+                test.add_viewers(session, target - len(test.viewers))
+                # Let the new viewers connect before measuring
+                await asyncio.sleep(min(3.0, args.stage_seconds / 3))
+                before, cpu_before, t0 = test.snapshot(), sampler.sample(), time.perf_counter()
+                await asyncio.sleep(args.stage_seconds)
+                elapsed = time.perf_counter() - t0
+                report = test.stage_report(before, elapsed)
+                cpu_after = sampler.sample()
+                if cpu_before and cpu_after:
+                    report["server_cpu_percent"] = round((cpu_after[0] - cpu_before[0]) / elapsed * 100.0, 1)
+                    report["server_rss_mb"] = round(cpu_after[1] / 2 ** 20, 1)
+                stages.append(report)
+                _print_stage(report)
+
+                if baseline_fps is None:
+                    baseline_fps = report["fps_median"]
+                reasons = []
+                if baseline_fps and report["fps_median"] < baseline_fps * args.min_fps_ratio:
+                    reasons.append(f"median FPS {report['fps_median']} < {args.min_fps_ratio:.0%} of {baseline_fps}")
+                if report["error_rate"] > args.max_error_rate:
+                    reasons.append(f"error rate {report['error_rate']:.1%}")
+                if report["poll_p99_ms"] > args.max_p99 * 1000.0:
+                    reasons.append(f"poll p99 {report['poll_p99_ms']} ms")
+                if reasons:
+                    saturated = {"viewers": report["viewers"], "reasons": reasons}
+                    break
+                target += args.step
+        finally:
+            test.cancel()
+    return stages, saturated
+
+
+def _print_stage(r):
+    cpu = f"cpu {r['server_cpu_percent']:6.1f}%  rss {r['server_rss_mb']:7.1f} MB" if "server_cpu_percent" in r else ""
+    polls = "  ".join(f"{path.strip('/')} p99 {p['p99_ms']} ms" for path, p in r["polls"].items())
+    print(f"viewers {r['viewers']:4d}  fps med {r['fps_median']:6.2f} min {r['fps_min']:6.2f}  "
+          f"errors {r['error_rate']:.1%}  {polls}  {cpu}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP load test (viewers + pollers, ramped)")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="app base URL")
+    parser.add_argument("--esp", default=None, help="ESP host:port to use (default: start a simulator)")
+    parser.add_argument("--sim-port", type=int, default=8090)
+    parser.add_argument("--sim-fps", type=float, default=15.0)
+    parser.add_argument("--default-feed", action="store_true", help="watch /video_feed without ?ip=")
+    parser.add_argument("--start", type=int, default=1, help="viewers in the first stage")
+    parser.add_argument("--step", type=int, default=4, help="viewers added per stage")
+    parser.add_argument("--max-viewers", type=int, default=64)
+    parser.add_argument("--stage-seconds", type=float, default=15.0)
+    parser.add_argument("--pollers", type=int, default=1, help="pollers per endpoint")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--server-pid", type=int, action="append", default=[], help="repeatable")
+    parser.add_argument("--min-fps-ratio", type=float, default=0.8)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--max-p99", type=float, default=1.0, help="poll p99 limit (s)")
+    parser.add_argument("--out", default=None, help="write stages JSON here")
+    args = parser.parse_args(argv)
+
+    sim = None
+    esp = args.esp
+    if esp is None:
+        from benchmarks.esp_simulator import ESP32Simulator
+        sim = ESP32Simulator(port=args.sim_port, fps=args.sim_fps).start()
+        esp = sim.address
+        print(f"✓ ESP32 simulator on {esp} ({args.sim_fps} fps)")
+    try:
+        if args.default_feed:
+            import requests
+            requests.post(f"{args.url.rstrip('/')}/set_camera_source", json={"mode": "esp", "ip": esp}, timeout=5)
+            feed_path = "/video_feed"
+        else:
+            feed_path = f"/video_feed?ip={esp}"
+        stages, saturated = asyncio.run(ramp(args, feed_path, esp))
+    finally:
+        if sim is not None:
+            sim.stop()
+
+    if saturated:
+        print(f"⚠️ Saturated at {saturated['viewers']} viewers: {', '.join(saturated['reasons'])}")
+    else:
+        print(f"✓ No saturation up to {stages[-1]['viewers'] if stages else 0} viewers")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"url": args.url, "esp": esp, "feed": feed_path, "stages": stages,
+                       "saturated": saturated}, f, indent=2)
+        print(f"✓ Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
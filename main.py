@@ -5,20 +5,41 @@ Flask Web Application - Main file
 Face recognition and emotion detection system
 """
 from flask import Flask, render_template, Response, jsonify, request
-import cv2
-from modules.config import latest_state
+import os
+import sys
+import json
+from datetime import datetime
 from modules.camera import camera_stream
-from modules.storage import load_existing_faces, get_captured_images
+from modules.session import sessions
+from modules.orchestrator import orchestrator
+from modules.oled import oled_sender
+from modules.health import device_monitor
+from modules.pipeline_service import frame_source
+from modules.storage import (
+    load_existing_faces, get_captured_images, read_captured_image, read_captured_meta,
+    start_capture_maintenance
+)
+from modules.config import THUMBNAIL_WIDTHS, ESP_PRESETS, ESP32_OLED_URL, SERVER_HOST, SERVER_PORT
+from modules.http_views import (
+    MJPEG_MIMETYPE, emotion_payload, snapshot_response, emotion_event_stream
+)
 from modules import esp_client
+from modules import thumbnails
 from modules import face_analysis
+from modules import metrics
+from modules.tracing import tracer
+from modules.recording import recorder, recording_path, ReplaySource
+from modules.event_log import get_event_log, KINDS as EVENT_KINDS
+from modules.output_profiles import viewer_quality
 
 app = Flask(__name__)
 
 # Load registered persons on application startup
 load_existing_faces()
+start_capture_maintenance()
+thumbnails.schedule_backfill()
+orchestrator.load_config()
 
-# ESP32 OLED target URL - will be set by user
-ESP32_OLED_URL = None
 
 
 
@@ -38,141 +59,20 @@ def video_feed():
     """Video stream endpoint"""
     # Optional query parameter `ip` allows the frontend to request the
     # stream from an ESP32 / IP camera (e.g. http://<ip>:81/stream).
+    # All viewers of one camera share its orchestrator pipeline.
+    # ?profile= / ?scale= / ?quality= / ?max_fps= pick the viewer's output
+    # quality (modules/output_profiles.py, adaptive by default).
+    try:
+        viewer = viewer_quality(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     ip = request.args.get('ip')
     if ip:
-        # Import necessary modules for processing
-        import time
-        import numpy as np
-        import mediapipe as mp
-        from modules.config import ANALYSIS_INTERVAL, DANGER_THRESHOLD, emotion_labels, latest_state
-        from modules.face_analysis import (
-            analyze_emotions, get_average_emotions, calculate_danger_score,
-            get_face_embedding, is_registered_dangerous_person, register_dangerous_person,
-            TemporalSmoother, emotions_dict_to_vector, vector_to_emotions_dict
-        )
-        from modules.storage import save_dangerous_person
-        import uuid
-        
-        # MediaPipe Face Mesh (local instance for this generator)
-        mp_face_mesh = mp.solutions.face_mesh
-        face_mesh_local = mp_face_mesh.FaceMesh(refine_landmarks=True, max_num_faces=1)
-        mp_drawing = mp.solutions.drawing_utils
-        
-        # Temporal smoother - iyileştirilmiş parametrelerle
-        emotion_smoother = TemporalSmoother(maxlen=10, ema_alpha=0.7)
-        last_danger_check = 0
-        
-        url = f'http://{ip}:81/stream'
-
-        def gen_from_ip_with_analysis():
-            nonlocal last_danger_check
-            cap = cv2.VideoCapture(url)
-            frame_count = 0
-            
-            try:
-                while True:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    
-                    # Convert to RGB for analysis
-                    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Draw face mesh
-                    results = face_mesh_local.process(rgb)
-                    if results.multi_face_landmarks:
-                        for face_landmarks in results.multi_face_landmarks:
-                            mp_drawing.draw_landmarks(
-                                image=frame,
-                                landmark_list=face_landmarks,
-                                connections=mp_face_mesh.FACEMESH_TESSELATION,
-                                landmark_drawing_spec=None,
-                                connection_drawing_spec=mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=1)
-                            )
-                    
-                    # Perform emotion analysis at intervals
-                    if camera_stream.is_detection_enabled() and frame_count % ANALYSIS_INTERVAL == 0:
-                        analyze_emotions(rgb)
-                    
-                    # Get average emotions
-                    avg_emotions, main_emotion = get_average_emotions()
-                    
-                    # Apply temporal smoothing
-                    if avg_emotions:
-                        vec = emotions_dict_to_vector(avg_emotions)
-                        smoothed = emotion_smoother.update(vec)
-                        if smoothed is not None:
-                            avg_emotions = vector_to_emotions_dict(smoothed)
-                            main_emotion = max(avg_emotions, key=avg_emotions.get)
-                    
-                    # Calculate danger score
-                    danger_score = calculate_danger_score(avg_emotions)
-                    danger = camera_stream.is_detection_enabled() and (danger_score > DANGER_THRESHOLD)
-                    
-                    # Update latest state
-                    latest_state["timestamp"] = time.strftime("%Y%m%d-%H%M%S")
-                    latest_state["emotions"] = avg_emotions if avg_emotions else None
-                    latest_state["main_emotion"] = main_emotion
-                    latest_state["danger_score"] = float(danger_score)
-                    
-                    # Send emotion to ESP32 OLED if URL is configured
-                    if main_emotion and avg_emotions and face_analysis.ESP32_TARGET_URL:
-                        confidence = avg_emotions.get(main_emotion, 0) / 100.0
-                        face_analysis.send_emotion_to_esp32(main_emotion, confidence)
-                    
-                    # Draw emotion info on frame
-                    y0 = 30
-                    if avg_emotions and main_emotion:
-                        emotion_text = f"Baskin Duygu: {emotion_labels.get(main_emotion, main_emotion)} ({avg_emotions.get(main_emotion, 0):.1f}%)"
-                        cv2.putText(frame, emotion_text, (10, y0), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                    
-                    # Draw detection status
-                    if not camera_stream.is_detection_enabled():
-                        cv2.putText(frame, "ALGILAMA KAPALI", (10, y0 + 60), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 1.0, (128, 128, 128), 3)
-                    
-                    # Handle danger detection
-                    if danger:
-                        current_time = time.time()
-                        if current_time - last_danger_check > 5:
-                            face_embedding = get_face_embedding(rgb)
-                            is_registered, existing_id = is_registered_dangerous_person(face_embedding)
-                            
-                            if not is_registered and face_embedding is not None:
-                                person_id = str(uuid.uuid4())[:8]
-                                timestamp = time.strftime("%Y%m%d-%H%M%S")
-                                save_dangerous_person(person_id, timestamp, frame, avg_emotions)
-                                register_dangerous_person(person_id, face_embedding)
-                                cv2.putText(frame, f"DANGEROUS PERSON! (NEW: {person_id})", (10, y0 + 60), 
-                                           cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 3)
-                            elif is_registered:
-                                print(f"✓ Registered dangerous person detected: {existing_id}")
-                                cv2.putText(frame, f"REGISTERED DANGEROUS PERSON: {existing_id}", (10, y0 + 60), 
-                                           cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 140, 255), 3)
-                            else:
-                                cv2.putText(frame, "DANGEROUS - Face not recognized", (10, y0 + 60), 
-                                           cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 3)
-                            last_danger_check = current_time
-                        else:
-                            cv2.putText(frame, "DANGEROUS PERSON!", (10, y0 + 60), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
-                    
-                    # Encode and yield frame
-                    ret2, buffer = cv2.imencode('.jpg', frame)
-                    frame_bytes = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                    
-                    frame_count += 1
-                    
-            finally:
-                cap.release()
-
-        return Response(gen_from_ip_with_analysis(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        source = orchestrator.ensure_stream(ip)
+        return Response(source.stream(viewer), mimetype=MJPEG_MIMETYPE)
 
     # Fall back to the local / default camera stream with analysis
-    return Response(camera_stream.generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(camera_stream.generate_frames(viewer), mimetype=MJPEG_MIMETYPE)
 
 
 @app.route('/captured')
@@ -182,11 +82,106 @@ def get_captured():
     return jsonify(images)
 
 
+@app.route('/captured/<path:name>')
+def get_captured_file(name):
+    """Serves a captured image (.jpg) or its metadata (.json).
+
+    Works for both capture backends.
+    """
+    if name.endswith('.json'):
+        data = read_captured_meta(name)
+        if data is None:
+            return jsonify({"error": "not found"}), 404
+        return jsonify(data)
+
+    image = read_captured_image(name)
+    if image is None:
+        return jsonify({"error": "not found"}), 404
+    return Response([image], mimetype='image/jpeg',
+                    headers={'Content-Length': str(len(image))})
+
+
+def _parse_time(value):
+    """Unix seconds or an ISO 8601 time (local time if no offset)."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+@app.route('/events')
+def get_events():
+    """Danger events from the event log, oldest first.
+
+    Query params: ?since= / ?until= (unix seconds or ISO 8601, until is
+    exclusive), ?person=<id>, ?source=<id>, ?kind=new|sighting|unrecognized|peak,
+    ?limit= (default 1000, max 10000).
+    """
+    try:
+        since = _parse_time(request.args['since']) if request.args.get('since') else None
+        until = _parse_time(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({"error": "since / until must be unix seconds or ISO 8601"}), 400
+    kind = request.args.get('kind')
+    if kind and kind not in EVENT_KINDS:
+        return jsonify({"error": f"kind must be one of {', '.join(EVENT_KINDS)}"}), 400
+    limit = min(max(request.args.get('limit', default=1000, type=int), 1), 10000)
+    events, total = get_event_log().query(since, until, request.args.get('person'),
+                                          request.args.get('source'), kind, limit)
+    return jsonify({"events": events, "count": len(events), "total": total, "truncated": total > len(events)})
+
+
+@app.route('/thumbnail/<int:width>/<path:name>')
+def get_thumbnail(width, name):
+    """Serves a capture thumbnail at one of the fixed THUMBNAIL_WIDTHS.
+
+    Captures never change once saved, so thumbnails are served with a
+    long-lived immutable cache header and an ETag.
+    """
+    if width not in THUMBNAIL_WIDTHS:
+        return jsonify({"error": f"width must be one of {list(THUMBNAIL_WIDTHS)}"}), 400
+
+    etag = f'"{name}@{width}"'
+    cache_headers = {
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'ETag': etag,
+    }
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers=cache_headers)
+
+    data = thumbnails.get_thumbnail(name, width)
+    if data is None:
+        return jsonify({"error": "not found"}), 404
+    cache_headers['Content-Length'] = str(len(data))
+    return Response([data], mimetype='image/jpeg', headers=cache_headers)
+
+
+@app.route('/snapshot.jpg')
+def snapshot():
+    """Latest annotated frame of the default stream (/video_feed)."""
+    return snapshot_response(*frame_source())
+
+
+@app.route('/snapshot/<source>.jpg')
+def source_snapshot(source):
+    """Latest annotated frame of one source ("local" or an ESP IP).
+
+    Unknown ESP IPs are started as on-demand orchestrator sources, so
+    polling this endpoint keeps one shared pipeline alive.
+    """
+    try:
+        return snapshot_response(*frame_source(source))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+
+
 @app.route('/set_camera_source', methods=['POST'])
 def set_camera_source():
-    """Switch camera source between 'local' and 'esp'.
+    """Switch camera source between 'local', 'esp' and 'replay'.
 
     JSON body: {"mode": "esp"|"local", "ip": "10.0.0.12"}
+    or {"mode": "replay", "name": "<recording>", "speed": 1.0, "loop": false}
+    (speed N plays N times faster, 0 as fast as possible).
     """
     try:
         payload = request.get_json(silent=True) or {}
@@ -201,8 +196,23 @@ def set_camera_source():
         elif mode == 'local':
             camera_stream.clear_remote_ip()
             return jsonify({"mode": "local"}), 200
+        elif mode == 'replay':
+            name = payload.get('name')
+            if not name:
+                return jsonify({"error": "name required for mode 'replay'"}), 400
+            path = recording_path(name)
+            if not os.path.exists(path):
+                return jsonify({"error": f"Unknown recording: {name}"}), 404
+            try:
+                replay = ReplaySource(path, speed=float(payload.get('speed', 1.0)), loop=bool(payload.get('loop')))
+            except ValueError as e:
+                # Empty recording or invalid speed
+                return jsonify({"error": str(e)}), 400
+            camera_stream.clear_remote_ip()
+            camera_stream.set_replay(replay)
+            return jsonify({"mode": "replay", **replay.status()}), 200
         else:
-            return jsonify({"error": "mode must be 'esp' or 'local'"}), 400
+            return jsonify({"error": "mode must be 'esp', 'local' or 'replay'"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -221,6 +231,8 @@ def esp_command():
         if not ip:
             return jsonify({"error": "No ESP ip configured or provided"}), 400
         status, body = esp_client.send_command(ip, params)
+        if params.get('var'):
+            esp_client.status_cache.invalidate(ip)
         return jsonify({"status": status, "body": body}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -230,7 +242,9 @@ def esp_command():
 def esp_status():
     """Get current ESP camera status and settings.
     
-    Query param: ?ip=<esp_ip>
+    Query param: ?ip=<esp_ip>, ?fresh=1 bypasses the cache.
+    Answers from a short TTL cache (ESP_STATUS_TTL); concurrent requests for
+    the same ESP share one device request.
     """
     try:
         ip = request.args.get('ip')
@@ -239,9 +253,11 @@ def esp_status():
         if not ip:
             return jsonify({"error": "No ESP ip configured or provided"}), 400
         
-        status, settings = esp_client.get_status(ip)
+        if request.args.get('fresh') == '1':
+            esp_client.status_cache.invalidate(ip)
+        status, settings, age = esp_client.status_cache.get(ip)
         if status == 200 and settings:
-            return jsonify({"status": "success", "settings": settings}), 200
+            return jsonify({"status": "success", "settings": settings, "age": round(age, 2)}), 200
         else:
             return jsonify({"error": "Failed to get ESP status", "status_code": status}), 500
     except Exception as e:
@@ -250,21 +266,25 @@ def esp_status():
 
 @app.route('/esp_apply_preset', methods=['POST'])
 def esp_apply_preset():
-    """Apply optimal camera settings preset for emotion analysis.
+    """Apply a named camera settings preset (default: emotion analysis).
     
-    JSON body: {"ip": "optional ip"}
+    JSON body: {"ip": "optional ip", "preset": "emotion_analysis"}
+    Only settings that differ from the camera's /status are sent.
     """
     try:
         payload = request.get_json(silent=True) or {}
         ip = payload.get('ip') or camera_stream.remote_ip
         if not ip:
             return jsonify({"error": "No ESP ip configured or provided"}), 400
+        preset = payload.get('preset') or 'emotion_analysis'
+        if preset not in ESP_PRESETS:
+            return jsonify({"error": f"Unknown preset: {preset}", "presets": list(ESP_PRESETS)}), 400
         
-        success = esp_client.apply_emotion_analysis_preset(ip)
-        if success:
-            return jsonify({"status": "success", "message": "Optimal settings applied"}), 200
+        result = esp_client.apply_preset(ip, preset)
+        if result["success"]:
+            return jsonify({"status": "success", "message": "Optimal settings applied", **result}), 200
         else:
-            return jsonify({"error": "Some settings failed to apply"}), 500
+            return jsonify({"error": "Some settings failed to apply", **result}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -293,27 +313,149 @@ def status():
 
 @app.route('/current_emotions')
 def current_emotions():
-    """Returns current emotion data."""
-    data = {
-        "enabled": camera_stream.is_detection_enabled(),
-        "timestamp": latest_state.get("timestamp"),
-        "emotions": latest_state.get("emotions"),
-        "main_emotion": latest_state.get("main_emotion"),
-        "danger_score": latest_state.get("danger_score"),
-    }
-    return jsonify(data)
+    """Returns current emotion data.
+
+    Query param: ?source=<id> ("local" or an ESP IP). Defaults to the
+    source selected with /set_camera_source.
+    """
+    source = request.args.get('source') or camera_stream.source_id
+    session = sessions.get(source)
+    if session is None and request.args.get('source'):
+        return jsonify({"error": f"Unknown source: {source}"}), 404
+    return jsonify(emotion_payload(source, session.latest_state if session else None,
+                                   camera_stream.is_detection_enabled()))
+
+
+@app.route('/emotions/stream')
+def emotions_stream():
+    """Server-Sent Events stream of emotion / danger updates.
+
+    Query params: ?source=<id> (default: selected source, 404 if unknown),
+    ?max_rate=<Hz> (capped at SSE_MAX_RATE). An event (same JSON as
+    /current_emotions) is sent when the state visibly changes; updates
+    arriving faster than max_rate are coalesced into the latest one.
+    """
+    if request.args.get('source'):
+        source = request.args['source']
+        session = sessions.get(source)
+        if session is None:
+            return jsonify({"error": f"Unknown source: {source}"}), 404
+    else:
+        source = camera_stream.source_id
+        session = sessions.get_or_create(source)
+
+    def wait_state(after_seq, timeout):
+        seq = session.wait_state(after_seq, timeout)
+        return seq, emotion_payload(source, session.latest_state, camera_stream.is_detection_enabled())
+
+    return emotion_event_stream(wait_state)
+
+
+@app.route('/sessions')
+def list_sessions():
+    """Lists active source sessions and their latest state."""
+    return jsonify({
+        source_id: {
+            "oled_url": session.oled_target,
+            **session.latest_state,
+        }
+        for source_id, session in sessions.items()
+    })
+
+
+@app.route('/cameras', methods=['GET'])
+def list_cameras():
+    """Health of all camera sources plus aggregate FPS / analysis rate."""
+    return jsonify(orchestrator.health())
+
+
+@app.route('/devices', methods=['GET'])
+def list_devices():
+    """ESP device health (state, RTT, FPS) and recent state transitions.
+
+    Query param: ?since=<unix time> only returns newer transitions.
+    """
+    since = request.args.get('since', type=float, default=0.0)
+    return jsonify({
+        "devices": device_monitor.status(),
+        "events": device_monitor.recent_events(since),
+    })
+
+
+@app.route('/cameras', methods=['POST'])
+def add_camera():
+    """Adds (and starts) a camera source.
+
+    JSON body: {"ip": "10.0.0.12", "name": "optional", "priority": 1.0, "start": true}
+    """
+    try:
+        payload = request.get_json(silent=True) or {}
+        ip = payload.get('ip')
+        if not ip:
+            return jsonify({"error": "ip required"}), 400
+        try:
+            priority = float(payload.get('priority', 1.0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "priority must be a number"}), 400
+        if priority <= 0:
+            return jsonify({"error": "priority must be > 0"}), 400
+        source = orchestrator.add_source(ip, name=payload.get('name'), priority=priority,
+                                         start=payload.get('start', True))
+        return jsonify(source.health()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/cameras/<ip>/start', methods=['POST'])
+def start_camera(ip):
+    """Starts a configured camera source."""
+    source = orchestrator.get(ip)
+    if source is None:
+        return jsonify({"error": f"Unknown camera: {ip}"}), 404
+    source.start()
+    return jsonify(source.health()), 200
+
+
+@app.route('/cameras/<ip>/stop', methods=['POST'])
+def stop_camera(ip):
+    """Stops a camera source (it stays configured)."""
+    source = orchestrator.get(ip)
+    if source is None:
+        return jsonify({"error": f"Unknown camera: {ip}"}), 404
+    source.stop()
+    return jsonify(source.health()), 200
+
+
+@app.route('/cameras/<ip>', methods=['DELETE'])
+def remove_camera(ip):
+    """Stops and removes a camera source."""
+    if orchestrator.remove_source(ip) is None:
+        return jsonify({"error": f"Unknown camera: {ip}"}), 404
+    return jsonify({"status": "success", "removed": ip}), 200
+
+
+def _forget_oled_url(url):
+    """Drops the OLED sender state of `url` once no session sends to it anymore."""
+    if not url or url == face_analysis.ESP32_TARGET_URL:
+        return
+    if any(session.oled_url == url for _, session in sessions.items()):
+        return
+    oled_sender.forget(url)
 
 
 @app.route('/set_esp32_oled_url', methods=['POST'])
 def set_esp32_oled_url():
     """Set ESP32 OLED display target URL for emotion transmission.
     
-    JSON body: {"url": "http://10.64.220.189:2711/face_mood"}
+    JSON body: {"url": "http://10.64.220.189:2711/face_mood", "source": "optional id"}
     If url is empty or null, emotion transmission will be disabled.
+    Without "source" the default target (used by all sessions without their
+    own target) is changed.
     """
     try:
         payload = request.get_json(silent=True) or {}
-        url = payload.get('url', '').strip()
+        url = (payload.get('url') or '').strip()
+        source = payload.get('source')
         
         if url:
             # Validate URL format
@@ -323,14 +465,27 @@ def set_esp32_oled_url():
             if not '/face_mood' in url:
                 return jsonify({"error": "URL must contain /face_mood endpoint"}), 400
             
-            face_analysis.set_esp32_target_url(url)
+            if source:
+                session = sessions.get_or_create(source)
+                old_url, session.oled_url = session.oled_url, url
+            else:
+                old_url = face_analysis.ESP32_TARGET_URL
+                face_analysis.set_esp32_target_url(url)
+            if old_url != url:
+                _forget_oled_url(old_url)
             return jsonify({
                 "status": "success",
                 "message": "ESP32 OLED URL ayarlandı",
                 "url": url
             }), 200
         else:
-            face_analysis.set_esp32_target_url(None)
+            if source:
+                session = sessions.get_or_create(source)
+                old_url, session.oled_url = session.oled_url, None
+            else:
+                old_url = face_analysis.ESP32_TARGET_URL
+                face_analysis.set_esp32_target_url(None)
+            _forget_oled_url(old_url)
             return jsonify({
                 "status": "success",
                 "message": "ESP32 OLED iletimi devre dışı bırakıldı"
@@ -342,13 +497,106 @@ def set_esp32_oled_url():
 
 @app.route('/get_esp32_oled_url', methods=['GET'])
 def get_esp32_oled_url():
-    """Get current ESP32 OLED target URL."""
+    """Get current ESP32 OLED target URL.
+
+    Query param: ?source=<id> returns the effective target of that source.
+    """
+    source = request.args.get('source')
+    session = sessions.get(source) if source else None
+    url = session.oled_target if session else face_analysis.ESP32_TARGET_URL
     return jsonify({
-        "url": face_analysis.ESP32_TARGET_URL,
-        "enabled": face_analysis.ESP32_TARGET_URL is not None
+        "url": url,
+        "enabled": url is not None
     })
 
 
+@app.route('/oled_stats', methods=['GET'])
+def oled_stats():
+    """Per-target OLED delivery counters (sent / skipped / failed)."""
+    return jsonify(oled_sender.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Pipeline counters and latency histograms in Prometheus text format."""
+    for source in orchestrator.sources():
+        metrics.VIEWERS.set(source.viewers, source=source.ip)
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+
+@app.route('/admin/trace/start', methods=['POST'])
+def trace_start():
+    """Starts per-frame span recording. Query: ?seconds=<auto stop>."""
+    tracer.start(seconds=request.args.get('seconds', type=float))
+    return jsonify(tracer.status())
+
+
+@app.route('/admin/trace/stop', methods=['POST'])
+def trace_stop():
+    tracer.stop()
+    return jsonify(tracer.status())
+
+
+@app.route('/admin/trace', methods=['GET'])
+def trace_download():
+    """Recorded spans as Chrome / Perfetto trace JSON (?status=1 for the recorder state)."""
+    if request.args.get('status'):
+        return jsonify(tracer.status())
+    return Response(json.dumps(tracer.chrome_trace()), mimetype='application/json',
+                    headers={'Content-Disposition': 'attachment; filename=trace.json'})
+
+
+@app.route('/admin/profile', methods=['POST'])
+def profile_start():
+    """Profiles the frame loops with cProfile for ?seconds= (default 10)."""
+    seconds = request.args.get('seconds', default=10.0, type=float)
+    tracer.profile(seconds)
+    return jsonify({"profiling": True, "seconds": seconds}), 202
+
+
+@app.route('/admin/profile', methods=['GET'])
+def profile_report():
+    """Text report of the last finished profile (?sort=cumulative|tottime)."""
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        return jsonify({"error": "sort must be cumulative, tottime or calls"}), 400
+    report = tracer.profile_report(sort=sort)
+    if report is None:
+        return jsonify({"error": "No finished profile", "profiling": tracer.profiling}), 404
+    return Response(report, mimetype='text/plain')
+
+
+@app.route('/admin/record/start', methods=['POST'])
+def record_start():
+    """Records the captured frames of ?source= (default: selected source).
+
+    ?name= picks the file name under RECORDINGS_DIR (default
+    <source>-<time>); an existing recording is appended to.
+    """
+    source = request.args.get('source') or camera_stream.source_id
+    rec = recorder.start(source, request.args.get('name'))
+    return jsonify(rec.status()), 202
+
+
+@app.route('/admin/record/stop', methods=['POST'])
+def record_stop():
+    """Stops recording ?source= (default: all)."""
+    source = request.args.get('source')
+    if source:
+        status = recorder.stop(source)
+        if status is None:
+            return jsonify({"error": f"Not recording: {source}"}), 404
+        return jsonify(status)
+    return jsonify(recorder.stop_all())
+
+
+@app.route('/admin/record', methods=['GET'])
+def record_status():
+    """Active recordings and the replay in use."""
+    replay = camera_stream.replay
+    return jsonify({"recording": recorder.status(), "replay": replay.status() if replay else None})
+
+
 
 # ============================================
 # Application Startup
@@ -361,10 +609,12 @@ if __name__ == "__main__":
     print("✓ Modules loaded")
     print("✓ Registered persons loaded into memory")
     
-    # Ask user for ESP32 OLED URL (optional)
+    # Ask user for ESP32 OLED URL (optional) - only interactively and if not configured
     print("\n📟 ESP32 OLED Ekran Ayarları")
     print("-" * 60)
-    esp_url = input("ESP32 OLED URL girin (opsiyonel, boş bırakabilirsiniz): ").strip()
+    esp_url = ESP32_OLED_URL or ""
+    if not esp_url and sys.stdin.isatty():
+        esp_url = input("ESP32 OLED URL girin (opsiyonel, boş bırakabilirsiniz): ").strip()
     if esp_url:
         if not esp_url.startswith('http://') and not esp_url.startswith('https://'):
             esp_url = f"http://{esp_url}"
@@ -377,6 +627,7 @@ if __name__ == "__main__":
     else:
         print("⚠️ ESP32 OLED iletimi devre dışı (URL girilmedi)")
     
-    print("\n🌐 Starting application: http://0.0.0.0:5000")
+    print(f"\n🌐 Starting application: http://{SERVER_HOST}:{SERVER_PORT}")
+    print("   (production: python serve.py)")
     print("=" * 60)
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False, threaded=True)
@@ -1,10 +1,16 @@
 """
 Robotik Yüz Tanıma Modülleri
-"""
 
-from . import config
-from . import face_analysis
-from . import storage
-from . import camera
+Submodules are imported on first use, so light processes (web workers in
+production mode, see serve.py) can use e.g. `modules.config` without
+loading DeepFace / MediaPipe.
+"""
+import importlib
 
 __all__ = ['config', 'face_analysis', 'storage', 'camera']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,403 @@
+"""
+Offline batch analysis of videos, recordings and image folders
+
+Re-runs the analysis of the live pipeline (emotion analysis -> weighted
+history + temporal smoothing -> danger score -> registry matching) over
+archived footage, e.g. with new thresholds, without streaming it through
+/video_feed in real time:
+
+    python -m modules.batch_analysis INPUT [INPUT ...] --out results/
+        [--workers N] [--every 3] [--format csv|parquet] [--sequence]
+        [--danger-threshold 70] [--similarity-threshold 0.6] [--known-faces]
+
+INPUT is a video file, a recording (.frec, modules/recording.py), an image
+file or a directory of images (e.g. static/captured). Frames are read as a
+stream and fanned out over the DeepFace worker processes of
+modules/inference_pool.py (models loaded once per worker; --workers
+defaults to one per INFERENCE_THREADS_PER_PROCESS cores); decoding runs on
+a thread per in-flight frame. Results come back in frame order, so the
+stateful part (history, smoothing, danger cadence, registry) runs
+sequentially per input as in FrameProcessor; the temporal smoothing of each
+block of results is one vectorized `smooth_sequence` step.
+
+Every --every-th frame of a video / recording is analyzed (the live
+ANALYSIS_INTERVAL; skipped frames are only grabbed, not decoded) and gives
+one output row. Images of a directory are independent (state reset per
+image) unless --sequence treats them as consecutive frames.
+
+Rows are written in parts (`part-000001.csv` / `.parquet`) to --out
+together with `checkpoint.json` (position per input, danger cadence,
+persons registered so far); re-running the same command resumes after the
+last written part. The smoothing state is rebuilt by re-analyzing the
+frames just before the resume point without writing them.
+
+CSV output (the default) needs only pandas; --format parquet additionally
+needs pyarrow or fastparquet.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import pandas as pd
+from modules import config, face_analysis, inference_pool
+from modules.face_analysis import (
+    EMOTION_KEYS, EmotionHistory, danger_score_from_vector, get_average_vector, record_emotions,
+    smooth_sequence,
+)
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".webm", ".mjpeg", ".mjpg")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+CHECKPOINT_FILE = "checkpoint.json"
+DANGER_CHECK_INTERVAL = 5.0  # s between embedding lookups per input (as handle_danger_detection)
+# Analyzed frames replayed before a resume point to rebuild history + smoothing
+WARMUP_FRAMES = config.HISTORY_SIZE + 10
+
+
+# -----------------------
+# Inputs
+# -----------------------
+def input_kind(path):
+    if os.path.isdir(path):
+        return "images"
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".frec":
+        return "recording"
+    if ext in IMAGE_EXTENSIONS:
+        return "images"
+    if ext in VIDEO_EXTENSIONS:
+        return "video"
+    raise ValueError(f"Unsupported input: {path}")
+
+
+def _image_files(path):
+    if os.path.isfile(path):
+        return [path]
+    return sorted(p for p in glob.glob(os.path.join(path, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def iter_frames(path, start=0, every=1):
+    """Yields (frame index, timestamp, payload) from frame `start` on, every `every`-th frame.
+
+    The payload is what the decode threads need: a BGR array (video), JPEG
+    bytes (recording) or an image path.
+    """
+    kind = input_kind(path)
+    if kind == "images":
+        files = _image_files(path)
+        for index in range(start, len(files)):
+            if index % every == 0:
+                yield index, os.path.getmtime(files[index]), files[index]
+    elif kind == "recording":
+        from modules.recording import Recording
+        rec = Recording(path)
+        try:
+            for index in range(start, len(rec)):
+                if index % every == 0:
+                    yield index, rec.timestamp(index), bytes(rec.jpeg(index))
+        finally:
+            rec.close()
+    else:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError(f"Cannot open video: {path}")
+        try:
+            if start:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            index = start
+            while True:
+                if index % every:
+                    # Skipped frames are not decoded
+                    if not cap.grab():
+                        break
+                else:
+                    ok, frame = cap.read()
+                    if not ok:
+                        break
+                    yield index, cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, frame
+                index += 1
+        finally:
+            cap.release()
+
+
+def _decode(payload):
+    if isinstance(payload, str):
+        return cv2.imread(payload)
+    if isinstance(payload, bytes):
+        return cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return payload
+
+
+def _analyze(payload):
+    """Decode thread: (rgb frame or None, DeepFace emotions or None)."""
+    frame = _decode(payload)
+    if frame is None:
+        return None, None
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return rgb, face_analysis.detect_emotions(rgb)
+
+
+# -----------------------
+# Sequential stage
+# -----------------------
+class InputState:
+    """Per-input analysis state, as a SourceSession holds it for a live source."""
+
+    def __init__(self, source):
+        self.source = source
+        self.history = EmotionHistory()
+        self.smoothing = {}  # smooth_sequence state
+        self.last_danger_check = float("-inf")
+
+
+class BatchAnalyzer:
+    """Runs the inputs through the pool and writes result parts + checkpoints."""
+
+    def __init__(self, out_dir, fmt="csv", every=config.ANALYSIS_INTERVAL, sequence=False,
+                 danger_threshold=config.DANGER_THRESHOLD, danger_interval=DANGER_CHECK_INTERVAL,
+                 part_rows=5000, in_flight=None, registry=None):
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.every = every
+        self.sequence = sequence
+        self.danger_threshold = danger_threshold
+        self.danger_interval = danger_interval
+        self.part_rows = part_rows
+        self.registry = registry if registry is not None else face_analysis.face_registry
+        pool = inference_pool.get_pool(create=False)
+        self.cores = pool.size * pool.threads if pool is not None else 1
+        self.in_flight = in_flight or max(4, 2 * (pool.size if pool is not None else 1))
+        self.rows = []
+        self.frames = 0
+        self.started = None
+        os.makedirs(out_dir, exist_ok=True)
+        self.checkpoint = self._load_checkpoint()
+        for person_id, embedding in self.checkpoint["registered"].items():
+            self.registry.register(person_id, embedding)
+
+    # ---- checkpoint ------------------------------------------------------
+
+    def _checkpoint_path(self):
+        return os.path.join(self.out_dir, CHECKPOINT_FILE)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self._checkpoint_path(), encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            print(f"✓ Resuming from {self._checkpoint_path()} (part {checkpoint['parts']})")
+            return checkpoint
+        except FileNotFoundError:
+            return {"parts": 0, "inputs": {}, "registered": {}}
+
+    def _save_checkpoint(self):
+        tmp = self._checkpoint_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp, self._checkpoint_path())
+
+    def _flush(self, state, done, next_index):
+        """Writes the pending rows as one part, then records the new position."""
+        if self.rows:
+            self.checkpoint["parts"] += 1
+            part = os.path.join(self.out_dir, f"part-{self.checkpoint['parts']:06d}.{self.fmt}")
+            df = pd.DataFrame(self.rows)
+            if self.fmt == "parquet":
+                df.to_parquet(part, index=False)
+            else:
+                df.to_csv(part, index=False)
+            self.rows = []
+        self.checkpoint["inputs"][state.source] = {
+            "next": next_index, "done": done, "last_danger_check": state.last_danger_check,
+        }
+        self._save_checkpoint()
+
+    # ---- processing ------------------------------------------------------
+
+    def run(self, inputs):
+        self.started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.in_flight, thread_name_prefix="batch-decode") as executor:
+            for path in inputs:
+                self._run_input(executor, path)
+        return self.report()
+
+    def _run_input(self, executor, path):
+        source = os.path.abspath(path)
+        position = self.checkpoint["inputs"].get(source, {})
+        if position.get("done"):
+            print(f"✓ {path}: already done")
+            return
+        kind = input_kind(path)
+        every = self.every if kind != "images" else 1
+        independent = kind == "images" and not self.sequence
+        resume_at = position.get("next", 0)
+        warmup = 0 if independent else WARMUP_FRAMES * every
+        start = max(0, resume_at - warmup)
+
+        state = InputState(source)
+        state.last_danger_check = position.get("last_danger_check", float("-inf"))
+        pending = deque()
+        block = []
+        input_frames, input_started = 0, time.perf_counter()
+        next_index = resume_at
+
+        def process_block():
+            nonlocal input_frames, next_index
+            rows = self._process_block(state, block, independent, resume_at)
+            block.clear()
+            if rows:
+                self.rows.extend(rows)
+                input_frames += len(rows)
+                self.frames += len(rows)
+                next_index = rows[-1]["frame"] + 1
+                if len(self.rows) >= self.part_rows:
+                    self._flush(state, False, next_index)
+
+        def finish(item):
+            index, ts, future = item
+            block.append((index, ts) + future.result())
+            if len(block) >= self.in_flight:
+                process_block()
+
+        for index, ts, payload in iter_frames(path, start, every):
+            # Bounded window: reading stays a stream, results are consumed in order
+            pending.append((index, ts, executor.submit(_analyze, payload)))
+            if len(pending) >= self.in_flight:
+                finish(pending.popleft())
+        while pending:
+            finish(pending.popleft())
+        process_block()
+        self._flush(state, True, next_index)
+        elapsed = time.perf_counter() - input_started
+        fps = input_frames / elapsed if elapsed > 0 else 0.0
+        print(f"✓ {path}: {input_frames} frames in {elapsed:.1f}s "
+              f"({fps:.2f} fps, {fps / self.cores:.2f} fps/core)")
+
+    def _process_block(self, state, block, independent, resume_at):
+        """History, smoothing, danger and registry matching for consecutive analyzed frames.
+
+        `block` holds (index, timestamp, rgb, emotions) in frame order. Returns
+        the rows of the frames from `resume_at` on; earlier (warm-up) frames
+        only rebuild the state.
+        """
+        averages = np.zeros((len(block), len(EMOTION_KEYS)))
+        for i, (_index, _ts, rgb, emotions) in enumerate(block):
+            if independent:
+                state.history.clear()
+            if rgb is not None:
+                record_emotions(emotions, state.history)
+            avg, _main = get_average_vector(state.history)
+            if avg is not None:
+                averages[i] = avg
+        has_average = averages.any(axis=1)
+        if independent:
+            # A fresh smoother returns its (normalized) input
+            sums = averages.sum(axis=1, keepdims=True)
+            smoothed = np.divide(averages, sums, out=np.zeros_like(averages), where=sums > 0)
+        else:
+            smoothed = smooth_sequence(averages, state=state.smoothing)
+
+        danger_interval = 0.0 if independent else self.danger_interval
+        return [self._process(state, index, ts, rgb, emotions, smoothed[i] if has_average[i] else None,
+                              danger_interval)
+                for i, (index, ts, rgb, emotions) in enumerate(block) if index >= resume_at]
+
+    def _process(self, state, index, ts, rgb, emotions, avg, danger_interval):
+        """Output row and registry matching for one analyzed frame with smoothed vector `avg`."""
+        row = {"source": state.source, "frame": index, "timestamp": ts,
+               "analyzed": emotions is not None, "decoded": rgb is not None}
+        for i, key in enumerate(EMOTION_KEYS):
+            row[key] = float(avg[i] * 100.0) if avg is not None else None
+        main_emotion = EMOTION_KEYS[int(np.argmax(avg))] if avg is not None else "neutral"
+        danger_score = danger_score_from_vector(avg)
+        row.update(main_emotion=main_emotion, danger_score=danger_score,
+                   danger=danger_score > self.danger_threshold, person_id=None, person_status=None)
+
+        if row["danger"] and rgb is not None and ts - state.last_danger_check >= danger_interval:
+            embedding = face_analysis.get_face_embedding(rgb)
+            is_registered, existing_id = self.registry.match(embedding)
+            if is_registered:
+                row.update(person_id=existing_id, person_status="registered")
+            elif embedding is not None:
+                # Registered for the rest of the batch only (no capture is saved)
+                person_id = str(uuid.uuid4())[:8]
+                self.registry.register(person_id, embedding)
+                self.checkpoint["registered"][person_id] = [float(v) for v in embedding]
+                row.update(person_id=person_id, person_status="new")
+            else:
+                row["person_status"] = "unrecognized"
+            state.last_danger_check = ts
+        return row
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        return {
+            "frames": self.frames,
+            "seconds": round(elapsed, 2),
+            "fps": round(fps, 2),
+            "cores": self.cores,
+            "fps_per_core": round(fps / self.cores, 3),
+            "parts": self.checkpoint["parts"],
+            "out": self.out_dir,
+        }
+
+
+def _check_format(fmt):
+    if fmt != "parquet":
+        return
+    try:
+        pd.io.parquet.get_engine("auto")
+    except ImportError as e:
+        raise SystemExit(f"❌ Parquet output needs pyarrow or fastparquet ({e}); use --format csv")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline batch emotion / danger analysis")
+    parser.add_argument("inputs", nargs="+", help="videos, .frec recordings, images or image directories")
+    parser.add_argument("--out", required=True, help="output directory (parts + checkpoint)")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv",
+                        help="part file format (parquet needs pyarrow or fastparquet)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="inference processes (default: one per INFERENCE_THREADS_PER_PROCESS cores)")
+    parser.add_argument("--every", type=int, default=config.ANALYSIS_INTERVAL,
+                        help="analyze every N-th video / recording frame")
+    parser.add_argument("--sequence", action="store_true", help="treat image directories as consecutive frames")
+    parser.add_argument("--danger-threshold", type=float, default=config.DANGER_THRESHOLD)
+    parser.add_argument("--danger-interval", type=float, default=DANGER_CHECK_INTERVAL,
+                        help="s between registry lookups per input (media time)")
+    parser.add_argument("--similarity-threshold", type=float, default=config.FACE_SIMILARITY_THRESHOLD)
+    parser.add_argument("--known-faces", action="store_true",
+                        help="match against the registered persons of the capture store")
+    parser.add_argument("--part-rows", type=int, default=5000, help="rows per output part / checkpoint")
+    args = parser.parse_args(argv)
+    _check_format(args.format)
+
+    workers = args.workers
+    if workers is None:
+        # No live pipeline to leave a core for
+        workers = max(1, (os.cpu_count() or 1) // max(1, config.INFERENCE_THREADS_PER_PROCESS))
+    pool = inference_pool.get_pool(processes=workers)
+    print(f"✓ {pool.size if pool else 0} inference processes x {config.INFERENCE_THREADS_PER_PROCESS} threads")
+
+    face_analysis.face_registry.threshold = args.similarity_threshold
+    if args.known_faces:
+        from modules.storage import load_existing_faces
+        load_existing_faces()
+
+    analyzer = BatchAnalyzer(args.out, fmt=args.format, every=max(1, args.every), sequence=args.sequence,
+                             danger_threshold=args.danger_threshold, danger_interval=args.danger_interval,
+                             part_rows=args.part_rows)
+    report = analyzer.run(args.inputs)
+    print(f"✓ {report['frames']} frames in {report['seconds']}s: {report['fps']} fps, "
+          f"{report['fps_per_core']} fps/core over {report['cores']} cores -> {report['out']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
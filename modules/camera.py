@@ -3,19 +3,22 @@ Camera operations and video stream management
 """
 import cv2
 import numpy as np
-from modules import esp_client
+from modules import esp_client, metrics
 import time
 import uuid
 import mediapipe as mp
-from modules.config import (
-    ANALYSIS_INTERVAL, DANGER_THRESHOLD, emotion_labels, latest_state
-)
+from modules.config import ANALYSIS_INTERVAL, DANGER_THRESHOLD, emotion_labels
 from modules.face_analysis import (
-    analyze_emotions, get_average_emotions, calculate_danger_score,
     get_face_embedding, is_registered_dangerous_person, register_dangerous_person
 )
-from modules.face_analysis import TemporalSmoother, emotions_dict_to_vector, vector_to_emotions_dict, preprocess_face
+from modules.face_analysis import vector_to_emotions_dict, preprocess_face, calculate_danger_score
+from modules.session import sessions, LOCAL_SOURCE
+from modules.health import Backoff, placeholder_jpeg, device_monitor
+from modules.frame_buffer import FrameBuffer
 from modules.storage import save_dangerous_person
+from modules.tracing import tracer
+from modules.recording import recorder
+from modules.event_log import get_event_log
 
 # MediaPipe Face Mesh
 mp_face_mesh = mp.solutions.face_mesh
@@ -23,188 +26,320 @@ face_mesh = mp_face_mesh.FaceMesh(refine_landmarks=True, max_num_faces=1)
 mp_drawing = mp.solutions.drawing_utils
 
 
+def mjpeg_part(jpeg):
+    """Wraps already encoded JPEG bytes as one multipart MJPEG part."""
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+
+def draw_face_mesh(mesh, frame, rgb):
+    """Draws face mesh on frame."""
+    with metrics.STAGE_SECONDS.time(stage="mesh", source=metrics.current_source()):
+        results = mesh.process(rgb)
+    if results.multi_face_landmarks:
+        for face_landmarks in results.multi_face_landmarks:
+            mp_drawing.draw_landmarks(
+                image=frame,
+                landmark_list=face_landmarks,
+                connections=mp_face_mesh.FACEMESH_TESSELATION,
+                landmark_drawing_spec=None,
+                connection_drawing_spec=mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=1)
+            )
+
+
+def draw_emotion_info(frame, main_emotion, avg_emotions, y0=30):
+    """Draws emotion information on frame."""
+    emotion_text = f"Baskin Duygu: {emotion_labels.get(main_emotion, main_emotion)} ({avg_emotions.get(main_emotion, 0):.1f}%)"
+    cv2.putText(frame, emotion_text, (10, y0), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+
+
+def draw_detection_status(frame, detection_enabled, y0=30):
+    """Draws warning if detection is off."""
+    if not detection_enabled:
+        cv2.putText(frame, "ALGILAMA KAPALI", (10, y0 + 60),
+                   cv2.FONT_HERSHEY_SIMPLEX, 1.0, (128, 128, 128), 3)
+
+
+def handle_danger_detection(session, frame, rgb, avg_emotions, y0=30):
+    """Handles dangerous situation detection for one source.
+
+    Registrations, re-sightings and unrecognized faces are appended to the
+    event log (modules/event_log.py).
+    """
+    current_time = time.time()
+    events = get_event_log()
+
+    # Check every 5 seconds
+    if current_time - session.last_danger_check > 5:
+        face_embedding = get_face_embedding(rgb)
+        is_registered, existing_id = is_registered_dangerous_person(face_embedding)
+
+        if not is_registered and face_embedding is not None:
+            # New dangerous person - save
+            person_id = str(uuid.uuid4())[:8]
+            timestamp = time.strftime("%Y%m%d-%H%M%S")
+
+            save_dangerous_person(person_id, timestamp, frame, avg_emotions)
+            register_dangerous_person(person_id, face_embedding)
+            metrics.DANGER.inc(source=session.source_id, event="new")
+            events.log("new", session.source_id, person_id, calculate_danger_score(avg_emotions), current_time)
+            events.note_person(session.source_id, person_id)
+
+            cv2.putText(frame, f"DANGEROUS PERSON! (NEW: {person_id})", (10, y0 + 60),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 3)
+
+        elif is_registered:
+            # Registered dangerous person
+            print(f"✓ Registered dangerous person detected: {existing_id} ({session.source_id})")
+            metrics.DANGER.inc(source=session.source_id, event="registered")
+            events.log("sighting", session.source_id, existing_id, calculate_danger_score(avg_emotions), current_time)
+            events.note_person(session.source_id, existing_id)
+            cv2.putText(frame, f"REGISTERED DANGEROUS PERSON: {existing_id}", (10, y0 + 60),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 140, 255), 3)
+        else:
+            # Face not recognized
+            metrics.DANGER.inc(source=session.source_id, event="unrecognized")
+            events.log("unrecognized", session.source_id, None, calculate_danger_score(avg_emotions), current_time)
+            cv2.putText(frame, "DANGEROUS - Face not recognized", (10, y0 + 60),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 3)
+
+        session.last_danger_check = current_time
+    else:
+        cv2.putText(frame, "DANGEROUS PERSON!", (10, y0 + 60),
+                   cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
+
+
+class FrameProcessor:
+    """Runs the analysis pipeline of one source over successive frames.
+
+    Pipeline per frame: face mesh overlay -> emotion analysis (every
+    ANALYSIS_INTERVAL frames) -> weighted average + temporal smoothing ->
+    danger score -> session state / OLED -> overlays -> danger handling.
+    All analysis state lives in the `SourceSession`.
+
+    `analyzer`, if given, is called with the RGB frame instead of running
+    DeepFace inline; it must deliver results via `session.post_emotions()`
+    (see modules/orchestrator.py).
+    """
+
+    def __init__(self, session, mesh=None, analyzer=None):
+        self.session = session
+        # MediaPipe graphs are not thread-safe: one per processor
+        self.mesh = mesh or mp_face_mesh.FaceMesh(refine_landmarks=True, max_num_faces=1)
+        self.analyzer = analyzer
+        self.frame_count = 0
+
+    def process(self, frame, rgb, detection_enabled):
+        """Analyzes `frame` and draws the results onto it (in place)."""
+        session = self.session
+        metrics.set_source(session.source_id)
+        with metrics.STAGE_SECONDS.time(stage="process", source=session.source_id):
+            self._process(session, frame, rgb, detection_enabled)
+        metrics.FRAMES.inc(source=session.source_id)
+
+    def _process(self, session, frame, rgb, detection_enabled):
+        source = session.source_id
+
+        # Draw face mesh
+        with tracer.span("mesh", source):
+            draw_face_mesh(self.mesh, frame, rgb)
+
+        # Perform emotion analysis (at intervals)
+        if detection_enabled and self.frame_count % ANALYSIS_INTERVAL == 0:
+            with tracer.span("analysis", source):
+                if self.analyzer is None:
+                    session.analyze(rgb)
+                else:
+                    self.analyzer(rgb)
+
+        with tracer.span("smoothing", source):
+            session.apply_pending()
+
+            # Average emotions + temporal smoothing (vectors), dict only for output
+            avg_vec, main_emotion, danger_score = session.smoothed_emotions()
+            avg_emotions = vector_to_emotions_dict(avg_vec) if avg_vec is not None else {}
+
+            # Check danger score
+            danger = detection_enabled and (danger_score > DANGER_THRESHOLD)
+
+            # Update latest state
+            session.update_state(avg_emotions, main_emotion, danger_score)
+
+            # Danger episodes -> score peaks in the event log
+            get_event_log().observe_danger(source, danger_score if detection_enabled else 0.0,
+                                           threshold=DANGER_THRESHOLD)
+
+            # Send emotion to ESP32 OLED if URL is configured
+            session.send_oled(main_emotion, avg_emotions)
+
+        # Draw information on frame
+        y0 = 30
+        with tracer.span("overlay", source):
+            draw_emotion_info(frame, main_emotion, avg_emotions, y0)
+            draw_detection_status(frame, detection_enabled, y0)
+
+        # Check for dangerous situation
+        if danger:
+            metrics.DANGER.inc(source=source, event="frame")
+            with tracer.span("danger", source):
+                handle_danger_detection(session, frame, rgb, avg_emotions, y0)
+
+        self.frame_count += 1
+
+
 class CameraStream:
     """Camera stream management and frame processing"""
-    
+
     def __init__(self):
         self.detection_enabled = True
-        self.last_danger_check = 0
         # If remote_ip is set, frames will be pulled from ESP via HTTP
         self.remote_ip = None
-        # small backoff between remote fetches to avoid overloading ESP
-        self._remote_delay = 0.1
-        # temporal smoother - iyileştirilmiş parametrelerle
-        self.emotion_smoother = TemporalSmoother(maxlen=10, ema_alpha=0.7)
-    
+        # If replay is set (modules/recording.ReplaySource), frames come from a recording
+        self.replay = None
+        # Latest annotated frame of generate_frames() (served by /snapshot.jpg)
+        self.output = FrameBuffer()
+
     def set_detection(self, enabled):
         """Sets detection status."""
         self.detection_enabled = enabled
-    
+
     def is_detection_enabled(self):
         """Returns detection status."""
         return self.detection_enabled
 
     def set_remote_ip(self, ip: str):
         """Set an ESP IP to use as frame source. Pass None to clear."""
+        self.clear_replay()
         if ip:
             self.remote_ip = ip
+            device_monitor.watch(ip)
         else:
             self.remote_ip = None
 
     def clear_remote_ip(self):
+        self.clear_replay()
         self.remote_ip = None
 
+    def set_replay(self, replay):
+        """Use a ReplaySource as frame source (until another source is set)."""
+        old, self.replay = self.replay, replay
+        if old is not None and old is not replay:
+            # Frees its map and file; its players end at their next frame
+            old.close()
+
+    def clear_replay(self):
+        self.set_replay(None)
+
     def is_using_remote(self):
         return bool(self.remote_ip)
-    
-    def draw_face_mesh(self, frame, rgb):
-        """Draws face mesh on frame."""
-        results = face_mesh.process(rgb)
-        if results.multi_face_landmarks:
-            for face_landmarks in results.multi_face_landmarks:
-                mp_drawing.draw_landmarks(
-                    image=frame,
-                    landmark_list=face_landmarks,
-                    connections=mp_face_mesh.FACEMESH_TESSELATION,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=1)
-                )
-    
-    def draw_emotion_info(self, frame, main_emotion, avg_emotions, y0=30):
-        """Draws emotion information on frame."""
-        emotion_text = f"Baskin Duygu: {emotion_labels.get(main_emotion, main_emotion)} ({avg_emotions.get(main_emotion, 0):.1f}%)"
-        cv2.putText(frame, emotion_text, (10, y0), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-    
-    def draw_detection_status(self, frame, y0=30):
-        """Draws warning if detection is off."""
-        if not self.detection_enabled:
-            cv2.putText(frame, "ALGILAMA KAPALI", (10, y0 + 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1.0, (128, 128, 128), 3)
-    
-    def handle_danger_detection(self, frame, rgb, avg_emotions, y0=30):
-        """Handles dangerous situation detection."""
-        current_time = time.time()
-        
-        # Check every 5 seconds
-        if current_time - self.last_danger_check > 5:
-            face_embedding = get_face_embedding(rgb)
-            is_registered, existing_id = is_registered_dangerous_person(face_embedding)
-            
-            if not is_registered and face_embedding is not None:
-                # New dangerous person - save
-                person_id = str(uuid.uuid4())[:8]
-                timestamp = time.strftime("%Y%m%d-%H%M%S")
-                
-                save_dangerous_person(person_id, timestamp, frame, avg_emotions)
-                register_dangerous_person(person_id, face_embedding)
-                
-                cv2.putText(frame, f"DANGEROUS PERSON! (NEW: {person_id})", (10, y0 + 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 3)
-            
-            elif is_registered:
-                # Registered dangerous person
-                print(f"✓ Registered dangerous person detected: {existing_id}")
-                cv2.putText(frame, f"REGISTERED DANGEROUS PERSON: {existing_id}", (10, y0 + 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 140, 255), 3)
-            else:
-                # Face not recognized
-                cv2.putText(frame, "DANGEROUS - Face not recognized", (10, y0 + 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 3)
-            
-            self.last_danger_check = current_time
-        else:
-            cv2.putText(frame, "DANGEROUS PERSON!", (10, y0 + 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
-    
-    def generate_frames(self):
+
+    @property
+    def source_id(self):
+        """Session id of the current source ("local", the ESP IP or "replay:<name>")."""
+        if self.replay is not None:
+            return self.replay.source_id
+        return self.remote_ip or LOCAL_SOURCE
+
+    def generate_frames(self, viewer=None):
         """Generates frames for video stream.
 
         If `self.remote_ip` is set, fetch single JPEG snapshots from the ESP
         and use them as the frame source. Otherwise fall back to local camera
-        capture (index 0) and the existing analysis pipeline.
+        capture (index 0) and the existing analysis pipeline. Failed
+        snapshots are retried with jittered exponential backoff while a
+        "reconnecting" placeholder is shown. With `self.replay` set, frames
+        come from the recording instead (the stream ends with it unless it loops).
+
+        Captured frames are handed to the recorder (modules/recording.py)
+        when their source is being recorded. With `viewer` (an
+        output_profiles.ViewerQuality) frames are sent in the viewer's output
+        profile; frames over its max FPS are processed but not sent.
         """
-        frame_count = 0
+        processor = FrameProcessor(sessions.get_or_create(self.source_id), mesh=face_mesh)
+        backoff = Backoff(base=0.1)
+        frame_size = (640, 480)
 
         # Local capture object (created lazily only if needed)
         cap = None
+        # Position in the current recording while replaying
+        replay, player = None, None
 
         while True:
-            if self.remote_ip:
-                # Fetch JPEG bytes from ESP
-                jpeg = esp_client.get_snapshot(self.remote_ip)
-                if not jpeg:
-                    # yield a short error frame or retry
-                    # (we simply sleep briefly and continue)
-                    time.sleep(self._remote_delay)
-                    continue
-                # decode JPEG bytes into OpenCV image
-                arr = np.frombuffer(jpeg, dtype=np.uint8)
-                frame = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-                if frame is None:
-                    time.sleep(self._remote_delay)
+            # Follow source switches (/set_camera_source) with the matching session
+            if processor.session.source_id != self.source_id:
+                processor.session = sessions.get_or_create(self.source_id)
+            source = processor.session.source_id
+
+            with tracer.frame(source):
+                if self.replay is not None:
+                    if replay is not self.replay:
+                        replay, player = self.replay, self.replay.player()
+                    with tracer.span("capture", source):
+                        item = next(player, None)
+                    if item is None:
+                        if replay is not self.replay:
+                            # Closed by a source switch
+                            continue
+                        break
+                    with tracer.span("decode", source), metrics.STAGE_SECONDS.time(stage="decode", source=source):
+                        frame = cv2.imdecode(np.frombuffer(item[1], dtype=np.uint8), cv2.IMREAD_COLOR)
+                    if frame is None:
+                        continue
+                    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                elif self.remote_ip:
+                    # Fetch JPEG bytes from ESP
+                    with tracer.span("capture", source):
+                        jpeg = esp_client.get_snapshot(self.remote_ip)
+                        if jpeg:
+                            recorder.tap_jpeg(source, jpeg)
+                    # decode JPEG bytes into OpenCV image
+                    frame = None
+                    if jpeg:
+                        with tracer.span("decode", source), metrics.STAGE_SECONDS.time(stage="decode", source=source):
+                            frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    if frame is None:
+                        device_monitor.report_stream_state(self.remote_ip, "reconnecting")
+                        yield mjpeg_part(placeholder_jpeg("YENIDEN BAGLANILIYOR...", *frame_size))
+                        time.sleep(backoff.next_delay())
+                        continue
+                    backoff.reset()
+                    frame_size = (frame.shape[1], frame.shape[0])
+                    device_monitor.report_stream_state(self.remote_ip, "running")
+                    device_monitor.report_frame(self.remote_ip)
+                    # No horizontal flip for remote stream by default
+                    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                else:
+                    if cap is None:
+                        cap = cv2.VideoCapture(0)
+                    with tracer.span("capture", source):
+                        success, frame = cap.read()
+                    if not success:
+                        break
+                    with tracer.span("decode", source):
+                        frame = cv2.flip(frame, 1)
+                        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    # Recorded mirrored, as the pipeline sees it (replay does not flip)
+                    recorder.tap_frame(source, frame)
+
+                processor.process(frame, rgb, self.detection_enabled)
+
+                # Encode frame once, publish for snapshots and yield
+                with tracer.span("encode", source), metrics.STAGE_SECONDS.time(stage="imencode", source=source):
+                    ok, buffer = cv2.imencode('.jpg', frame)
+                if not ok:
                     continue
-                # No horizontal flip for remote stream by default
-                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            else:
-                if cap is None:
-                    cap = cv2.VideoCapture(0)
-                success, frame = cap.read()
-                if not success:
-                    break
-                frame = cv2.flip(frame, 1)
-                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            # Draw face mesh
-            self.draw_face_mesh(frame, rgb)
-            
-            # Perform emotion analysis (at intervals)
-            if self.detection_enabled and frame_count % ANALYSIS_INTERVAL == 0:
-                analyze_emotions(rgb)
-            
-            # Calculate average emotions
-            avg_emotions, main_emotion = get_average_emotions()
-
-            # Apply temporal smoothing to the averaged emotions for stability
-            if avg_emotions:
-                vec = emotions_dict_to_vector(avg_emotions)
-                smoothed = self.emotion_smoother.update(vec)
-                if smoothed is not None:
-                    avg_emotions = vector_to_emotions_dict(smoothed)
-                    main_emotion = max(avg_emotions, key=avg_emotions.get)
-            
-            # Calculate danger score
-            danger_score = calculate_danger_score(avg_emotions)
-            danger = self.detection_enabled and (danger_score > DANGER_THRESHOLD)
-            
-            # Update latest state
-            latest_state["timestamp"] = time.strftime("%Y%m%d-%H%M%S")
-            latest_state["emotions"] = avg_emotions if avg_emotions else None
-            latest_state["main_emotion"] = main_emotion
-            latest_state["danger_score"] = float(danger_score)
-            
-            # Send emotion to ESP32 OLED if URL is configured
-            from modules.face_analysis import send_emotion_to_esp32, ESP32_TARGET_URL
-            if main_emotion and avg_emotions and ESP32_TARGET_URL:
-                confidence = avg_emotions.get(main_emotion, 0) / 100.0
-                send_emotion_to_esp32(main_emotion, confidence)
-            
-            # Draw information on frame
-            y0 = 30
-            self.draw_emotion_info(frame, main_emotion, avg_emotions, y0)
-            self.draw_detection_status(frame, y0)
-            
-            # Check for dangerous situation
-            if danger:
-                self.handle_danger_detection(frame, rgb, avg_emotions, y0)
-            
-            # Encode frame and yield
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-            frame_count += 1
-        
+                jpeg = buffer.tobytes()
+                seq = self.output.publish(jpeg, frame)
+                if viewer is None:
+                    with tracer.span("send", source):
+                        yield mjpeg_part(jpeg)
+                elif viewer.due():
+                    part = mjpeg_part(viewer.encode(self.output, seq, jpeg))
+                    with tracer.span("send", source):
+                        start = time.monotonic()
+                        yield part
+                        viewer.sent(time.monotonic() - start)
+
         if cap is not None:
             cap.release()
 
@@ -0,0 +1,533 @@
+"""
+Append-only segmented capture store
+
+Instead of writing one JPG + one JSON file per capture into a flat directory,
+captures are appended as records to rolling segment files:
+
+    segments/seg-000001.log   <record><record><record>...
+    segments/seg-000002.log
+    segments/index.idx        fixed-size offset index entries
+
+Each record is `header | key | jpeg bytes | json metadata`. The index maps a
+capture key (`<person_id>_<timestamp>`) to its segment and offset, so listing
+and loading never touch the directory tree. Reads go through a cached `mmap`
+per segment and return `memoryview` slices (no copy of the JPEG bytes).
+
+Maintenance:
+ - apply_retention(max_age_seconds): drops whole sealed segments that are
+   older than the retention window (segments roll daily, see `max_segment_age`)
+ - compact(): rewrites sealed segments that contain deleted records
+ - export_to_directory(path): writes plain `<key>.jpg` / `<key>.json` files
+ - import_directory(path): imports a legacy flat capture directory
+
+Command line:
+    python -m modules.capture_store export <dest_dir>
+    python -m modules.capture_store import <src_dir>
+    python -m modules.capture_store compact
+    python -m modules.capture_store retention <days>
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import threading
+from collections import namedtuple
+
+_MAGIC = b"CAPR"
+# magic, created (unix time), key length, image length, metadata length
+_RECORD_HEADER = struct.Struct("<4sdHII")
+# flags, segment id, record offset, created, key (padded), image length, metadata length
+_INDEX_ENTRY = struct.Struct("<BIQd48sII")
+_MAX_KEY_BYTES = 48
+
+_FLAG_LIVE = 0
+_FLAG_DELETED = 1
+_FLAG_SEGMENT_END = 2  # offset = bytes of the segment already covered by the index
+
+_SEGMENT_PREFIX = "seg-"
+_SEGMENT_SUFFIX = ".log"
+_INDEX_FILE = "index.idx"
+
+Entry = namedtuple("Entry", "segment offset created key image_len meta_len")
+
+
+def _record_size(entry):
+    return _RECORD_HEADER.size + len(entry.key.encode("utf-8")) + entry.image_len + entry.meta_len
+
+
+class SegmentStore:
+    """Append-only capture store backed by rolling segment files."""
+
+    def __init__(self, directory, max_segment_bytes=64 * 1024 * 1024,
+                 max_segment_age=24 * 3600):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._entries = {}          # key -> Entry (live records only)
+        self._segment_live = {}     # segment id -> live record count
+        self._segment_dead = {}     # segment id -> deleted record count
+        self._segment_created = {}  # segment id -> created time of first record
+        self._maps = {}             # segment id -> mmap
+        self._pending_delete = []   # segment files still mapped by readers
+
+        self._active_id = None
+        self._active_file = None
+        self._active_size = 0
+        self._index_file = None
+
+        self._load()
+
+    # -----------------------
+    # Paths / open / recovery
+    # -----------------------
+    def _segment_path(self, segment_id):
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{segment_id:06d}{_SEGMENT_SUFFIX}")
+
+    def _index_path(self):
+        return os.path.join(self.directory, _INDEX_FILE)
+
+    def _segment_ids(self):
+        ids = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                try:
+                    ids.append(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(ids)
+
+    def _load(self):
+        segment_ids = self._segment_ids()
+        indexed_end = {}  # segment id -> end offset of last indexed record
+
+        if os.path.exists(self._index_path()):
+            with open(self._index_path(), "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % _INDEX_ENTRY.size
+            for pos in range(0, usable, _INDEX_ENTRY.size):
+                flags, seg, off, created, raw_key, img_len, meta_len = _INDEX_ENTRY.unpack_from(data, pos)
+                key = raw_key.rstrip(b"\x00").decode("utf-8")
+                if seg not in segment_ids:
+                    continue
+                if flags == _FLAG_SEGMENT_END:
+                    indexed_end[seg] = max(indexed_end.get(seg, 0), off)
+                    continue
+                entry = Entry(seg, off, created, key, img_len, meta_len)
+                if flags == _FLAG_DELETED:
+                    self._forget(key)
+                else:
+                    self._remember(entry)
+                    end = off + _record_size(entry)
+                    indexed_end[seg] = max(indexed_end.get(seg, 0), end)
+            if usable != len(data):
+                # Partially written index entry from a crash
+                with open(self._index_path(), "r+b") as f:
+                    f.truncate(usable)
+
+        self._index_file = open(self._index_path(), "ab")
+
+        # Recover records that reached a segment but not the index
+        for seg in segment_ids:
+            self._scan_segment(seg, indexed_end.get(seg, 0))
+
+        if segment_ids:
+            self._open_active(segment_ids[-1])
+        else:
+            self._open_active(1)
+
+    def _scan_segment(self, segment_id, start):
+        path = self._segment_path(segment_id)
+        size = os.path.getsize(path)
+        if start >= size:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        pos = 0
+        while pos + _RECORD_HEADER.size <= len(data):
+            magic, created, key_len, img_len, meta_len = _RECORD_HEADER.unpack_from(data, pos)
+            end = pos + _RECORD_HEADER.size + key_len + img_len + meta_len
+            if magic != _MAGIC or end > len(data):
+                break
+            key_start = pos + _RECORD_HEADER.size
+            key = data[key_start:key_start + key_len].decode("utf-8")
+            if key_len > _MAX_KEY_BYTES:
+                # Written before append() checked the key; cannot be indexed
+                print(f"⚠️ Capture segment {segment_id}: skipping record with too long key {key!r}")
+                # Mark it covered so the next open does not scan it again
+                self._write_index(_FLAG_SEGMENT_END, Entry(segment_id, start + end, 0.0, "", 0, 0))
+            else:
+                entry = Entry(segment_id, start + pos, created, key, img_len, meta_len)
+                self._remember(entry)
+                self._write_index(_FLAG_LIVE, entry)
+            pos = end
+        if start + pos < size:
+            # Torn write at the tail: drop it so the next append starts clean
+            with open(path, "r+b") as f:
+                f.truncate(start + pos)
+            print(f"⚠️ Capture segment {segment_id} truncated to last complete record")
+
+    def _open_active(self, segment_id):
+        if self._active_file is not None:
+            self._active_file.close()
+        self._active_id = segment_id
+        self._active_file = open(self._segment_path(segment_id), "ab")
+        self._active_size = self._active_file.tell()
+
+    def close(self):
+        with self._lock:
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+            if self._index_file is not None:
+                self._index_file.close()
+                self._index_file = None
+            for seg in list(self._maps):
+                self._unmap(seg)
+
+    # -----------------------
+    # Bookkeeping
+    # -----------------------
+    def _remember(self, entry):
+        old = self._entries.get(entry.key)
+        if old is not None:
+            self._mark_dead(old)
+        self._entries[entry.key] = entry
+        self._segment_live[entry.segment] = self._segment_live.get(entry.segment, 0) + 1
+        created = self._segment_created.get(entry.segment)
+        if created is None or entry.created < created:
+            self._segment_created[entry.segment] = entry.created
+
+    def _forget(self, key):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._mark_dead(old)
+
+    def _mark_dead(self, entry):
+        self._segment_live[entry.segment] -= 1
+        self._segment_dead[entry.segment] = self._segment_dead.get(entry.segment, 0) + 1
+
+    def _write_index(self, flags, entry):
+        self._index_file.write(_INDEX_ENTRY.pack(
+            flags, entry.segment, entry.offset, entry.created, entry.key.encode("utf-8"),
+            entry.image_len, entry.meta_len
+        ))
+        self._index_file.flush()
+
+    def _rewrite_index(self):
+        tmp = self._index_path() + ".tmp"
+        with open(tmp, "wb") as f:
+            for entry in sorted(self._entries.values(), key=lambda e: (e.segment, e.offset)):
+                f.write(_INDEX_ENTRY.pack(
+                    _FLAG_LIVE, entry.segment, entry.offset, entry.created,
+                    entry.key.encode("utf-8"), entry.image_len, entry.meta_len
+                ))
+            # Deleted records are no longer listed, so mark how far each
+            # segment is covered to keep recovery from resurrecting them
+            for seg in self._segment_ids():
+                end = self._active_size if seg == self._active_id else os.path.getsize(self._segment_path(seg))
+                f.write(_INDEX_ENTRY.pack(_FLAG_SEGMENT_END, seg, end, 0.0, b"", 0, 0))
+        self._index_file.close()
+        os.replace(tmp, self._index_path())
+        self._index_file = open(self._index_path(), "ab")
+
+    # -----------------------
+    # Memory maps
+    # -----------------------
+    def _map(self, segment_id, needed_end):
+        """Return an mmap covering at least `needed_end` bytes of the segment."""
+        mm = self._maps.get(segment_id)
+        if mm is not None and len(mm) >= needed_end:
+            return mm
+        if segment_id == self._active_id:
+            self._active_file.flush()
+        with open(self._segment_path(segment_id), "rb") as f:
+            new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm is not None:
+            self._release_map(mm)
+        self._maps[segment_id] = new_map
+        return new_map
+
+    def _release_map(self, mm):
+        try:
+            mm.close()
+        except BufferError:
+            # A reader still holds a memoryview; the map is freed with it
+            pass
+
+    def _unmap(self, segment_id):
+        mm = self._maps.pop(segment_id, None)
+        if mm is not None:
+            self._release_map(mm)
+
+    def _delete_segment_file(self, segment_id):
+        self._unmap(segment_id)
+        self._segment_live.pop(segment_id, None)
+        self._segment_dead.pop(segment_id, None)
+        self._segment_created.pop(segment_id, None)
+        path = self._segment_path(segment_id)
+        try:
+            os.remove(path)
+        except OSError:
+            # Still mapped by an in-flight reader (Windows); retry later
+            self._pending_delete.append(path)
+
+    def _retry_pending_deletes(self):
+        remaining = []
+        for path in self._pending_delete:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                remaining.append(path)
+        self._pending_delete = remaining
+
+    # -----------------------
+    # Public API
+    # -----------------------
+    def append(self, key, image_bytes, meta, created=None):
+        """Append a capture record. Replaces an existing record with the same key."""
+        created = time.time() if created is None else created
+        raw_key = key.encode("utf-8")
+        if len(raw_key) > _MAX_KEY_BYTES:
+            raise ValueError(f"capture key longer than {_MAX_KEY_BYTES} bytes: {key}")
+        raw_meta = json.dumps(meta).encode("utf-8")
+        image = memoryview(image_bytes).cast("B")
+        header = _RECORD_HEADER.pack(_MAGIC, created, len(raw_key), len(image), len(raw_meta))
+
+        with self._lock:
+            self._maybe_roll(created)
+            offset = self._active_size
+            self._active_file.write(header)
+            self._active_file.write(raw_key)
+            self._active_file.write(image)
+            self._active_file.write(raw_meta)
+            self._active_file.flush()
+            entry = Entry(self._active_id, offset, created, key, len(image), len(raw_meta))
+            self._active_size += _record_size(entry)
+            self._remember(entry)
+            self._write_index(_FLAG_LIVE, entry)
+            return entry
+
+    def _maybe_roll(self, now):
+        if self._active_size == 0:
+            return
+        too_big = self._active_size >= self.max_segment_bytes
+        first = self._segment_created.get(self._active_id)
+        too_old = first is not None and self.max_segment_age and now - first >= self.max_segment_age
+        if too_big or too_old:
+            self._open_active(self._active_id + 1)
+
+    def delete(self, key):
+        """Delete a capture (tombstone). Space is reclaimed by `compact()`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            self._forget(key)
+            self._write_index(_FLAG_DELETED, entry)
+            return True
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        """Live capture keys, oldest first."""
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e.created)
+        return [e.key for e in entries]
+
+    def _slice(self, key, part):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            start = entry.offset + _RECORD_HEADER.size + len(entry.key.encode("utf-8"))
+            if part == "meta":
+                start += entry.image_len
+                length = entry.meta_len
+            else:
+                length = entry.image_len
+            mm = self._map(entry.segment, start + length)
+            return memoryview(mm)[start:start + length]
+
+    def get_image(self, key):
+        """Zero-copy JPEG bytes of a capture as a `memoryview`, or None."""
+        return self._slice(key, "image")
+
+    def get_meta(self, key):
+        """Decoded metadata dict of a capture, or None."""
+        view = self._slice(key, "meta")
+        if view is None:
+            return None
+        with view:
+            return json.loads(bytes(view))
+
+    def iter_records(self):
+        """Yields (key, meta, image memoryview) for all live captures, oldest first."""
+        for key in self.keys():
+            image = self.get_image(key)
+            meta = self.get_meta(key)
+            if image is not None and meta is not None:
+                yield key, meta, image
+
+    def stats(self):
+        with self._lock:
+            return {
+                "records": len(self._entries),
+                "segments": len(self._segment_ids()),
+                "active_segment": self._active_id,
+                "bytes": sum(os.path.getsize(self._segment_path(s)) for s in self._segment_ids()),
+            }
+
+    # -----------------------
+    # Maintenance
+    # -----------------------
+    def apply_retention(self, max_age_seconds, now=None):
+        """Drops sealed segments whose newest record is older than the window.
+
+        Returns the number of captures removed.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - max_age_seconds
+        removed = 0
+        with self._lock:
+            newest = {}
+            for entry in self._entries.values():
+                newest[entry.segment] = max(newest.get(entry.segment, 0), entry.created)
+            for seg in self._segment_ids():
+                if seg == self._active_id:
+                    continue
+                if newest.get(seg, 0) >= cutoff:
+                    continue
+                for key in [k for k, e in self._entries.items() if e.segment == seg]:
+                    del self._entries[key]
+                    removed += 1
+                self._delete_segment_file(seg)
+            if removed:
+                self._rewrite_index()
+            self._retry_pending_deletes()
+        return removed
+
+    def compact(self, min_dead_ratio=0.25):
+        """Rewrites sealed segments whose deleted share exceeds `min_dead_ratio`.
+
+        Live records are copied into fresh segments (new ids, so readers of the
+        old maps are never affected) and the old segment files are removed.
+        Returns the number of bytes reclaimed.
+        """
+        with self._lock:
+            victims = []
+            for seg in self._segment_ids():
+                if seg == self._active_id:
+                    continue
+                live = self._segment_live.get(seg, 0)
+                dead = self._segment_dead.get(seg, 0)
+                if live + dead and dead / (live + dead) >= min_dead_ratio:
+                    victims.append(seg)
+                elif live == 0:
+                    victims.append(seg)
+            if not victims:
+                self._retry_pending_deletes()
+                return 0
+
+            before = sum(os.path.getsize(self._segment_path(s)) for s in victims)
+            moving = sorted(
+                (e for e in self._entries.values() if e.segment in victims),
+                key=lambda e: e.created,
+            )
+            # Copy into new segments after the active one, then continue appending there
+            self._open_active(self._active_id + 1)
+            for entry in moving:
+                mm = self._map(entry.segment, entry.offset + _record_size(entry))
+                record = mm[entry.offset:entry.offset + _record_size(entry)]
+                if self._active_size and self._active_size + len(record) > self.max_segment_bytes:
+                    self._open_active(self._active_id + 1)
+                new_entry = entry._replace(segment=self._active_id, offset=self._active_size)
+                self._active_file.write(record)
+                self._active_size += len(record)
+                self._segment_live[entry.segment] -= 1
+                self._entries[entry.key] = new_entry
+                self._segment_live[self._active_id] = self._segment_live.get(self._active_id, 0) + 1
+                created = self._segment_created.get(self._active_id)
+                if created is None or entry.created < created:
+                    self._segment_created[self._active_id] = entry.created
+            self._active_file.flush()
+            self._rewrite_index()
+            for seg in victims:
+                self._delete_segment_file(seg)
+            self._retry_pending_deletes()
+            return before - sum(_record_size(e) for e in moving)
+
+    def export_to_directory(self, dest_dir):
+        """Writes every live capture back as plain `<key>.jpg` + `<key>.json` files."""
+        os.makedirs(dest_dir, exist_ok=True)
+        count = 0
+        for key, meta, image in self.iter_records():
+            with open(os.path.join(dest_dir, f"{key}.jpg"), "wb") as f:
+                f.write(image)
+            with open(os.path.join(dest_dir, f"{key}.json"), "w") as f:
+                json.dump(meta, f, indent=4)
+            image.release()
+            count += 1
+        return count
+
+    def import_directory(self, src_dir):
+        """Imports a flat directory of `<key>.jpg` + `<key>.json` captures."""
+        count = 0
+        for name in sorted(os.listdir(src_dir)):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            img_path = os.path.join(src_dir, key + ".jpg")
+            if key in self or not os.path.exists(img_path):
+                continue
+            with open(os.path.join(src_dir, name), "r") as f:
+                meta = json.load(f)
+            if len(key.encode("utf-8")) > _MAX_KEY_BYTES:
+                print(f"⚠️ Skipping {name}: key longer than {_MAX_KEY_BYTES} bytes")
+                continue
+            with open(img_path, "rb") as f:
+                image = f.read()
+            self.append(key, image, meta, created=os.path.getmtime(img_path))
+            count += 1
+        return count
+
+
+def _main(argv):
+    from modules.config import CAPTURE_DIR, CAPTURE_SEGMENT_DIR
+    if not argv:
+        print(__doc__)
+        return 1
+    store = SegmentStore(CAPTURE_SEGMENT_DIR)
+    command = argv[0]
+    if command == "export":
+        dest = argv[1] if len(argv) > 1 else os.path.join(CAPTURE_DIR, "export")
+        print(f"✓ {store.export_to_directory(dest)} captures exported to {dest}")
+    elif command == "import":
+        src = argv[1] if len(argv) > 1 else CAPTURE_DIR
+        print(f"✓ {store.import_directory(src)} captures imported from {src}")
+    elif command == "compact":
+        print(f"✓ {store.compact()} bytes reclaimed")
+    elif command == "retention":
+        days = float(argv[1])
+        print(f"✓ {store.apply_retention(days * 86400)} captures removed")
+    else:
+        print(f"Unknown command: {command}")
+        return 1
+    print(store.stats())
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -1,11 +1,31 @@
 """
 Configuration constants and global settings
+
+Every constant can be overridden without editing this file (see the end of
+the file): from a JSON file named by APP_CONFIG_FILE, or from environment
+variables with the same name (a .env file is loaded first).
 """
 import os
+import json
+from dotenv import load_dotenv
 
 # Directory configuration
 CAPTURE_DIR = "static/captured"
-os.makedirs(CAPTURE_DIR, exist_ok=True)
+
+# Capture storage backend
+# "files"    -> one JPG + one JSON file per capture in CAPTURE_DIR
+# "segments" -> append-only rolling segment files (modules/capture_store.py)
+CAPTURE_BACKEND = "files"
+CAPTURE_SEGMENT_DIR = os.path.join(CAPTURE_DIR, "segments")
+CAPTURE_SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # roll to a new segment after 64 MB
+CAPTURE_SEGMENT_MAX_AGE = 24 * 3600           # ...or after one day (retention granularity)
+CAPTURE_RETENTION_DAYS = 0                    # drop captures older than N days (0 = keep forever)
+CAPTURE_MAINTENANCE_INTERVAL = 3600           # seconds between retention/compaction runs
+
+# Capture thumbnails for the dashboard (modules/thumbnails.py)
+THUMBNAIL_DIR = os.path.join(CAPTURE_DIR, "thumbs")
+THUMBNAIL_WIDTHS = (160, 320, 640)  # fixed widths, served via /thumbnail/<width>/<name>
+THUMBNAIL_QUALITY = 75              # JPEG quality of thumbnails
 
 # Analysis parameters
 ANALYSIS_INTERVAL = 3     # analyze every 3 frames (daha sık analiz için optimize edildi)
@@ -13,6 +33,82 @@ HISTORY_SIZE = 5           # average of last 5 analyses (daha fazla smoothing)
 DANGER_THRESHOLD = 70     # danger threshold (angry+fear+disgust sum)
 FACE_SIMILARITY_THRESHOLD = 0.6  # face similarity threshold (0-1 range, lower=stricter)
 
+# Multi-camera orchestrator (modules/orchestrator.py)
+# Sources started at startup, e.g. {"ip": "10.0.0.12", "name": "Kapi", "priority": 2}
+CAMERA_SOURCES = []
+INFERENCE_WORKERS = 1          # concurrent DeepFace analyses shared by all cameras (at least the pool size)
+INFERENCE_MAX_RATE = 0         # max analyses/s over all cameras (0 = no cap)
+ON_DEMAND_IDLE_TIMEOUT = 30    # stop /video_feed?ip= sources after N s without viewers
+
+# Frame loop tracing / profiling (modules/tracing.py, /admin/trace, /admin/profile)
+TRACE_MAX_EVENTS = 200000      # spans kept in memory (oldest dropped)
+PROFILE_MAX_SECONDS = 60       # longest cProfile capture
+
+# Capture recording / replay (modules/recording.py, /admin/record, /set_camera_source mode "replay")
+RECORDINGS_DIR = "recordings"
+RECORD_QUEUE_SIZE = 64         # frames waiting for the writer thread (more are dropped)
+RECORD_JPEG_QUALITY = 90       # quality of recorded decoded frames (ESP snapshots are kept as sent)
+
+# Danger event log (modules/event_log.py, GET /events)
+EVENT_LOG_DIR = "events"
+EVENT_FLUSH_INTERVAL = 0.5     # s the writer thread collects events before appending a batch
+EVENT_BATCH_SIZE = 1000        # max events per write
+
+# DeepFace worker processes (modules/inference_pool.py)
+INFERENCE_PROCESSES = -1       # -1: from CPU cores, 0: run DeepFace in the calling thread
+INFERENCE_THREADS_PER_PROCESS = 2  # TensorFlow threads per worker process
+INFERENCE_TIMEOUT = 10.0       # s per call before the worker is restarted
+INFERENCE_START_TIMEOUT = 300.0    # s for a worker to load its models
+INFERENCE_FRAME_BYTES = 1600 * 1200 * 3  # shared-memory frame slot (larger frames are pickled)
+
+# ESP32 device health (modules/health.py)
+HEALTH_PROBE_INTERVAL = 5.0    # seconds between /status probes of an online device
+HEALTH_PROBE_TIMEOUT = 2.0     # probe request timeout
+HEALTH_OFFLINE_AFTER = 2       # consecutive failed probes before a device is "offline"
+RECONNECT_BACKOFF_BASE = 0.5   # first stream reconnect delay (s), doubled per failure
+RECONNECT_BACKOFF_MAX = 30.0   # upper bound of reconnect / probe delays (s)
+
+# ESP32 OLED updates (modules/oled.py)
+OLED_MAX_RATE = 2.0            # max POSTs per second per OLED target
+OLED_CONFIDENCE_DELTA = 0.10   # resend same emotion only if confidence moved by >= 0.10
+OLED_RESEND_INTERVAL = 10.0    # refresh an unchanged display every N s (0 = never)
+
+# Per-viewer output quality of /video_feed (modules/output_profiles.py)
+# Best first; "auto" viewers move along this order. quality 0 = the pipeline's JPEG as is.
+OUTPUT_PROFILES = {
+    "full": {"scale": 1.0, "quality": 0, "max_fps": 0},
+    "high": {"scale": 1.0, "quality": 75, "max_fps": 0},
+    "medium": {"scale": 0.75, "quality": 65, "max_fps": 15},
+    "low": {"scale": 0.5, "quality": 55, "max_fps": 10},
+    "minimal": {"scale": 0.25, "quality": 45, "max_fps": 5},
+}
+OUTPUT_PROFILE_DEFAULT = "auto"        # profile of viewers without ?profile= ("auto" = adaptive)
+OUTPUT_ADAPT_DEGRADE_SECONDS = 0.10    # step down when sending a frame blocks longer (moving average)
+OUTPUT_ADAPT_UPGRADE_SECONDS = 0.02    # step up after sends stayed below this...
+OUTPUT_ADAPT_UPGRADE_AFTER = 10.0      # ...for N seconds
+
+# Server-sent emotion updates (/emotions/stream)
+SSE_MAX_RATE = 10.0            # max events per second per client (coalesced, latest wins)
+SSE_HEARTBEAT = 15.0           # seconds between keep-alive comments
+
+# Default ESP32 OLED target (e.g. http://10.0.0.12/face_mood); main.py asks for it
+# interactively when unset and running in a terminal
+ESP32_OLED_URL = None
+
+# Production serving (serve.py): one pipeline process + lightweight web workers
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 5000
+WEB_WORKERS = 2                # gunicorn worker processes (no cameras / models)
+WEB_THREADS = 32               # threads per web worker (long-lived streams)
+PIPELINE_HOST = "127.0.0.1"
+PIPELINE_HTTP_PORT = 5001      # internal: full app in the pipeline process
+PIPELINE_RPC_PORT = 5002       # internal: frames / state for the web workers
+PIPELINE_AUTHKEY = ""          # RPC secret; generated by `serve.py`, required by the pipeline / web roles
+LOCAL_CAMERA = True            # pipeline process captures the local camera continuously
+FRAME_TRANSPORT = "shm"        # frames to web workers: "shm" (shared-memory rings) or "rpc" (other host)
+FRAME_RING_SLOTS = 4           # frames kept per source ring
+FRAME_RING_SLOT_BYTES = 1024 * 1024  # max encoded frame size
+
 # Emotion analysis optimization
 EMOTION_CONFIDENCE_THRESHOLD = 35.0  # minimum emotion confidence to consider valid (%)
 
@@ -30,14 +126,6 @@ emotion_labels = {
     "neutral": "Notr"
 }
 
-# Latest state data
-latest_state = {
-    "timestamp": None,
-    "emotions": None,
-    "main_emotion": None,
-    "danger_score": 0.0,
-}
-
 # ESP32 Camera optimal settings for emotion analysis
 ESP_OPTIMAL_SETTINGS = {
     "framesize": 8,        # XGA (1024x768) - optimal balance
@@ -62,6 +150,13 @@ ESP_OPTIMAL_SETTINGS = {
     "face_detect": 1,     # Face detection ON
 }
 
+# Named ESP32 camera presets (applied via esp_client.apply_preset / /esp_apply_preset)
+ESP_PRESETS = {
+    "emotion_analysis": ESP_OPTIMAL_SETTINGS,
+}
+ESP_PRESET_CONCURRENCY = 3   # parallel /control requests while applying a preset
+ESP_STATUS_TTL = 2.0         # seconds /esp_status answers from cache
+
 # ESP32 Resolution options
 ESP_FRAMESIZE_OPTIONS = {
     "UXGA": 10,    # 1600x1200
@@ -75,3 +170,64 @@ ESP_FRAMESIZE_OPTIONS = {
     "HQVGA": 2,    # 240x176
     "QQVGA": 1,    # 160x120
 }
+
+
+# ============================================
+# Overrides from config file / environment
+# ============================================
+
+def _parse_env(name, value, default):
+    """Env value in the type of the setting's default.
+
+    Strings are taken as is; other settings are JSON (numbers, lists,
+    true/false, null), falling back to the plain string for unset (None)
+    defaults.
+    """
+    if isinstance(default, str):
+        return value
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        if default is None:
+            return value
+        raise ValueError(f"{name}: cannot parse {value!r} as {type(default).__name__}") from None
+    if isinstance(default, bool):
+        if not isinstance(parsed, bool):
+            raise ValueError(f"{name} must be true or false, got {value!r}")
+    elif isinstance(default, (int, float)):
+        if isinstance(parsed, bool) or not isinstance(parsed, (int, float)):
+            raise ValueError(f"{name} must be a number, got {value!r}")
+    return parsed
+
+
+def _apply_overrides():
+    """Applies the overrides; returns the names of the overridden settings."""
+    names = [k for k in globals() if k.isupper()]
+    overrides = {}
+    config_file = os.environ.get("APP_CONFIG_FILE")
+    if config_file:
+        with open(config_file, encoding="utf-8") as f:
+            overrides.update(json.load(f))
+    for name in names:
+        if name in os.environ:
+            overrides[name] = _parse_env(name, os.environ[name], globals()[name])
+    unknown = set(overrides) - set(names)
+    if unknown:
+        raise ValueError(f"Unknown config keys: {sorted(unknown)}")
+    for name, value in overrides.items():
+        if isinstance(globals()[name], tuple) and isinstance(value, list):
+            value = tuple(value)
+        globals()[name] = value
+    return set(overrides)
+
+
+load_dotenv(os.environ.get("APP_ENV_FILE", ".env"))
+_overridden = _apply_overrides()
+# Settings derived from others follow their overrides unless set themselves
+if "CAPTURE_SEGMENT_DIR" not in _overridden:
+    CAPTURE_SEGMENT_DIR = os.path.join(CAPTURE_DIR, "segments")
+if "THUMBNAIL_DIR" not in _overridden:
+    THUMBNAIL_DIR = os.path.join(CAPTURE_DIR, "thumbs")
+if "ESP_PRESETS" not in _overridden:
+    ESP_PRESETS = {"emotion_analysis": ESP_OPTIMAL_SETTINGS}
+os.makedirs(CAPTURE_DIR, exist_ok=True)
@@ -9,16 +9,96 @@ ESP firmware (see `esp_system/app_httpd.cpp`).
 Functions:
  - get_snapshot(ip) -> bytes or None
  - send_command(ip, params) -> (status_code, content or json)
+ - get_status(ip) -> (status_code, settings dict or None)
+ - status_cache.get(ip) -> like get_status, cached for ESP_STATUS_TTL seconds
+ - apply_preset(ip, preset) -> per-setting results (only changed settings are sent)
 
 """
-from typing import Optional, Tuple
+import threading
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Union
 import requests
+from requests.adapters import HTTPAdapter
+from modules.config import ESP_PRESETS, ESP_PRESET_CONCURRENCY, ESP_STATUS_TTL
+from modules import metrics
 
 
 def _base_url(ip: str) -> str:
     return f'http://{ip}'
 
 
+def stream_url(ip: str) -> str:
+    """URL of the MJPEG stream server (port 81 of the firmware).
+
+    `ip` may carry a port (e.g. "127.0.0.1:8080" for the simulator); the
+    stream server is then expected on the next port.
+    """
+    host, sep, port = ip.rpartition(':')
+    if sep and port.isdigit():
+        return f'http://{host}:{int(port) + 1}/stream'
+    return f'http://{ip}:81/stream'
+
+
+class MJPEGParser:
+    """Incremental splitter of a multipart MJPEG body into JPEG frames.
+
+    Uses the part's Content-Length header (sent by the firmware) and falls
+    back to scanning for the JPEG SOI/EOI markers.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        """Adds received bytes and returns the complete frames found."""
+        self._buf += data
+        frames = []
+        while True:
+            start = self._buf.find(b'\xff\xd8')
+            if start == -1:
+                # Keep a possibly split header, drop older noise
+                del self._buf[:max(0, len(self._buf) - 256)]
+                return frames
+            header_end = self._buf.rfind(b'\r\n\r\n', 0, start)
+            length = None
+            if header_end != -1:
+                header = bytes(self._buf[max(0, header_end - 256):header_end]).lower()
+                pos = header.rfind(b'content-length:')
+                if pos != -1:
+                    try:
+                        length = int(header[pos + 15:].split(b'\r\n', 1)[0])
+                    except ValueError:
+                        length = None
+            if length is not None and header_end + 4 == start:
+                if len(self._buf) < start + length:
+                    return frames
+                frames.append(bytes(self._buf[start:start + length]))
+                del self._buf[:start + length]
+            else:
+                end = self._buf.find(b'\xff\xd9', start + 2)
+                if end == -1:
+                    return frames
+                frames.append(bytes(self._buf[start:end + 2]))
+                del self._buf[:end + 2]
+
+
+def _timed(op, failed):
+    """Records the duration (esp_request_seconds) and failures of an ESP call."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(ip, *args, **kwargs):
+            with metrics.ESP_REQUEST_SECONDS.time(op=op, ip=ip):
+                result = fn(ip, *args, **kwargs)
+            if failed(result):
+                metrics.ESP_REQUEST_ERRORS.inc(op=op, ip=ip)
+            return result
+        return wrapper
+    return decorator
+
+
+@_timed("snapshot", lambda jpeg: jpeg is None)
 def get_snapshot(ip: str, timeout: float = 5.0) -> Optional[bytes]:
     """GET a single JPEG snapshot from the ESP.
 
@@ -43,31 +123,31 @@ def get_snapshot(ip: str, timeout: float = 5.0) -> Optional[bytes]:
         url = _base_url(ip) + '/stream'
         r = requests.get(url, timeout=timeout, stream=True)
         if r.status_code == 200:
-            # read a chunk and try to find JPEG start/end
-            data = b''
-            for chunk in r.iter_content(1024):
+            # read chunks until the first complete JPEG part
+            parser = MJPEGParser()
+            for chunk in r.iter_content(4096):
                 if not chunk:
                     break
-                data += chunk
-                # naive JPEG start/end search
-                start = data.find(b'\xff\xd8')
-                end = data.find(b'\xff\xd9')
-                if start != -1 and end != -1 and end > start:
-                    return data[start:end+2]
+                frames = parser.feed(chunk)
+                if frames:
+                    return frames[0]
     except requests.RequestException:
         pass
     return None
 
 
-def send_command(ip: str, params: dict, timeout: float = 5.0) -> Tuple[int, Optional[object]]:
+@_timed("control", lambda result: result[0] != 200)
+def send_command(ip: str, params: dict, timeout: float = 5.0,
+                 http: Optional[requests.Session] = None) -> Tuple[int, Optional[object]]:
     """Send a GET request with query parameters to the ESP /control endpoint.
 
     Example usage: send_command('10.0.0.12', {'var': 'framesize', 'val': '8'})
     The ESP firmware uses /control endpoint with 'var' and 'val' parameters.
+    `http` is an optional keep-alive session.
     """
     try:
         url = _base_url(ip) + '/control'
-        r = requests.get(url, params=params, timeout=timeout)
+        r = (http or requests).get(url, params=params, timeout=timeout)
         try:
             return r.status_code, r.json()
         except ValueError:
@@ -76,14 +156,16 @@ def send_command(ip: str, params: dict, timeout: float = 5.0) -> Tuple[int, Opti
         return 0, str(e)
 
 
-def get_status(ip: str, timeout: float = 5.0) -> Tuple[int, Optional[dict]]:
+@_timed("status", lambda result: result[0] != 200)
+def get_status(ip: str, timeout: float = 5.0,
+               http: Optional[requests.Session] = None) -> Tuple[int, Optional[dict]]:
     """Get current camera status and settings from ESP /status endpoint.
     
     Returns: (status_code, settings_dict)
     """
     try:
         url = _base_url(ip) + '/status'
-        r = requests.get(url, timeout=timeout)
+        r = (http or requests).get(url, timeout=timeout)
         if r.status_code == 200:
             return r.status_code, r.json()
         return r.status_code, None
@@ -91,61 +173,149 @@ def get_status(ip: str, timeout: float = 5.0) -> Tuple[int, Optional[dict]]:
         return 0, None
 
 
+class StatusCache:
+    """Short-lived cache of `get_status()` results per ESP.
+
+    Concurrent lookups of the same IP share one in-flight request, so many
+    dashboards polling /esp_status cost the device one request per TTL.
+    Only successful responses are cached.
+    """
+
+    def __init__(self, ttl: float = ESP_STATUS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}      # ip -> (fetched_at, status, settings)
+        self._inflight = {}     # ip -> _Fetch
+        self._generation = {}   # ip -> bumped on invalidate
+        self.hits = 0
+        self.misses = 0
+
+    class _Fetch:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = (0, None)
+
+    def get(self, ip: str, timeout: float = 5.0) -> Tuple[int, Optional[dict], float]:
+        """Returns (status_code, settings, age in seconds of the result)."""
+        with self._lock:
+            entry = self._entries.get(ip)
+            now = time.time()
+            if entry is not None and now - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1], entry[2], now - entry[0]
+            fetch = self._inflight.get(ip)
+            owner = fetch is None
+            if owner:
+                fetch = self._inflight[ip] = self._Fetch()
+                generation = self._generation.get(ip, 0)
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not owner:
+            # Another request is already fetching this IP: share its result
+            fetch.done.wait(timeout)
+            return fetch.result + (0.0,)
+
+        try:
+            fetch.result = get_status(ip, timeout)
+            status, settings = fetch.result
+            with self._lock:
+                # Skip caching if a setting changed while the request was in flight
+                if status == 200 and settings and self._generation.get(ip, 0) == generation:
+                    self._entries[ip] = (time.time(), status, settings)
+            return status, settings, 0.0
+        finally:
+            with self._lock:
+                self._inflight.pop(ip, None)
+            fetch.done.set()
+
+    def invalidate(self, ip: Optional[str] = None):
+        """Drops the cached status of `ip` (all IPs if None)."""
+        with self._lock:
+            ips = list(self._entries) + list(self._inflight) if ip is None else [ip]
+            for key in ips:
+                self._entries.pop(key, None)
+                self._generation[key] = self._generation.get(key, 0) + 1
+
+
+def diff_settings(current: Optional[dict], wanted: dict) -> dict:
+    """Returns the settings of `wanted` that differ from `current`.
+
+    Settings missing from `current` (e.g. `vflip`, which /status does not
+    report) are always included.
+    """
+    current = current or {}
+    changed = {}
+    for var, val in wanted.items():
+        try:
+            same = var in current and int(current[var]) == int(val)
+        except (TypeError, ValueError):
+            same = str(current.get(var)) == str(val)
+        if not same:
+            changed[var] = val
+    return changed
+
+
+def _session(pool_size: int) -> requests.Session:
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    http.mount('http://', adapter)
+    return http
+
+
+def apply_preset(ip: str, preset: Union[str, dict] = "emotion_analysis", timeout: float = 5.0,
+                 concurrency: int = ESP_PRESET_CONCURRENCY) -> dict:
+    """Apply a named preset (see ESP_PRESETS in modules/config.py) or a settings dict.
+
+    Reads /status once and sends only the settings that differ, over one
+    keep-alive session with at most `concurrency` requests in flight.
+    Re-applying an already applied preset costs the /status request plus
+    the settings /status does not report (e.g. `vflip`), which are always
+    sent.
+
+    Returns: {"preset", "success", "sent", "unchanged", "results": {var: {"value", "status", "ok"}}}
+    Raises KeyError for an unknown preset name.
+    """
+    settings = ESP_PRESETS[preset] if isinstance(preset, str) else preset
+    with _session(max(1, concurrency)) as http:
+        status, current = get_status(ip, timeout, http=http)
+        changed = diff_settings(current if status == 200 else None, settings)
+
+        def _send(item):
+            var, val = item
+            code, _ = send_command(ip, {'var': var, 'val': str(val)}, timeout, http=http)
+            return var, {"value": val, "status": code, "ok": code == 200}
+
+        results = {}
+        if changed:
+            with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(changed)))) as pool:
+                results = dict(pool.map(_send, changed.items()))
+
+    if results:
+        status_cache.invalidate(ip)
+    for var, result in results.items():
+        if not result["ok"]:
+            print(f"Failed to set {var}={result['value']}")
+    return {
+        "preset": preset if isinstance(preset, str) else None,
+        "success": all(r["ok"] for r in results.values()),
+        "sent": len(results),
+        "unchanged": [var for var in settings if var not in changed],
+        "results": results,
+    }
+
+
 def apply_emotion_analysis_preset(ip: str, timeout: float = 5.0) -> bool:
     """Apply optimal camera settings for emotion analysis.
-    
-    Optimal settings:
-    - framesize: 8 (XGA 1024x768) - Good balance for face detection
-    - quality: 10 (Best JPEG quality)
-    - brightness: 0 (Default, adjust based on lighting)
-    - contrast: 0 (Default, good for facial features)
-    - saturation: 0 (Natural colors for skin tone detection)
-    - awb: 1 (Auto White Balance ON - critical for accurate face analysis)
-    - awb_gain: 1 (AWB gain ON)
-    - aec: 1 (Auto Exposure ON)
-    - aec2: 1 (DSP-based exposure ON)
-    - ae_level: 0 (Default exposure level)
-    - agc: 1 (Auto Gain ON)
-    - gainceiling: 2 (Moderate gain ceiling to reduce noise)
-    - bpc: 1 (Black pixel correction ON)
-    - wpc: 1 (White pixel correction ON)
-    - raw_gma: 1 (Raw gamma ON for better dynamic range)
-    - lenc: 1 (Lens correction ON)
-    - hmirror: 0 (No horizontal mirror)
-    - vflip: 0 (No vertical flip)
-    - dcw: 1 (Downsize EN for better performance)
-    - face_detect: 1 (Face detection ON)
-    
+
+    The settings are `ESP_PRESETS["emotion_analysis"]` (ESP_OPTIMAL_SETTINGS
+    in modules/config.py); only the ones that differ are sent.
+
     Returns: True if all settings applied successfully
     """
-    settings = [
-        ('framesize', 8),      # XGA 1024x768
-        ('quality', 10),        # Best quality
-        ('brightness', 0),      # Default brightness
-        ('contrast', 0),        # Default contrast
-        ('saturation', 0),      # Natural saturation
-        ('awb', 1),            # Auto White Balance ON
-        ('awb_gain', 1),       # AWB gain ON
-        ('aec', 1),            # Auto Exposure ON
-        ('aec2', 1),           # DSP exposure ON
-        ('ae_level', 0),       # Default AE level
-        ('agc', 1),            # Auto Gain ON
-        ('gainceiling', 2),    # Moderate gain ceiling
-        ('bpc', 1),            # Black pixel correction
-        ('wpc', 1),            # White pixel correction
-        ('raw_gma', 1),        # Raw gamma
-        ('lenc', 1),           # Lens correction
-        ('hmirror', 0),        # No mirror
-        ('vflip', 0),          # No flip
-        ('dcw', 1),            # Downsize enable
-        ('face_detect', 1),    # Face detection ON
-    ]
-    
-    success = True
-    for var, val in settings:
-        status, _ = send_command(ip, {'var': var, 'val': str(val)}, timeout)
-        if status != 200:
-            success = False
-            print(f"Failed to set {var}={val}")
-    
-    return success
+    return apply_preset(ip, "emotion_analysis", timeout)["success"]
+
+
+# Global ESP status cache
+status_cache = StatusCache()
@@ -0,0 +1,221 @@
+"""
+asyncio ESP client
+
+Async counterpart of `modules/esp_client.py` for managing many ESP32 boards
+from one process without a thread per in-flight request. Covers snapshot,
+MJPEG stream iteration, `/control`, `/status` and `/face_mood`, plus fleet
+operations with bounded concurrency:
+
+    async with AsyncESPClient() as esp:
+        statuses = await esp.status_all(["10.0.0.12", "10.0.0.13"])
+        results = await esp.apply_preset_all(ips, "emotion_analysis")
+
+Connections per host are limited (`limit_per_host`, the firmware's HTTP
+server is small), every call has a timeout and cancelling the calling task
+aborts the request. `ip` may include a port to talk to a local stand-in
+server (see `esp_client.stream_url`).
+
+CLI: python -m modules.esp_client_async status|preset <ip> [<ip> ...]
+"""
+import sys
+import json
+import asyncio
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple, Union
+import aiohttp
+from modules.config import ESP_PRESETS, ESP_PRESET_CONCURRENCY
+from modules.esp_client import _base_url, stream_url, diff_settings, MJPEGParser
+
+SNAPSHOT_PATHS = ('/capture', '/capture.jpg', '/jpg', '/snapshot')
+
+
+class AsyncESPClient:
+    """Shared aiohttp session with per-host connection limits."""
+
+    def __init__(self, timeout: float = 5.0, limit_per_host: int = 2, limit: int = 100,
+                 fleet_concurrency: int = 16):
+        self.timeout = timeout
+        self.limit_per_host = limit_per_host
+        self.limit = limit
+        self.fleet_concurrency = fleet_concurrency
+        self._session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _timeout(self, timeout):
+        return aiohttp.ClientTimeout(total=timeout if timeout is not None else self.timeout)
+
+    # ---- single device ---------------------------------------------------
+
+    async def get_snapshot(self, ip: str, timeout: Optional[float] = None) -> Optional[bytes]:
+        """GET a single JPEG (same endpoints as `esp_client.get_snapshot`)."""
+        session = await self.open()
+        for path in SNAPSHOT_PATHS:
+            try:
+                async with session.get(_base_url(ip) + path, timeout=self._timeout(timeout)) as r:
+                    if r.status == 200 and r.content_type.startswith('image'):
+                        return await r.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                continue
+        return None
+
+    async def iter_stream(self, ip: str, read_timeout: Optional[float] = None,
+                          chunk_size: int = 16384) -> AsyncIterator[bytes]:
+        """Yields JPEG frames of the MJPEG stream until cancelled or closed.
+
+        `read_timeout` bounds the wait for each chunk (the stream itself has
+        no total timeout).
+        """
+        session = await self.open()
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=read_timeout or self.timeout)
+        parser = MJPEGParser()
+        async with session.get(stream_url(ip), timeout=timeout) as r:
+            r.raise_for_status()
+            async for chunk in r.content.iter_chunked(chunk_size):
+                for frame in parser.feed(chunk):
+                    yield frame
+
+    async def send_command(self, ip: str, params: dict,
+                           timeout: Optional[float] = None) -> Tuple[int, Optional[object]]:
+        """GET /control with query params. Returns (status, json or text); (0, error) on failure."""
+        session = await self.open()
+        params = {k: str(v) for k, v in params.items()}
+        try:
+            async with session.get(_base_url(ip) + '/control', params=params,
+                                   timeout=self._timeout(timeout)) as r:
+                text = await r.text()
+                try:
+                    return r.status, json.loads(text)
+                except ValueError:
+                    return r.status, text
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return 0, str(e) or type(e).__name__
+
+    async def get_status(self, ip: str, timeout: Optional[float] = None) -> Tuple[int, Optional[dict]]:
+        """GET /status. Returns (status, settings dict or None)."""
+        session = await self.open()
+        try:
+            async with session.get(_base_url(ip) + '/status', timeout=self._timeout(timeout)) as r:
+                if r.status == 200:
+                    return r.status, await r.json(content_type=None)
+                return r.status, None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return 0, None
+
+    async def send_emotion(self, url: str, emotion: str, confidence: float,
+                           timeout: float = 0.5) -> bool:
+        """POSTs {"emotion", "confidence"} to an OLED /face_mood URL."""
+        session = await self.open()
+        try:
+            async with session.post(url, json={"emotion": emotion, "confidence": float(confidence)},
+                                    timeout=self._timeout(timeout)) as r:
+                return r.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def apply_preset(self, ip: str, preset: Union[str, dict] = "emotion_analysis",
+                           timeout: Optional[float] = None,
+                           concurrency: int = ESP_PRESET_CONCURRENCY) -> dict:
+        """Async `esp_client.apply_preset`: one /status, then only the changed settings."""
+        settings = ESP_PRESETS[preset] if isinstance(preset, str) else preset
+        status, current = await self.get_status(ip, timeout)
+        changed = diff_settings(current if status == 200 else None, settings)
+
+        async def _send(var, val):
+            code, _ = await self.send_command(ip, {'var': var, 'val': val}, timeout)
+            return var, {"value": val, "status": code, "ok": code == 200}
+
+        results = dict(await bounded_gather(
+            (_send(var, val) for var, val in changed.items()), concurrency))
+        return {
+            "preset": preset if isinstance(preset, str) else None,
+            "success": all(r["ok"] for r in results.values()),
+            "sent": len(results),
+            "unchanged": [var for var in settings if var not in changed],
+            "results": results,
+        }
+
+    # ---- fleet -----------------------------------------------------------
+
+    async def _fleet(self, ips, fn, concurrency):
+        ips = list(ips)
+
+        async def _one(ip):
+            return ip, await fn(ip)
+
+        return dict(await bounded_gather((_one(ip) for ip in ips),
+                                         concurrency or self.fleet_concurrency))
+
+    async def status_all(self, ips: Iterable[str], concurrency: Optional[int] = None) -> Dict[str, tuple]:
+        """{ip: (status, settings)} for all devices."""
+        return await self._fleet(ips, self.get_status, concurrency)
+
+    async def snapshot_all(self, ips: Iterable[str], concurrency: Optional[int] = None) -> Dict[str, Optional[bytes]]:
+        """{ip: jpeg bytes or None} for all devices."""
+        return await self._fleet(ips, self.get_snapshot, concurrency)
+
+    async def apply_preset_all(self, ips: Iterable[str], preset: Union[str, dict] = "emotion_analysis",
+                               concurrency: Optional[int] = None) -> Dict[str, dict]:
+        """{ip: apply_preset result} for all devices."""
+        return await self._fleet(ips, lambda ip: self.apply_preset(ip, preset), concurrency)
+
+    async def send_emotion_all(self, urls: Iterable[str], emotion: str, confidence: float,
+                               concurrency: Optional[int] = None) -> Dict[str, bool]:
+        """{url: delivered} for a set of OLED targets."""
+        return await self._fleet(urls, lambda url: self.send_emotion(url, emotion, confidence), concurrency)
+
+
+async def bounded_gather(coros, concurrency: int) -> list:
+    """Awaits `coros` with at most `concurrency` running at a time (results in order).
+
+    If one raises or the caller is cancelled, the remaining ones are cancelled.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(coro):
+        async with semaphore:
+            return await coro
+
+    tasks = [asyncio.ensure_future(_run(c)) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def _main(argv):
+    command, ips = argv[0], argv[1:]
+    async with AsyncESPClient() as esp:
+        if command == "status":
+            result = {ip: {"status": s, "settings": settings}
+                      for ip, (s, settings) in (await esp.status_all(ips)).items()}
+        elif command == "preset":
+            result = await esp.apply_preset_all(ips)
+        else:
+            raise SystemExit(__doc__)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+    else:
+        asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,347 @@
+"""
+Append-only danger event log with a time index
+
+Danger detections of all sources are persisted as fixed-size records
+(32 bytes) in one append-only file, plus a small append-only table of the
+source names the records refer to:
+
+    events/events.log      header | record | record | ...
+    events/sources.txt     one source id per line (line number = source index)
+
+Event kinds:
+ - "new"          a new dangerous person was registered (person id, score)
+ - "sighting"     an already registered person was recognized again
+ - "unrecognized" danger without a usable face embedding
+ - "peak"         highest danger score of an episode (score above
+                  DANGER_THRESHOLD until it drops below again), with the
+                  last person identified during the episode
+
+Each record carries the time of the event (`ts`) and the time it was
+logged (`logged`: a peak is logged when its episode ends, other events when
+they happen). Records are written in `logged` order (a batch is sorted, and
+a `logged` older than the last written one is raised to it), so the file
+itself is the time index: `query()` maps it as a NumPy record array,
+binary-searches the range of `logged` that can hold events of the requested
+time range (widened by the largest logged - ts gap written), then filters
+time / person / source / kind vectorized, which stays in the milliseconds
+with millions of events.
+
+The frame loops only put events on a queue (`log()` / `observe_danger()`);
+a writer thread appends them in batches every EVENT_FLUSH_INTERVAL seconds.
+"""
+import os
+import mmap
+import time
+import queue
+import atexit
+import struct
+import threading
+import numpy as np
+from modules.config import EVENT_LOG_DIR, EVENT_FLUSH_INTERVAL, EVENT_BATCH_SIZE, DANGER_THRESHOLD
+
+_MAGIC = b"DEVT"
+_VERSION = 2
+# magic, version, padding to one record
+_HEADER = struct.Struct("<4sI24x")
+
+RECORD = np.dtype([
+    ("logged", "<f8"),    # unix time the event was logged (file order)
+    ("ts", "<f8"),        # unix time of the event
+    ("kind", "u1"),
+    ("_pad", "u1"),
+    ("source", "<u2"),    # line in sources.txt
+    ("score", "<f4"),     # danger score (%)
+    ("person", "S8"),     # person id (empty if none)
+])
+
+KINDS = ("new", "sighting", "unrecognized", "peak")
+_KIND_CODES = {name: code for code, name in enumerate(KINDS, start=1)}
+
+
+class EventLog:
+    """Append-only event file with batched writes and range queries."""
+
+    def __init__(self, directory, flush_interval=EVENT_FLUSH_INTERVAL, batch_size=EVENT_BATCH_SIZE):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, "events.log")
+        self._sources_path = os.path.join(directory, "sources.txt")
+
+        self._lock = threading.Lock()
+        self._sources = []
+        self._source_index = {}
+        self._map = None
+        self._mapped = 0
+        self._load_sources()
+        self._open()
+
+        self._queue = queue.SimpleQueue()
+        self._episodes = {}  # source -> [peak score, peak time, person]
+        self.written = 0
+        self._thread = threading.Thread(target=self._write_loop, name="event-log", daemon=True)
+        self._thread.start()
+
+    # -----------------------
+    # Files
+    # -----------------------
+    def _load_sources(self):
+        if os.path.exists(self._sources_path):
+            with open(self._sources_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        self._add_source(line[:-1])
+        self._sources_file = open(self._sources_path, "a", encoding="utf-8")
+
+    def _add_source(self, source):
+        self._source_index[source] = len(self._sources)
+        self._sources.append(source)
+
+    def _source_id(self, source):
+        index = self._source_index.get(source)
+        if index is None:
+            # Only the writer thread adds sources
+            self._sources_file.write(source.replace("\n", " ") + "\n")
+            self._sources_file.flush()
+            self._add_source(source)
+            index = self._source_index[source]
+        return index
+
+    def _open(self):
+        size = os.path.getsize(self._path) if os.path.exists(self._path) else 0
+        if size < _HEADER.size:
+            with open(self._path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION))
+        else:
+            with open(self._path, "rb") as f:
+                magic, version = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"Not an event log: {self._path}")
+            if version != _VERSION:
+                raise ValueError(f"Event log {self._path} has version {version}, expected {_VERSION}")
+            torn = (size - _HEADER.size) % RECORD.itemsize
+            if torn:
+                # Partially written record from a crash
+                with open(self._path, "r+b") as f:
+                    f.truncate(size - torn)
+                print("⚠️ Event log truncated to last complete record")
+        self._file = open(self._path, "ab")
+        self._count = (self._file.tell() - _HEADER.size) // RECORD.itemsize
+        records = self._records()
+        self._last_logged = float(records[-1]["logged"]) if self._count else 0.0
+        # Largest logged - ts gap: how far before a `logged` position events can lie
+        self._max_lag = float((records["logged"] - records["ts"]).max()) if self._count else 0.0
+
+    def __len__(self):
+        return self._count
+
+    # -----------------------
+    # Writing
+    # -----------------------
+    def log(self, kind, source, person=None, score=0.0, ts=None, logged=None):
+        """Queues one event (safe to call from the frame loops).
+
+        `logged` (default: `ts`) is when the event became known, for events
+        reported after the fact. Raises ValueError for an unknown `kind`.
+        """
+        if kind not in _KIND_CODES:
+            raise ValueError(f"Unknown event kind: {kind!r} (expected one of {', '.join(KINDS)})")
+        ts = time.time() if ts is None else ts
+        self._queue.put((ts if logged is None else max(logged, ts), ts, kind, source, person, float(score)))
+
+    def observe_danger(self, source, score, person=None, ts=None, threshold=DANGER_THRESHOLD):
+        """Per-frame danger score of `source`; logs a "peak" when an episode ends."""
+        episode = self._episodes.get(source)
+        if score > threshold:
+            if episode is None:
+                self._episodes[source] = [score, time.time() if ts is None else ts, person]
+            else:
+                if score > episode[0]:
+                    episode[0], episode[1] = score, time.time() if ts is None else ts
+                if person:
+                    episode[2] = person
+        elif episode is not None:
+            del self._episodes[source]
+            self.log("peak", source, episode[2], episode[0], ts=episode[1],
+                     logged=time.time() if ts is None else ts)
+
+    def note_person(self, source, person):
+        """Attributes the current danger episode of `source` to `person`."""
+        episode = self._episodes.get(source)
+        if episode is not None and person:
+            episode[2] = person
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # flush() / close() markers end the batch early
+            while len(batch) < self.batch_size and isinstance(batch[-1], tuple):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            events = [e for e in batch if isinstance(e, tuple)]
+            try:
+                self._write(events)
+            except Exception as e:
+                # Drop the batch, keep the writer running
+                print(f"⚠️ Event log batch of {len(events)} events dropped: {e!r}")
+            for marker in batch:
+                if isinstance(marker, threading.Event):
+                    marker.set()
+            if None in batch:
+                return
+
+    def _write(self, batch):
+        if not batch:
+            return
+        batch.sort(key=lambda e: e[0])
+        records = np.zeros(len(batch), dtype=RECORD)
+        n = 0
+        for logged, ts, kind, source, person, score in batch:
+            # Keep the file sorted by `logged` (it is the time index); `ts` stays as is
+            logged = max(logged, self._last_logged)
+            try:
+                records[n] = (logged, ts, _KIND_CODES[kind], 0, self._source_id(source), score,
+                              (person or "").encode("ascii", "replace")[:8])
+            except (KeyError, OverflowError, TypeError, ValueError) as e:
+                # e.g. more sources than the u2 index holds: skip just this event
+                print(f"⚠️ Event log dropped {kind} event of {source}: {e!r}")
+                continue
+            self._last_logged = logged
+            n += 1
+        if not n:
+            return
+        records = records[:n]
+        lag = float((records["logged"] - records["ts"]).max())
+        try:
+            self._file.write(records.tobytes())
+            self._file.flush()
+        except OSError as e:
+            print(f"⚠️ Event log write failed: {e}")
+            return
+        with self._lock:
+            self._max_lag = max(self._max_lag, lag)
+            self._count += len(records)
+        self.written += len(records)
+
+    def flush(self, timeout=5.0):
+        """Waits until the events queued so far are written."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        # Ongoing episodes end with the process
+        for source in list(self._episodes):
+            self.observe_danger(source, 0.0)
+        self._queue.put(None)
+        self._thread.join(timeout=10.0)
+        self._file.close()
+        self._sources_file.close()
+
+    # -----------------------
+    # Queries
+    # -----------------------
+    def _records(self):
+        """Record array over an mmap of the written events (remapped as the file grows)."""
+        with self._lock:
+            count = self._count
+            if count == 0:
+                return np.zeros(0, dtype=RECORD)
+            if self._map is None or self._mapped < count:
+                with open(self._path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), _HEADER.size + count * RECORD.itemsize,
+                                          access=mmap.ACCESS_READ)
+                self._mapped = count
+            return np.frombuffer(self._map, dtype=RECORD, count=count, offset=_HEADER.size)
+
+    def query(self, since=None, until=None, person=None, source=None, kind=None, limit=1000):
+        """Events with since <= ts < until, optionally filtered; oldest first.
+
+        Returns (events, total) where total counts all matches (events holds
+        at most `limit` of them).
+        """
+        records = self._records()
+        lag = self._max_lag
+        logged = records["logged"]
+        # Events of [since, until) were logged in [since, until + lag)
+        lo = int(np.searchsorted(logged, since, side="left")) if since is not None else 0
+        hi = int(np.searchsorted(logged, until + lag, side="left")) if until is not None else len(records)
+        window = records[lo:hi]
+
+        mask = None
+        if lag > 0:
+            # The window's edges can hold events from outside the range
+            if since is not None:
+                mask = window["ts"] >= since
+            if until is not None:
+                match = window["ts"] < until
+                mask = match if mask is None else mask & match
+        if person:
+            match = window["person"] == person.encode("ascii", "replace")[:8]
+            mask = match if mask is None else mask & match
+        if source:
+            index = self._source_index.get(source)
+            if index is None:
+                return [], 0
+            match = window["source"] == index
+            mask = match if mask is None else mask & match
+        if kind:
+            match = window["kind"] == _KIND_CODES[kind]
+            mask = match if mask is None else mask & match
+        if mask is None and lag == 0:
+            total = len(window)
+            selected = window[:limit]
+        else:
+            hits = np.flatnonzero(mask) if mask is not None else np.arange(len(window))
+            total = len(hits)
+            if lag > 0:
+                # Peaks are filed at their episode end: order by event time.
+                # The first `limit` events by time were logged before the
+                # latest event time among the first `limit` hits + lag.
+                if total > limit:
+                    end = np.searchsorted(window["logged"], window["ts"][hits[:limit]].max() + lag, side="right")
+                    hits = hits[:int(np.searchsorted(hits, end))]
+                hits = hits[np.argsort(window["ts"][hits], kind="stable")]
+            selected = window[hits[:limit]]
+
+        sources = self._sources
+        events = [{
+            "timestamp": float(r["ts"]),
+            "kind": KINDS[r["kind"] - 1],
+            "source": sources[r["source"]],
+            "person": r["person"].decode("ascii") or None,
+            "score": round(float(r["score"]), 2),
+        } for r in selected]
+        return events, total
+
+    def stats(self):
+        records = self._records()
+        return {
+            "events": len(records),
+            "sources": len(self._sources),
+            "first": float(records["ts"].min()) if len(records) else None,
+            "last": float(records["ts"].max()) if len(records) else None,
+            "queued": self._queue.qsize(),
+        }
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_event_log():
+    """The process-wide event log in EVENT_LOG_DIR (opened on first use)."""
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = EventLog(EVENT_LOG_DIR)
+                atexit.register(_log.close)
+    return _log
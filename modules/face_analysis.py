@@ -3,19 +3,21 @@ Face analysis, emotion detection, and person recognition operations
 """
 import numpy as np
 from deepface import DeepFace
-from collections import deque
+import threading
 import requests
 import json
-from modules.config import HISTORY_SIZE, FACE_SIMILARITY_THRESHOLD
+from modules.config import HISTORY_SIZE, FACE_SIMILARITY_THRESHOLD, ESP32_OLED_URL
+from modules import inference_pool, metrics
 
-# ESP32 target URL for emotion data (can be set by user)
-ESP32_TARGET_URL = None
+# Default ESP32 OLED target URL for emotion data (can be set by user).
+# Sessions without their own target (see modules/session.py) use this one.
+ESP32_TARGET_URL = ESP32_OLED_URL
 
-# Emotion history
-emotion_history = deque(maxlen=HISTORY_SIZE)
+# Emotion order used for all emotion vectors (DeepFace order)
+EMOTION_KEYS = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+# Indices of the emotions summed into the danger score (angry + disgust + fear)
+DANGER_INDICES = (0, 1, 2)
 
-# Face embeddings of registered dangerous persons
-registered_dangerous_faces = {}
 
 
 # -----------------------
@@ -77,6 +79,269 @@ def preprocess_face(image, bbox=None, output_size=(224, 224), clahe=True):
 # -----------------------
 # Temporal Smoothing
 # -----------------------
+class SmootherBank:
+    """EMA + hysteresis smoothing state for N emotion streams in one array.
+
+    Every stream owns one row of an (N x 7) state array, so all streams can
+    be advanced in a single vectorized step (`update`) and a single stream
+    with `update_row`, both without per-frame allocations (all buffers are
+    preallocated and written with `out=`). Whole sequences are smoothed
+    with `smooth_sequence`.
+
+    Semantics match the original deque-based smoother:
+    - input vectors are normalized; all-zero vectors are ignored
+    - EMA with `ema_alpha` (newest weight), output normalized
+    - hysteresis: once more than 3 vectors were seen, the previous dominant
+      emotion gets a `hysteresis` boost (x1.05) before re-normalizing
+    The EMA is kept recursively instead of being rebuilt over the last
+    `maxlen` vectors; the difference is the truncated tail weight
+    (1 - ema_alpha) ** maxlen (~6e-6 with the defaults).
+    """
+    def __init__(self, capacity=8, maxlen=10, ema_alpha=0.7, hysteresis=1.05):
+        self.maxlen = maxlen
+        self.ema_alpha = ema_alpha
+        self.hysteresis = hysteresis
+        self._lock = threading.Lock()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        width = len(EMOTION_KEYS)
+        old = getattr(self, "_ema", None)
+        used = 0 if old is None else len(old)
+
+        def grow(name, shape, dtype, fill=0):
+            arr = _np.full(shape, fill, dtype=dtype)
+            prev = getattr(self, name, None)
+            if prev is not None:
+                arr[:used] = prev
+            setattr(self, name, arr)
+
+        grow("_ema", (capacity, width), _np.float32)
+        grow("_out", (capacity, width), _np.float32)
+        grow("_count", capacity, _np.int32)
+        grow("_dominant", capacity, _np.int64, -1)
+        grow("_in_use", capacity, bool, False)
+        # Scratch buffers (per row, so concurrent single-row updates never share one)
+        self._norm = _np.zeros((capacity, width), dtype=_np.float32)
+        self._cand = _np.zeros((capacity, width), dtype=_np.float32)
+        self._boost = _np.ones((capacity, width), dtype=_np.float32)
+        self._sums = _np.zeros(capacity, dtype=_np.float32)
+        self._factor = _np.zeros(capacity, dtype=_np.float32)
+        self._valid = _np.zeros(capacity, dtype=bool)
+        self._first = _np.zeros(capacity, dtype=bool)
+        self._hyst = _np.zeros(capacity, dtype=bool)
+        self._not_hyst = _np.zeros(capacity, dtype=bool)
+        self._dom_idx = _np.zeros(capacity, dtype=_np.int64)
+        self._argmax = _np.zeros(capacity, dtype=_np.int64)
+        self._rows = _np.arange(capacity)
+
+    @property
+    def capacity(self):
+        return len(self._ema)
+
+    def acquire(self):
+        """Reserves a stream row and returns its index (grows the bank if full)."""
+        with self._lock:
+            free = _np.flatnonzero(~self._in_use)
+            if len(free) == 0:
+                slot = self.capacity
+                self._allocate(self.capacity * 2)
+            else:
+                slot = int(free[0])
+            self._in_use[slot] = True
+            self._reset(slot)
+            return slot
+
+    def release(self, slot):
+        with self._lock:
+            self._in_use[slot] = False
+            self._reset(slot)
+
+    def reset(self, slot):
+        with self._lock:
+            self._reset(slot)
+
+    def _reset(self, slot):
+        self._ema[slot] = 0.0
+        self._out[slot] = 0.0
+        self._count[slot] = 0
+        self._dominant[slot] = -1
+
+    def dominant(self, slot):
+        d = int(self._dominant[slot])
+        return None if d < 0 else d
+
+    def current(self, slot):
+        """Last smoothed output of a stream (view) or None."""
+        if self._count[slot] == 0:
+            return None
+        return self._out[slot]
+
+    def update_row(self, slot, prob_vector):
+        """Advances one stream. Returns its smoothed vector (a view) or None."""
+        with self._lock:
+            vec = self._norm[slot]
+            vec[:] = prob_vector
+            total = vec.sum()
+            if total <= 0:
+                # avoid invalid vectors
+                return None
+            vec /= (total + 1e-8)
+
+            ema = self._ema[slot]
+            if self._count[slot] == 0:
+                ema[:] = vec
+            else:
+                ema *= (1.0 - self.ema_alpha)
+                vec *= self.ema_alpha
+                ema += vec
+            if self._count[slot] < self.maxlen:
+                self._count[slot] += 1
+
+            out = self._out[slot]
+            _np.divide(ema, ema.sum() + 1e-8, out=out)
+
+            # Hysteresis: son dominant emotion'a hafif bias ekle (titremeyi azaltır)
+            last = self._dominant[slot]
+            if last >= 0 and self._count[slot] > 3:
+                out[last] *= self.hysteresis
+                out /= out.sum()
+            self._dominant[slot] = out.argmax()
+            return out
+
+    def update(self, values, mask=None):
+        """Advances the first len(values) streams in one vectorized step.
+
+        `values` is an (n x 7) array aligned with the stream rows, `mask` an
+        optional (n,) bool array of rows that carry a new vector. Returns
+        (smoothed (n x 7) view, updated (n,) bool view); rows that were not
+        updated keep their previous output.
+        """
+        with self._lock:
+            n = len(values)
+            if n > self.capacity:
+                raise ValueError(f"{n} rows but only {self.capacity} streams")
+            alpha = self.ema_alpha
+            norm, cand, boost = self._norm[:n], self._cand[:n], self._boost[:n]
+            sums, factor = self._sums[:n], self._factor[:n]
+            valid, first = self._valid[:n], self._first[:n]
+            hyst, not_hyst = self._hyst[:n], self._not_hyst[:n]
+            ema, out = self._ema[:n], self._out[:n]
+            count, dominant = self._count[:n], self._dominant[:n]
+            rows, dom_idx, argmax = self._rows[:n], self._dom_idx[:n], self._argmax[:n]
+
+            # normalize inputs, skip empty / masked rows
+            _np.sum(values, axis=1, out=sums)
+            _np.greater(sums, 0, out=valid)
+            if mask is not None:
+                _np.logical_and(valid, mask, out=valid)
+            sums += 1e-8
+            _np.divide(values, sums[:, None], out=norm)
+
+            # EMA step (first vector of a stream initializes it)
+            _np.multiply(ema, 1.0 - alpha, out=cand)
+            _np.multiply(norm, alpha, out=boost)
+            cand += boost
+            _np.equal(count, 0, out=first)
+            _np.logical_and(first, valid, out=first)
+            _np.copyto(cand, norm, where=first[:, None])
+            _np.copyto(ema, cand, where=valid[:, None])
+            count += valid
+            _np.minimum(count, self.maxlen, out=count)
+
+            # normalized output
+            _np.sum(cand, axis=1, out=sums)
+            sums += 1e-8
+            _np.divide(cand, sums[:, None], out=cand)
+
+            # hysteresis boost on the previous dominant emotion
+            _np.greater(count, 3, out=hyst)
+            _np.logical_and(hyst, valid, out=hyst)
+            _np.greater_equal(dominant, 0, out=not_hyst)
+            _np.logical_and(hyst, not_hyst, out=hyst)
+            _np.multiply(hyst, self.hysteresis - 1.0, out=factor)
+            factor += 1.0
+            boost.fill(1.0)
+            _np.maximum(dominant, 0, out=dom_idx)
+            boost[rows, dom_idx] = factor
+            cand *= boost
+            _np.sum(cand, axis=1, out=sums)
+            _np.logical_not(hyst, out=not_hyst)
+            _np.copyto(sums, 1.0, where=not_hyst)
+            _np.divide(cand, sums[:, None], out=cand)
+
+            _np.copyto(out, cand, where=valid[:, None])
+            _np.argmax(cand, axis=1, out=argmax)
+            _np.copyto(dominant, argmax, where=valid)
+            return out, valid
+
+
+def smooth_sequence(sequence, maxlen=10, ema_alpha=0.7, hysteresis=1.05, state=None):
+    """Offline smoothing of a whole (T x 7) sequence at once.
+
+    Produces the same outputs as feeding the rows one by one into a fresh
+    `TemporalSmoother`. The EMA runs as one vectorized IIR filter over the
+    time axis; only the hysteresis (which depends on the previous dominant
+    emotion) is a scalar pass. Rows with an all-zero input repeat the
+    previous output (zeros before the first valid row).
+
+    `state` (a dict, updated in place) carries the smoother from one call to
+    the next, so a long stream can be smoothed block by block with the same
+    result as in one piece.
+    """
+    from scipy.signal import lfilter
+
+    state = {} if state is None else state
+    count = state.get("count", 0)
+    prev = state.get("dominant", -1)
+    previous = state.get("output")
+    seq = _np.asarray(sequence, dtype=_np.float64)
+    result = _np.zeros(seq.shape, dtype=_np.float32)
+    sums = seq.sum(axis=1)
+    valid = sums > 0
+    if not valid.any():
+        if previous is not None:
+            result[:] = previous
+        return result
+    x = seq[valid] / (sums[valid] + 1e-8)[:, None]
+
+    # y[t] = a * x[t] + (1 - a) * y[t-1], y[-1] = previous EMA (or y[0] = x[0])
+    initial = x[:1] if count == 0 else state["ema"][None, :]
+    ema = lfilter([ema_alpha], [1.0, -(1.0 - ema_alpha)], x, axis=0,
+                  zi=((1.0 - ema_alpha) * initial))[0]
+    state["ema"] = ema[-1].copy()
+    ema /= (ema.sum(axis=1) + 1e-8)[:, None]
+
+    # Hysteresis pass: previous dominant wins if its boosted value is highest
+    counts = _np.minimum(count + _np.arange(1, len(ema) + 1), maxlen)
+    boosted = (counts > 3).tolist()
+    top = ema.argmax(axis=1).tolist()
+    top_value = ema.max(axis=1).tolist()
+    rows = ema.tolist()
+    prev_dominant = _np.empty(len(rows), dtype=_np.int64)
+    for k in range(len(rows)):
+        prev_dominant[k] = prev
+        d = top[k]
+        if boosted[k] and prev >= 0 and rows[k][prev] * hysteresis > top_value[k]:
+            d = prev
+        prev = d
+
+    idx = _np.flatnonzero((counts > 3) & (prev_dominant >= 0))
+    ema[idx, prev_dominant[idx]] *= hysteresis
+    ema[idx] /= ema[idx].sum(axis=1)[:, None]
+    state.update(count=int(counts[-1]), dominant=prev, output=ema[-1].astype(_np.float32))
+
+    # Scatter back and carry the last output over skipped rows
+    positions = _np.flatnonzero(valid)
+    result[positions] = ema
+    carry = _np.maximum.accumulate(_np.where(valid, _np.arange(len(seq)), -1))
+    filled = carry >= 0
+    result[filled] = result[carry[filled]]
+    if previous is not None:
+        result[~filled] = previous
+    return result
+
+
 class TemporalSmoother:
     """Gelişmiş temporal smoother for emotion probability vectors.
 
@@ -84,45 +349,171 @@ class TemporalSmoother:
     - Daha uzun hafıza (maxlen=10)
     - Daha agresif smoothing (ema_alpha=0.7)
     - Hysteresis ile daha stabil sonuçlar
+
+    Thin handle on one row of a `SmootherBank`; pass `bank=smoother_bank` to
+    share the process-wide engine with the other streams.
     """
-    def __init__(self, maxlen=10, ema_alpha=0.7):
-        self.maxlen = maxlen
-        self.ema_alpha = ema_alpha
-        self.deque = deque(maxlen=maxlen)
-        self.last_dominant = None  # Hysteresis için son dominant emotion
+    def __init__(self, maxlen=10, ema_alpha=0.7, bank=None):
+        if bank is None:
+            bank = SmootherBank(capacity=1, maxlen=maxlen, ema_alpha=ema_alpha)
+        self.bank = bank
+        self.maxlen = bank.maxlen
+        self.ema_alpha = bank.ema_alpha
+        self.slot = bank.acquire()
+
+    @property
+    def last_dominant(self):
+        return self.bank.dominant(self.slot)
 
     def update(self, prob_vector):
         """Add a new probability vector (list/np.array) and return smoothed vector."""
-        arr = _np.array(prob_vector, dtype=_np.float32)
-        if arr.sum() <= 0:
-            # avoid invalid vectors
-            return None
-        # normalize
-        arr = arr / (arr.sum() + 1e-8)
-        self.deque.append(arr)
-        return self.get_smoothed()
+        return self.bank.update_row(self.slot, prob_vector)
 
     def get_smoothed(self):
-        if not self.deque:
+        return self.bank.current(self.slot)
+
+    def reset(self):
+        self.bank.reset(self.slot)
+
+    def close(self):
+        """Returns the row to the bank."""
+        if self.slot is not None:
+            self.bank.release(self.slot)
+            self.slot = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+# Shared smoothing engine for all live streams
+smoother_bank = SmootherBank(maxlen=10, ema_alpha=0.7)
+
+
+# -----------------------
+# Emotion History
+# -----------------------
+class EmotionHistory:
+    """Fixed-size ring buffer of emotion vectors (history x 7).
+
+    Keeps the linearly weighted average (weights 0.5 for the oldest entry up
+    to 1.0 for the newest, same as the old `np.linspace` version) up to date
+    incrementally, so `append()` and `average()` cost O(1) in the history
+    length instead of re-weighting every entry on every frame:
+
+        S = sum(x_i)          R = sum(i * x_i)     (i = 0 oldest .. n-1 newest)
+        weighted = 0.5 * S + 0.5 / (n - 1) * R
+
+    Dropping the oldest entry shifts every rank down by one, i.e. R -= S.
+    Values are stored as given (DeepFace percentages); `average()` returns a
+    probability vector in `EMOTION_KEYS` order.
+    """
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self._buf = _np.zeros((size, len(EMOTION_KEYS)), dtype=_np.float64)
+        self._head = 0    # next write position
+        self._count = 0
+        self._appends = 0
+        self._sum = _np.zeros(len(EMOTION_KEYS), dtype=_np.float64)
+        self._ranked = _np.zeros(len(EMOTION_KEYS), dtype=_np.float64)
+        self._avg = _np.zeros(len(EMOTION_KEYS), dtype=_np.float64)
+        self._tmp = _np.zeros(len(EMOTION_KEYS), dtype=_np.float64)
+        self._in = _np.zeros(len(EMOTION_KEYS), dtype=_np.float64)
+        self._danger_idx = _np.array(DANGER_INDICES)
+        self._main_index = None
+        self._danger = 0.0
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def clear(self):
+        self._buf.fill(0.0)
+        self._sum.fill(0.0)
+        self._ranked.fill(0.0)
+        self._avg.fill(0.0)
+        self._head = 0
+        self._count = 0
+        self._main_index = None
+        self._danger = 0.0
+
+    def append(self, vec):
+        """Adds an emotion vector (`EMOTION_KEYS` order)."""
+        slot = self._buf[self._head]
+        if self._count == self.size:
+            self._sum -= slot
+            self._ranked -= self._sum
+            _np.multiply(vec, self.size - 1, out=self._tmp)
+        else:
+            _np.multiply(vec, self._count, out=self._tmp)
+            self._count += 1
+        self._ranked += self._tmp
+        slot[:] = vec
+        self._sum += slot
+        self._head = (self._head + 1) % self.size
+
+        # Re-derive the running sums once per wrap-around to cancel float drift
+        self._appends += 1
+        if self._appends % self.size == 0 and self._count == self.size:
+            self._resync()
+        self._update_average()
+
+    def append_dict(self, emotions):
+        """Adds a DeepFace emotion dict."""
+        for i, k in enumerate(EMOTION_KEYS):
+            self._in[i] = emotions.get(k, 0.0)
+        self.append(self._in)
+
+    def _resync(self):
+        ordered = _np.roll(self._buf, -self._head, axis=0)
+        self._sum[:] = ordered.sum(axis=0)
+        self._ranked[:] = _np.arange(self.size) @ ordered
+
+    def _update_average(self):
+        n = self._count
+        if n == 1:
+            self._avg[:] = self._sum
+        else:
+            _np.multiply(self._sum, 0.5, out=self._avg)
+            _np.multiply(self._ranked, 0.5 / (n - 1), out=self._tmp)
+            self._avg += self._tmp
+        total = self._avg.sum()
+        if total > 0:
+            self._avg /= total
+        self._main_index = int(self._avg.argmax())
+        self._danger = float(self._avg[self._danger_idx].sum() * 100.0)
+
+    def latest(self):
+        """Most recent vector (a copy) or None."""
+        if not self._count:
             return None
-        
-        # Exponential Moving Average smoothing
-        ema = _np.array(self.deque[0], dtype=_np.float32).copy()
-        for v in list(self.deque)[1:]:
-            ema = self.ema_alpha * v + (1.0 - self.ema_alpha) * ema
-        
-        # normalize
-        ema = ema / (ema.sum() + 1e-8)
-        
-        # Hysteresis: son dominant emotion'a hafif bias ekle (titremeyi azaltır)
-        if self.last_dominant is not None and len(self.deque) > 3:
-            ema[self.last_dominant] *= 1.05  # %5 boost
-            ema = ema / ema.sum()  # Re-normalize
-        
-        # Update last dominant
-        self.last_dominant = _np.argmax(ema)
-        
-        return ema
+        return self._buf[(self._head - 1) % self.size].copy()
+
+    def average(self):
+        """Returns (probability vector, main emotion index) or (None, None).
+
+        The returned vector is owned by the history and updated in place.
+        """
+        if not self._count:
+            return None, None
+        return self._avg, self._main_index
+
+    def danger_score(self):
+        """angry + disgust + fear of the weighted average, in percent."""
+        return self._danger
+
+
+# Emotion history
+emotion_history = EmotionHistory(HISTORY_SIZE)
+
+
+def vector_to_dict(vec):
+    """Raw vector in `EMOTION_KEYS` order -> emotion dict (no scaling)."""
+    return {k: float(vec[i]) for i, k in enumerate(EMOTION_KEYS)}
 
 
 def emotions_dict_to_vector(emotions_dict, ordered_keys=None):
@@ -131,7 +522,7 @@ def emotions_dict_to_vector(emotions_dict, ordered_keys=None):
     If ordered_keys not provided, uses the typical DeepFace order.
     """
     if ordered_keys is None:
-        ordered_keys = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+        ordered_keys = EMOTION_KEYS
     vec = []
     for k in ordered_keys:
         vec.append(float(emotions_dict.get(k, 0.0)))
@@ -145,13 +536,26 @@ def emotions_dict_to_vector(emotions_dict, ordered_keys=None):
 
 def vector_to_emotions_dict(vec, ordered_keys=None):
     if ordered_keys is None:
-        ordered_keys = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+        ordered_keys = EMOTION_KEYS
     # Convert to percentage (0-100 range)
     return {k: float(vec[i] * 100.0) for i, k in enumerate(ordered_keys)}
 
 
 def get_face_embedding(frame):
-    """Extracts face embedding (vector) from a frame."""
+    """Extracts face embedding (vector) from a frame.
+
+    Runs in an inference worker process when the pool is enabled
+    (see modules/inference_pool.py).
+    """
+    pool = inference_pool.get_pool()
+    with metrics.STAGE_SECONDS.time(stage="represent", source=metrics.current_source()):
+        if pool is not None:
+            return pool.get_face_embedding(frame)
+        return represent_face(frame)
+
+
+def represent_face(frame):
+    """Facenet embedding computed in this process (None on failure)."""
     try:
         embedding = DeepFace.represent(frame, model_name="Facenet", enforce_detection=False)
         return np.array(embedding[0]["embedding"])
@@ -159,28 +563,87 @@ def get_face_embedding(frame):
         return None
 
 
+# -----------------------
+# Registered Faces
+# -----------------------
+class FaceRegistry:
+    """Thread-safe registry of dangerous person embeddings.
+
+    Shared by all sources on purpose (a person registered by one camera must
+    be recognized by the others). Embeddings are kept L2-normalized in one
+    matrix, so a lookup is a single matrix-vector product.
+    """
+    def __init__(self, threshold=FACE_SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.faces = {}  # person_id -> embedding (as registered)
+        self._lock = threading.Lock()
+        self._ids = []
+        self._matrix = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, person_id):
+        return person_id in self.faces
+
+    def register(self, person_id, embedding):
+        emb = _np.asarray(embedding, dtype=_np.float64)
+        unit = emb / (_np.linalg.norm(emb) + 1e-12)
+        with self._lock:
+            if person_id in self.faces:
+                self._matrix[self._ids.index(person_id)] = unit
+            else:
+                self._ids.append(person_id)
+                self._matrix = unit[None, :] if self._matrix is None else _np.vstack([self._matrix, unit])
+            self.faces[person_id] = emb
+
+    def match(self, embedding):
+        """Returns (True, person_id) of the first registered face above the threshold."""
+        if embedding is None:
+            return False, None
+        with self._lock:
+            matrix, ids = self._matrix, list(self._ids)
+        if matrix is None:
+            return False, None
+        emb = _np.asarray(embedding, dtype=_np.float64)
+        similarity = matrix @ (emb / (_np.linalg.norm(emb) + 1e-12))
+        hits = _np.flatnonzero(similarity > self.threshold)
+        if len(hits) == 0:
+            return False, None
+        return True, ids[hits[0]]
+
+
+face_registry = FaceRegistry(FACE_SIMILARITY_THRESHOLD)
+
+# Face embeddings of registered dangerous persons (read-only view)
+registered_dangerous_faces = face_registry.faces
+
+
 def is_registered_dangerous_person(current_embedding):
     """Checks if the current face has been registered before."""
-    if current_embedding is None:
-        return False, None
-    
-    for person_id, saved_embedding in registered_dangerous_faces.items():
-        similarity = np.dot(current_embedding, saved_embedding) / (
-            np.linalg.norm(current_embedding) * np.linalg.norm(saved_embedding)
-        )
-        if similarity > FACE_SIMILARITY_THRESHOLD:
-            return True, person_id
-    return False, None
+    return face_registry.match(current_embedding)
 
 
-def analyze_emotions(rgb_frame):
-    """Gelişmiş duygu analizi - daha doğru ve güvenilir sonuçlar.
-    
-    İyileştirmeler:
-    - Yüz hizalama (align=True) ile %15-20 daha doğru
-    - OpenCV detector ile daha hızlı
-    - Düşük güvenilirlikli sonuçları filtreleme
+def detect_emotions(rgb_frame):
+    """Runs the DeepFace emotion model on a frame.
+
+    Returns the raw emotion dict, or None if the analysis failed. Safe to
+    call from worker threads; it does not touch any history. Runs in an
+    inference worker process when the pool is enabled.
     """
+    pool = inference_pool.get_pool()
+    source = metrics.current_source()
+    with metrics.STAGE_SECONDS.time(stage="analyze", source=source):
+        if pool is not None:
+            emotions = pool.detect_emotions(rgb_frame)
+        else:
+            emotions = analyze_face_emotions(rgb_frame)
+    metrics.ANALYSES.inc(source=source, result="failed" if emotions is None else "ok")
+    return emotions
+
+
+def analyze_face_emotions(rgb_frame):
+    """DeepFace emotion analysis in this process (None on failure)."""
     try:
         analysis = DeepFace.analyze(
             rgb_frame, 
@@ -189,68 +652,104 @@ def analyze_emotions(rgb_frame):
             detector_backend='opencv',  # Daha hızlı
             align=True  # Yüz hizalama ile daha doğru sonuç
         )
-        
-        if isinstance(analysis, list):
-            emotions = analysis[0]['emotion']
-        else:
-            emotions = analysis['emotion']
-        
-        # Dominant emotion'un güvenilirlik kontrolü
-        max_confidence = max(emotions.values())
-        
-        from modules.config import EMOTION_CONFIDENCE_THRESHOLD
-        if max_confidence >= EMOTION_CONFIDENCE_THRESHOLD:
-            emotion_history.append(emotions)
-            return emotions
-        else:
-            # Düşük güven - eğer history varsa son değeri kullan, yoksa neutral
-            if emotion_history:
-                return emotion_history[-1]
-            else:
-                # Neutral emotion döndür
-                neutral_emotions = {k: 0.0 for k in emotions.keys()}
-                neutral_emotions['neutral'] = 100.0
-                emotion_history.append(neutral_emotions)
-                return neutral_emotions
-            
-    except Exception as e:
+    except Exception:
+        return None
+
+    if isinstance(analysis, list):
+        return analysis[0]['emotion']
+    return analysis['emotion']
+
+
+def record_emotions(emotions, history=None):
+    """Adds a detection result to a history (with the confidence filter).
+
+    Returns the emotions that are in effect for this frame (see analyze_emotions).
+    """
+    if history is None:
+        history = emotion_history
+
+    if emotions is None:
         # Hata durumunda son bilinen duyguyu kullan
-        if emotion_history:
-            return emotion_history[-1]
+        if history:
+            return vector_to_dict(history.latest())
         return None
 
+    # Dominant emotion'un güvenilirlik kontrolü
+    max_confidence = max(emotions.values())
+
+    from modules.config import EMOTION_CONFIDENCE_THRESHOLD
+    if max_confidence >= EMOTION_CONFIDENCE_THRESHOLD:
+        history.append_dict(emotions)
+        return emotions
+    else:
+        # Düşük güven - eğer history varsa son değeri kullan, yoksa neutral
+        if history:
+            return vector_to_dict(history.latest())
+        else:
+            # Neutral emotion döndür
+            neutral_emotions = {k: 0.0 for k in emotions.keys()}
+            neutral_emotions['neutral'] = 100.0
+            history.append_dict(neutral_emotions)
+            return neutral_emotions
+
 
-def get_average_emotions():
-    """Gelişmiş ağırlıklı ortalama hesaplama.
+def analyze_emotions(rgb_frame, history=None):
+    """Gelişmiş duygu analizi - daha doğru ve güvenilir sonuçlar.
+    
+    İyileştirmeler:
+    - Yüz hizalama (align=True) ile %15-20 daha doğru
+    - OpenCV detector ile daha hızlı
+    - Düşük güvenilirlikli sonuçları filtreleme
+
+    Results go into `history` (a source's `EmotionHistory`), by default the
+    module-level `emotion_history`.
+    """
+    return record_emotions(detect_emotions(rgb_frame), history)
+
+
+def get_average_vector(history=None):
+    """Ağırlıklı ortalama (vektör olarak).
+
+    Son frame'lere daha fazla ağırlık verilir (bkz. `EmotionHistory`).
+    Returns (probability vector or None, main_emotion). The vector is owned
+    by the history; copy it before keeping it across frames.
+    """
+    if history is None:
+        history = emotion_history
+    avg, main_index = history.average()
+    if avg is None:
+        return None, "neutral"
+
+    # Minimum threshold - eğer dominant emotion çok düşükse neutral kabul et
+    if avg[main_index] < 0.30:  # %30'un altındaysa belirsiz
+        return avg, "neutral"
+    return avg, EMOTION_KEYS[main_index]
+
+
+def get_smoothed_emotions(smoother, history=None):
+    """Average of the history passed through a `TemporalSmoother`.
+
+    Returns (probability vector or None, main_emotion, danger_score).
+    """
+    avg, main_emotion = get_average_vector(history)
+    if avg is not None:
+        smoothed = smoother.update(avg)
+        if smoothed is not None:
+            avg = smoothed
+            main_emotion = EMOTION_KEYS[int(_np.argmax(avg))]
+    return avg, main_emotion, danger_score_from_vector(avg)
+
+
+def get_average_emotions(history=None):
+    """Gelişmiş ağırlıklı ortalama hesaplama (dict API).
     
     Son frame'lere daha fazla ağırlık vererek daha hızlı tepki verir
     ama yeterince smooth kalır.
     """
-    if not emotion_history:
+    avg, main_emotion = get_average_vector(history)
+    if avg is None:
         return {}, "neutral"
-    
-    # Ağırlıklı ortalama - son frame'ler daha önemli
-    n = len(emotion_history)
-    weights = np.linspace(0.5, 1.0, n)
-    weights = weights / weights.sum()  # Normalize et
-    
-    avg_emotions = {}
-    for key in emotion_history[0].keys():
-        weighted_sum = sum(e[key] * w for e, w in zip(emotion_history, weights))
-        avg_emotions[key] = weighted_sum
-    
-    # Toplam 100% olması için normalize et
-    total = sum(avg_emotions.values())
-    if total > 0:
-        avg_emotions = {k: (v / total) * 100 for k, v in avg_emotions.items()}
-    
-    main_emotion = max(avg_emotions, key=avg_emotions.get)
-    
-    # Minimum threshold - eğer dominant emotion çok düşükse neutral kabul et
-    if avg_emotions[main_emotion] < 30.0:  # %30'un altındaysa belirsiz
-        main_emotion = "neutral"
-    
-    return avg_emotions, main_emotion
+    return vector_to_emotions_dict(avg), main_emotion
 
 
 def calculate_danger_score(avg_emotions):
@@ -258,29 +757,40 @@ def calculate_danger_score(avg_emotions):
     return sum(avg_emotions.get(k, 0) for k in ["angry", "fear", "disgust"])
 
 
+def danger_score_from_vector(prob_vector):
+    """Danger score (angry + disgust + fear, in percent) of a probability vector."""
+    if prob_vector is None:
+        return 0.0
+    return float(sum(prob_vector[i] for i in DANGER_INDICES) * 100.0)
+
+
 def register_dangerous_person(person_id, embedding):
     """Registers a new dangerous person."""
-    registered_dangerous_faces[person_id] = embedding
+    face_registry.register(person_id, embedding)
     print(f"⚠️ NEW dangerous person registered: {person_id}")
 
 
-def clear_emotion_history():
+def clear_emotion_history(history=None):
     """Clears emotion history."""
-    emotion_history.clear()
+    (emotion_history if history is None else history).clear()
 
 
 def set_esp32_target_url(url):
-    """Sets ESP32 target URL for emotion data transmission."""
+    """Sets the default ESP32 target URL for emotion data transmission."""
     global ESP32_TARGET_URL
     ESP32_TARGET_URL = url
     print(f"✓ ESP32 hedef URL ayarlandı: {url}")
 
 
-def send_emotion_to_esp32(emotion, confidence):
-    """Sends emotion data to ESP32 via HTTP POST (non-blocking, fast)."""
-    global ESP32_TARGET_URL
-    
-    if not ESP32_TARGET_URL:
+def send_emotion_to_esp32(emotion, confidence, url=None, http=None):
+    """Sends emotion data to ESP32 via HTTP POST (blocking, 0.5 s timeout).
+
+    `url` defaults to the global ESP32_TARGET_URL, `http` is an optional
+    `requests.Session` for keep-alive. The frame loop does not call this
+    directly; it goes through `modules.oled.oled_sender`.
+    """
+    url = url or ESP32_TARGET_URL
+    if not url:
         return False
     
     try:
@@ -290,14 +800,18 @@ def send_emotion_to_esp32(emotion, confidence):
         }
         
         # Çok kısa timeout - ESP32 meşgulse skip et
-        response = requests.post(
-            ESP32_TARGET_URL,
-            json=payload,
-            timeout=0.5  # 500ms - daha hızlı
-        )
-        
-        return response.status_code == 200
+        with metrics.OLED_POST_SECONDS.time():
+            response = (http or requests).post(
+                url,
+                json=payload,
+                timeout=0.5  # 500ms - daha hızlı
+            )
+
+        ok = response.status_code == 200
+        metrics.OLED_POSTS.inc(result="ok" if ok else "failed")
+        return ok
             
     except:
         # Sessizce devam et - log spam'i yok
+        metrics.OLED_POSTS.inc(result="failed")
         return False
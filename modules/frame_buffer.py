@@ -0,0 +1,131 @@
+"""
+Shared output buffer for processed frames
+
+A pipeline publishes each annotated, encoded frame once; any number of
+viewers read the latest one. Viewers never drive the pipeline, so N viewers
+of one camera cost one analysis pipeline, not N.
+
+A buffer can mirror its frames into a shared-memory ring (`mirror`, see
+modules/shm_ring.py) for readers in other processes.
+
+Viewers with a lower output profile (modules/output_profiles.py) read
+re-encoded variants of the latest frame through `variant()`: each variant
+is encoded once per frame, by the first viewer asking for it, and shared
+by all others (readers in other processes share a `VariantCache` per
+source, see modules/pipeline_client.py).
+"""
+import threading
+import time
+
+_SEQ_RESTART = 100
+
+
+class VariantCache:
+    """Re-encoded variants of a source's latest frame, by variant key.
+
+    Only variants of the newest frame are kept: keys no viewer asked for
+    since (e.g. a custom ?scale= of a viewer that left) are dropped with
+    their lock once a newer frame is encoded.
+    """
+
+    def __init__(self):
+        self._variants = {}
+        self._locks = {}
+        self._seq = None
+
+    def get(self, seq, key, encode):
+        """Variant `key` of frame `seq`, computed by `encode()` once and shared."""
+        cached = self._variants.get(key)
+        if cached is not None and cached[0] == seq:
+            return cached[1]
+        lock = self._locks.get(key) or self._locks.setdefault(key, threading.Lock())
+        with lock:
+            # Another viewer may have encoded it while this one waited
+            cached = self._variants.get(key)
+            if cached is not None and cached[0] == seq:
+                return cached[1]
+            data = encode()
+            self._variants[key] = (seq, data)
+        # Viewers read the latest frame; a big step back is a restarted source
+        if self._seq is None or seq > self._seq or seq < self._seq - _SEQ_RESTART:
+            self._seq = seq
+            self._prune(seq)
+        return data
+
+    def _prune(self, seq):
+        for old_key, (old_seq, _data) in list(self._variants.items()):
+            if old_seq != seq:
+                self._variants.pop(old_key, None)
+                lock = self._locks.get(old_key)
+                # A held lock belongs to an encode in progress; keep it
+                if lock is not None and not lock.locked():
+                    self._locks.pop(old_key, None)
+
+
+class FrameBuffer:
+    """Latest encoded frame of a source with a sequence number."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.seq = 0
+        self.jpeg = None
+        self.timestamp = None
+        self.mirror = None
+        # Annotated frame of `jpeg` (if the publisher passes it) for variants
+        self.frame = None
+        self.variants = VariantCache()
+
+    def publish(self, jpeg, frame=None):
+        """Stores a new encoded frame and wakes up waiting readers.
+
+        `frame` is the BGR image `jpeg` was encoded from; it must not be
+        modified afterwards. Variants are encoded from it instead of
+        decoding `jpeg` again.
+        """
+        with self._cond:
+            self.seq += 1
+            self.jpeg = jpeg
+            self.frame = frame
+            self.timestamp = time.time()
+            if self.mirror is not None and len(jpeg) <= self.mirror.slot_bytes:
+                self.mirror.write_jpeg(jpeg, self.timestamp)
+            self._cond.notify_all()
+            return self.seq
+
+    def latest(self):
+        """Returns (seq, jpeg) of the most recent frame (jpeg None if none yet)."""
+        with self._cond:
+            return self.seq, self.jpeg
+
+    def wait_for(self, after_seq, timeout=None):
+        """Blocks until a frame newer than `after_seq` exists.
+
+        Returns (seq, jpeg); on timeout the current (possibly old) frame.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > after_seq, timeout=timeout)
+            return self.seq, self.jpeg
+
+    def variant(self, seq, jpeg, key, encode):
+        """Frame `seq` (`jpeg`) re-encoded as `key`, shared by all readers asking for `key`.
+
+        `encode(jpeg, frame)` gets the published BGR frame if it is still
+        the latest one (else None) and returns the encoded bytes.
+        """
+        def encode_latest():
+            with self._cond:
+                frame = self.frame if self.seq == seq else None
+            return encode(jpeg, frame)
+
+        return self.variants.get(seq, key, encode_latest)
+
+    def mjpeg(self, timeout=5.0, keep_running=lambda: True):
+        """Multipart MJPEG generator over the published frames."""
+        seq = 0
+        while keep_running():
+            new_seq, jpeg = self.wait_for(seq, timeout=timeout)
+            if new_seq == seq or jpeg is None:
+                continue
+            seq = new_seq
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
@@ -0,0 +1,293 @@
+"""
+ESP32 device health monitoring and stream reconnection
+
+- `DeviceMonitor` probes every watched ESP in the background (`/status`),
+  tracks RTT, the achieved stream FPS and the device state
+  (unknown -> online <-> offline) and keeps a log of state transitions.
+- `StreamConnection` wraps `cv2.VideoCapture` of an MJPEG stream and
+  reconnects dropped streams with jittered exponential backoff.
+- `placeholder_jpeg()` renders the "reconnecting" frame served to viewers
+  while a stream is down, so their connections stay open instead of
+  ending and being re-opened by every browser at once.
+"""
+import time
+import random
+import threading
+from collections import deque
+from functools import lru_cache
+import cv2
+import numpy as np
+from modules.config import (
+    HEALTH_PROBE_INTERVAL, HEALTH_PROBE_TIMEOUT, HEALTH_OFFLINE_AFTER,
+    RECONNECT_BACKOFF_BASE, RECONNECT_BACKOFF_MAX
+)
+from modules import esp_client
+
+
+class RateMeter:
+    """Events per second over a sliding time window."""
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self._events = deque()
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def tick(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._events.append(now)
+            self.total += 1
+            self._trim(now)
+
+    def _trim(self, now):
+        while self._events and now - self._events[0] > self.window:
+            self._events.popleft()
+
+    def rate(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._trim(now)
+            return len(self._events) / self.window
+
+
+class Backoff:
+    """Exponential backoff with jitter.
+
+    The n-th delay is drawn from [d/2, d] with d = min(cap, base * factor**n),
+    so clients that failed together do not retry in lockstep.
+    """
+
+    def __init__(self, base=RECONNECT_BACKOFF_BASE, cap=RECONNECT_BACKOFF_MAX, factor=2.0):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.cap, self.base * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempts = 0
+
+
+@lru_cache(maxsize=16)
+def placeholder_jpeg(text, width=640, height=480):
+    """JPEG of a dark frame with `text`, used while a stream reconnects."""
+    frame = np.full((height, width, 3), 40, dtype=np.uint8)
+    scale = max(0.5, width / 900)
+    (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+    org = (max(10, (width - tw) // 2), (height + th) // 2)
+    cv2.putText(frame, text, org, cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 200, 255), 2)
+    ok, buffer = cv2.imencode('.jpg', frame)
+    return buffer.tobytes() if ok else b''
+
+
+class StreamConnection:
+    """MJPEG stream capture that reconnects with backoff instead of ending."""
+
+    def __init__(self, url, backoff=None):
+        self.url = url
+        self.backoff = backoff or Backoff()
+        self.state = "connecting"
+        self.last_error = None
+        self.reconnects = 0
+        self.frame_size = (640, 480)
+        self._cap = None
+        self._retry_at = 0.0
+
+    def read(self, wait=time.sleep, poll=1.0):
+        """Returns the next BGR frame, or None while the stream is down.
+
+        While waiting for the next reconnect attempt it blocks at most `poll`
+        seconds (via `wait`), so the caller can keep serving placeholders.
+        """
+        if self._cap is None:
+            remaining = self._retry_at - time.time()
+            if remaining > 0:
+                wait(min(remaining, poll))
+                return None
+            self.state = "connecting"
+            self._cap = cv2.VideoCapture(self.url)
+            if not self._cap.isOpened():
+                self._fail("open failed")
+                return None
+
+        ret, frame = self._cap.read()
+        if not ret:
+            self._fail("stream read failed")
+            return None
+        if self.state != "running":
+            self.state = "running"
+            self.backoff.reset()
+        self.frame_size = (frame.shape[1], frame.shape[0])
+        return frame
+
+    def _fail(self, reason):
+        self.release()
+        self.state = "reconnecting"
+        self.last_error = reason
+        self.reconnects += 1
+        self._retry_at = time.time() + self.backoff.next_delay()
+
+    def retry_now(self):
+        """Skips the remaining backoff (e.g. when the device came back online)."""
+        self._retry_at = 0.0
+        self.backoff.reset()
+
+    def placeholder(self, text="YENIDEN BAGLANILIYOR..."):
+        return placeholder_jpeg(text, *self.frame_size)
+
+    def release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class DeviceHealth:
+    """Health of one ESP32 device."""
+
+    def __init__(self, ip):
+        self.ip = ip
+        self.state = "unknown"
+        self.rtt = None             # smoothed probe round trip (seconds)
+        self.last_probe = None
+        self.last_ok = None
+        self.failures = 0           # consecutive failed probes
+        self.stream_state = None    # reported by the stream reader
+        self.fps = RateMeter()
+        self.next_probe = 0.0
+        self.backoff = Backoff(base=HEALTH_PROBE_INTERVAL, cap=RECONNECT_BACKOFF_MAX)
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            "ip": self.ip,
+            "state": self.state,
+            "stream_state": self.stream_state,
+            "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            "fps": round(self.fps.rate(now), 2),
+            "failures": self.failures,
+            "last_ok_age": round(now - self.last_ok, 1) if self.last_ok else None,
+        }
+
+
+class DeviceMonitor:
+    """Background prober of all watched ESP32 devices."""
+
+    def __init__(self, interval=HEALTH_PROBE_INTERVAL, timeout=HEALTH_PROBE_TIMEOUT,
+                 offline_after=HEALTH_OFFLINE_AFTER, max_events=200):
+        self.interval = interval
+        self.timeout = timeout
+        self.offline_after = offline_after
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._listeners = []
+        self.events = deque(maxlen=max_events)
+        self._thread = None
+
+    def watch(self, ip):
+        with self._lock:
+            device = self._devices.get(ip)
+            if device is None:
+                device = self._devices[ip] = DeviceHealth(ip)
+        self._ensure_thread()
+        self._wake.set()
+        return device
+
+    def unwatch(self, ip):
+        with self._lock:
+            self._devices.pop(ip, None)
+
+    def add_listener(self, fn):
+        """Registers `fn(ip, old_state, new_state)` for device state transitions."""
+        self._listeners.append(fn)
+
+    def report_frame(self, ip, now=None):
+        device = self._devices.get(ip)
+        if device is not None:
+            device.fps.tick(now)
+
+    def report_stream_state(self, ip, state):
+        device = self._devices.get(ip)
+        if device is not None and device.stream_state != state:
+            self._record(ip, "stream", device.stream_state, state)
+            device.stream_state = state
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="device-monitor", daemon=True)
+                    self._thread.start()
+
+    def _record(self, ip, kind, old, new):
+        self.events.append({"time": time.time(), "ip": ip, "kind": kind, "from": old, "to": new})
+        print(f"ℹ️ ESP {ip} {kind}: {old} -> {new}")
+
+    def _set_state(self, device, state):
+        old = device.state
+        if old == state:
+            return
+        device.state = state
+        self._record(device.ip, "device", old, state)
+        for fn in list(self._listeners):
+            try:
+                fn(device.ip, old, state)
+            except Exception as e:
+                print(f"⚠️ Health listener failed: {e}")
+
+    def probe(self, device):
+        start = time.time()
+        status, _ = esp_client.get_status(device.ip, timeout=self.timeout)
+        now = time.time()
+        device.last_probe = now
+        if status == 200:
+            rtt = now - start
+            device.rtt = rtt if device.rtt is None else 0.7 * device.rtt + 0.3 * rtt
+            device.last_ok = now
+            device.failures = 0
+            device.backoff.reset()
+            device.next_probe = now + self.interval
+            self._set_state(device, "online")
+        else:
+            device.failures += 1
+            # Probe offline devices less and less often
+            device.next_probe = now + max(self.interval, device.backoff.next_delay())
+            if device.failures >= self.offline_after:
+                self._set_state(device, "offline")
+
+    def _run(self):
+        while True:
+            now = time.time()
+            with self._lock:
+                devices = list(self._devices.values())
+            due = [d for d in devices if d.next_probe <= now]
+            for device in due:
+                try:
+                    self.probe(device)
+                except Exception as e:
+                    print(f"⚠️ Health probe failed for {device.ip}: {e}")
+            with self._lock:
+                upcoming = [d.next_probe for d in self._devices.values()]
+            timeout = max(0.05, min(upcoming) - time.time()) if upcoming else None
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def get(self, ip):
+        return self._devices.get(ip)
+
+    def status(self):
+        with self._lock:
+            devices = list(self._devices.values())
+        return {d.ip: d.to_dict() for d in devices}
+
+    def recent_events(self, since=0.0):
+        return [e for e in list(self.events) if e["time"] > since]
+
+
+# Global device monitor
+device_monitor = DeviceMonitor()
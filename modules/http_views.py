@@ -0,0 +1,93 @@
+"""
+Response helpers shared by the full app (main.py) and the production web
+workers (web.py)
+
+Only Flask and light modules are imported here, so web workers can use it
+without loading the analysis stack.
+"""
+import json
+import time
+from flask import Response, jsonify, request, stream_with_context
+from modules.config import SSE_MAX_RATE, SSE_HEARTBEAT
+
+MJPEG_MIMETYPE = 'multipart/x-mixed-replace; boundary=frame'
+
+
+def emotion_payload(source, state, enabled):
+    """JSON body of /current_emotions for a session's latest_state."""
+    state = state or {}
+    return {
+        "enabled": enabled,
+        "source": source,
+        "timestamp": state.get("timestamp"),
+        "emotions": state.get("emotions"),
+        "main_emotion": state.get("main_emotion"),
+        "danger_score": state.get("danger_score", 0.0),
+    }
+
+
+def snapshot_response(source, buffer):
+    """Latest encoded frame of `buffer` as image/jpeg, straight from memory.
+
+    `buffer` is a FrameBuffer (or anything with latest(), wait_for() and
+    timestamp). ETag is the frame sequence number; `If-None-Match` with the
+    current one returns 304. `?wait_for_new=<s>` (max 30) long-polls for a
+    frame newer than the one in If-None-Match (or the current one).
+    """
+    seq, jpeg = buffer.latest()
+    known = request.headers.get('If-None-Match', '').strip('"')
+    prefix = f"{source}-"
+    known_seq = int(known[len(prefix):]) if known.startswith(prefix) and known[len(prefix):].isdigit() else None
+
+    wait = min(request.args.get('wait_for_new', type=float) or 0.0, 30.0)
+    if wait > 0:
+        seq, jpeg = buffer.wait_for(known_seq if known_seq is not None else seq, timeout=wait)
+
+    headers = {'ETag': f'"{prefix}{seq}"', 'Cache-Control': 'no-cache', 'X-Frame-Seq': str(seq)}
+    if jpeg is None:
+        headers['Retry-After'] = '1'
+        return jsonify({"error": "No frame yet", "source": source}), 503, headers
+    if known_seq == seq:
+        return Response(status=304, headers=headers)
+    if buffer.timestamp:
+        headers['X-Frame-Age'] = f"{time.time() - buffer.timestamp:.3f}"
+    headers['Content-Length'] = str(len(jpeg))
+    return Response([jpeg], mimetype='image/jpeg', headers=headers)
+
+
+def emotion_event_stream(wait_state):
+    """Server-Sent Events response of emotion / danger updates.
+
+    `wait_state(after_seq, timeout)` blocks until the state sequence passes
+    `after_seq` (or timeout) and returns (seq, payload). An event is sent when
+    the state or the detection flag changes, at most `?max_rate=` (capped at
+    SSE_MAX_RATE) per second; changes during the pause are coalesced.
+    """
+    max_rate = request.args.get('max_rate', type=float)
+    # Values <= 0 would turn the rate limit off
+    max_rate = min(max_rate, SSE_MAX_RATE) if max_rate and max_rate > 0 else SSE_MAX_RATE
+    min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+
+    def generate():
+        seq = -1
+        enabled = None
+        last_send = 0.0
+        last_write = time.time()
+        while True:
+            new_seq, payload = wait_state(seq, 1.0)
+            now = time.time()
+            if new_seq != seq or payload["enabled"] != enabled:
+                # Rate limit; state changes during the pause are coalesced
+                pause = last_send + min_interval - now
+                if pause > 0:
+                    time.sleep(pause)
+                    new_seq, payload = wait_state(-1, 0)
+                seq, enabled = new_seq, payload["enabled"]
+                last_send = last_write = time.time()
+                yield f"id: {seq}\ndata: {json.dumps(payload)}\n\n"
+            elif now - last_write > SSE_HEARTBEAT:
+                last_write = now
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,295 @@
+"""
+DeepFace inference worker processes
+
+`face_analysis.detect_emotions()` and `get_face_embedding()` run in a pool
+of worker processes instead of the calling thread, so TensorFlow uses its
+own cores (outside the GIL of the process doing capture, MediaPipe, drawing
+and encoding) and a TF crash only costs one worker:
+
+- every worker loads the emotion and Facenet models once at start,
+- frames go through a per-worker shared-memory slot (modules/shm_ring.py),
+  only the op name and slot seq / the small result are sent over the
+  `multiprocessing.connection` (frames larger than a slot are pickled),
+- a call that takes longer than INFERENCE_TIMEOUT, or a worker that dies,
+  gets the worker killed and restarted in the background (the call returns
+  None like a failed analysis),
+- INFERENCE_PROCESSES -1 sizes the pool from the CPU count (one process per
+  INFERENCE_THREADS_PER_PROCESS cores, one core left for the pipeline).
+
+Workers are started with `python -m modules.inference_pool` (not forked),
+so they never re-run main.py or inherit camera / Flask state.
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import secrets
+import threading
+import subprocess
+from multiprocessing.connection import Client, Listener, arbitrary_address, default_family
+import numpy as np
+from modules.config import (
+    INFERENCE_PROCESSES, INFERENCE_THREADS_PER_PROCESS, INFERENCE_TIMEOUT,
+    INFERENCE_START_TIMEOUT, INFERENCE_FRAME_BYTES,
+)
+from modules.health import Backoff
+from modules.shm_ring import SharedFrameRing
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pool_size(processes=INFERENCE_PROCESSES, threads=INFERENCE_THREADS_PER_PROCESS):
+    """Number of worker processes (-1: from the CPU count, 0: no pool)."""
+    if processes >= 0:
+        return processes
+    cores = os.cpu_count() or 1
+    return max(1, (cores - 1) // max(1, threads))
+
+
+class _Worker:
+    """One worker process with its connection and frame slot."""
+
+    def __init__(self, index):
+        self.index = index
+        self.proc = None
+        self.conn = None
+        self.ring = None
+        self.calls = 0
+        self.failures = 0
+        self.starts = 0
+        self.backoff = Backoff(base=1.0, cap=60.0)
+
+    def request(self, op, frame, timeout):
+        frame = np.ascontiguousarray(frame)
+        if self.ring is not None and frame.dtype == np.uint8 and frame.nbytes <= self.ring.slot_bytes:
+            self.conn.send((op, self.ring.write_frame(frame), None))
+        else:
+            self.conn.send((op, 0, frame))
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"{op} took longer than {timeout}s")
+        return self.conn.recv()
+
+    def stop(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.unlink()
+            self.ring = None
+
+
+class InferencePool:
+    """Runs DeepFace calls in worker processes (thread-safe, one call per worker at a time)."""
+
+    def __init__(self, processes, threads=INFERENCE_THREADS_PER_PROCESS, timeout=INFERENCE_TIMEOUT,
+                 start_timeout=INFERENCE_START_TIMEOUT, frame_bytes=INFERENCE_FRAME_BYTES):
+        self.threads = threads
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.frame_bytes = frame_bytes
+        self._authkey = secrets.token_bytes(16)
+        self._idle = queue.Queue()
+        self._ready = threading.Event()
+        self._closed = False
+        self._lock = threading.Lock()  # orders close() against workers being started
+        self.workers = [_Worker(i) for i in range(processes)]
+        for worker in self.workers:
+            self._restart(worker)
+
+    @property
+    def size(self):
+        return len(self.workers)
+
+    # ---- worker lifecycle ------------------------------------------------
+
+    def _restart(self, worker, delay=0.0):
+        threading.Thread(target=self._launch, args=(worker, delay),
+                         name=f"inference-start-{worker.index}", daemon=True).start()
+
+    def _launch(self, worker, delay):
+        time.sleep(delay)
+        if self._closed:
+            return
+        worker.starts += 1
+        address = arbitrary_address(default_family)
+        if self.frame_bytes > 0:
+            worker.ring = SharedFrameRing.create(
+                f"inf{os.getpid()}-{worker.index}-{worker.starts}", slots=2, slot_bytes=self.frame_bytes)
+        env = dict(os.environ, INFERENCE_AUTHKEY=self._authkey.hex(),
+                   PYTHONPATH=os.pathsep.join(filter(None, [_ROOT, os.environ.get("PYTHONPATH")])))
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "modules.inference_pool", str(address),
+             worker.ring.name if worker.ring else "-", str(self.threads)], env=env)
+        with self._lock:
+            worker.proc = proc
+        try:
+            if self._closed:
+                raise EOFError("pool closed")
+            conn = self._connect(proc, address)
+            with self._lock:
+                worker.conn = conn
+            if self._closed:
+                raise EOFError("pool closed")
+            # close() may stop the worker meanwhile: only use the local handles
+            if self._wait_ready(proc, conn) != "ready":
+                raise EOFError("worker did not start")
+        except (OSError, EOFError, TimeoutError, ValueError) as e:
+            with self._lock:
+                worker.stop()
+                if self._closed:
+                    return
+            print(f"⚠️ Inference worker {worker.index} failed to start: {e}")
+            self._restart(worker, worker.backoff.next_delay())
+            return
+        with self._lock:
+            if self._closed:
+                # close() already stopped it
+                return
+        worker.backoff.reset()
+        print(f"✓ Inference worker {worker.index} ready (pid {proc.pid})")
+        self._idle.put(worker)
+        self._ready.set()
+
+    def _connect(self, proc, address):
+        deadline = time.time() + 30.0
+        while True:
+            try:
+                return Client(address, authkey=self._authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if proc.poll() is not None or time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _wait_ready(self, proc, conn):
+        """Waits for the worker's models to load (checking that it is still alive)."""
+        deadline = time.time() + self.start_timeout
+        while not conn.poll(1.0):
+            if self._closed:
+                raise EOFError("pool closed")
+            if proc.poll() is not None:
+                raise EOFError(f"worker exited with {proc.returncode}")
+            if time.time() > deadline:
+                raise TimeoutError("models did not load in time")
+        return conn.recv()
+
+    def _fail(self, worker, error):
+        worker.failures += 1
+        print(f"⚠️ Inference worker {worker.index} restarting ({type(error).__name__}: {error})")
+        worker.stop()
+        self._restart(worker)
+
+    # ---- calls -----------------------------------------------------------
+
+    def call(self, op, frame):
+        """Runs `op` ("analyze" / "represent") on a free worker. None on failure or timeout."""
+        # The first calls wait for the models to load; later ones only for a free worker
+        if not self._ready.wait(self.start_timeout):
+            return None
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            return None
+        try:
+            result = worker.request(op, frame, self.timeout)
+        except (OSError, EOFError, TimeoutError) as e:
+            self._fail(worker, e)
+            return None
+        worker.calls += 1
+        self._idle.put(worker)
+        return result
+
+    def detect_emotions(self, rgb_frame):
+        return self.call("analyze", rgb_frame)
+
+    def get_face_embedding(self, frame):
+        embedding = self.call("represent", frame)
+        return None if embedding is None else np.asarray(embedding)
+
+    def stats(self):
+        return {
+            "processes": self.size,
+            "threads_per_process": self.threads,
+            "idle": self._idle.qsize(),
+            "workers": [{
+                "pid": w.proc.pid if w.proc is not None else None,
+                "alive": w.proc is not None and w.proc.poll() is None,
+                "calls": w.calls,
+                "failures": w.failures,
+                "starts": w.starts,
+            } for w in self.workers],
+        }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            # Workers still starting see _closed and stop on their own
+            for worker in self.workers:
+                worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(create=True, processes=None):
+    """The process-wide pool (created on first use), or None if INFERENCE_PROCESSES is 0.
+
+    `processes` sizes the pool if this call creates it (batch tools use all
+    cores); by default it comes from `pool_size()`.
+    """
+    global _pool
+    processes = pool_size() if processes is None else processes
+    if _pool is None and create and processes > 0:
+        with _pool_lock:
+            if _pool is None:
+                _pool = InferencePool(processes)
+                atexit.register(_pool.close)
+    return _pool
+
+
+# ---- worker process ------------------------------------------------------
+
+def _limit_threads(threads):
+    for name in ("OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[name] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+
+def _serve(address, ring_name, threads):
+    _limit_threads(threads)
+    listener = Listener(address, authkey=bytes.fromhex(os.environ["INFERENCE_AUTHKEY"]))
+    conn = listener.accept()
+    listener.close()
+
+    from modules import face_analysis
+    # Load the models once; DeepFace keeps built models cached
+    blank = np.zeros((224, 224, 3), dtype=np.uint8)
+    face_analysis.analyze_face_emotions(blank)
+    face_analysis.represent_face(blank)
+    ring = SharedFrameRing.attach(ring_name) if ring_name != "-" else None
+    ops = {"analyze": face_analysis.analyze_face_emotions, "represent": face_analysis.represent_face}
+    conn.send("ready")
+
+    while True:
+        try:
+            op, seq, frame = conn.recv()
+        except (EOFError, OSError):
+            return
+        if frame is None:
+            _, frame = ring.frame(seq, writable=True)
+        result = ops[op](frame) if frame is not None else None
+        if isinstance(result, np.ndarray):
+            result = result.tolist()
+        conn.send(result)
+        del frame
+
+
+if __name__ == "__main__":
+    _serve(sys.argv[1], sys.argv[2], int(sys.argv[3]))
@@ -0,0 +1,175 @@
+"""
+Pipeline metrics (Prometheus text format)
+
+Counters and latency histograms recorded by the camera pipelines, the
+DeepFace calls, the ESP client and capture storage, exposed on /metrics:
+
+    with metrics.STAGE_SECONDS.time(stage="mesh", source=source_id):
+        results = mesh.process(rgb)
+    metrics.FRAMES.inc(source=source_id)
+
+Recording is a dict lookup, a bisect into fixed buckets and a lock per
+observation, cheap enough to stay on permanently. Code that does not know
+its source (e.g. `face_analysis.detect_emotions()`) labels with
+`current_source()`, set per thread by the frame loops and analysis jobs.
+
+In production mode the pipeline process records everything; web.py forwards
+/metrics to it.
+"""
+import time
+import threading
+from bisect import bisect_left
+
+# Seconds; covers 1 ms (face mesh) .. 10 s (model load / timeouts)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_local = threading.local()
+
+
+def set_source(source_id):
+    """Sets the `source` label used by current_source() in this thread."""
+    _local.source = source_id
+
+
+def current_source():
+    return getattr(_local, "source", "") or "-"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            lines += self._render_series(series)
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._series.get(self._key(labels), 0)
+
+    def _render_series(self, series):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in series]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def _render_series(self, series):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in series]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [per-bucket counts (+Inf last), sum]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _render_series(self, series):
+        lines = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [le])} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---- pipeline metrics -----------------------------------------------------
+
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds", "Duration of a pipeline stage "
+    "(mesh, analyze, represent, imencode, decode, process, save)", ("stage", "source"))
+FRAMES = Counter("pipeline_frames_total", "Frames processed", ("source",))
+ANALYSES = Counter("pipeline_analyses_total", "Emotion analyses by result (ok / failed)", ("source", "result"))
+DANGER = Counter("pipeline_danger_total", "Danger path events "
+                 "(frame, new, registered, unrecognized)", ("source", "event"))
+ESP_REQUEST_SECONDS = Histogram("esp_request_seconds", "ESP HTTP request duration", ("op", "ip"))
+ESP_REQUEST_ERRORS = Counter("esp_request_errors_total", "Failed ESP HTTP requests", ("op", "ip"))
+OLED_POSTS = Counter("oled_posts_total", "OLED /face_mood POSTs by result (ok / failed)", ("result",))
+OLED_POST_SECONDS = Histogram("oled_post_seconds", "OLED /face_mood POST duration")
+CAPTURES = Counter("captures_saved_total", "Dangerous person captures saved", ("source",))
+VIEWERS = Gauge("camera_viewers", "Connected /video_feed viewers of an orchestrator source", ("source",))
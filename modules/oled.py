@@ -0,0 +1,137 @@
+"""
+Background delivery of emotion updates to ESP32 OLED displays
+
+The frame loop only calls `oled_sender.submit()`, which compares the value
+with what the display already shows and stores it (latest value wins) - no
+network I/O. A single worker thread POSTs to each target over a keep-alive
+session, at most `OLED_MAX_RATE` times per second per target, and only when
+the emotion changed or the confidence moved by at least
+`OLED_CONFIDENCE_DELTA` (or `OLED_RESEND_INTERVAL` passed, so a rebooted
+display catches up).
+"""
+import time
+import threading
+import requests
+from modules.config import OLED_MAX_RATE, OLED_CONFIDENCE_DELTA, OLED_RESEND_INTERVAL
+from modules import face_analysis
+
+
+class _Target:
+    def __init__(self, url):
+        self.url = url
+        self.pending = None      # (emotion, confidence) waiting to be sent
+        self.inflight = None     # value currently being POSTed
+        self.shown = None        # last value delivered successfully
+        self.shown_time = 0.0
+        self.next_send = 0.0     # rate limit
+        self.sent = 0
+        self.skipped = 0
+        self.failed = 0
+
+
+class OledSender:
+    """Coalescing, rate-limited sender of (emotion, confidence) per OLED URL."""
+
+    def __init__(self, max_rate=OLED_MAX_RATE, confidence_delta=OLED_CONFIDENCE_DELTA,
+                 resend_interval=OLED_RESEND_INTERVAL):
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.confidence_delta = confidence_delta
+        self.resend_interval = resend_interval
+        self._cond = threading.Condition()
+        self._targets = {}
+        self._http = requests.Session()
+        self._thread = None
+
+    def _changed(self, target, emotion, confidence, now):
+        current = target.pending or target.inflight or target.shown
+        if current is None or current[0] != emotion:
+            return True
+        if abs(confidence - current[1]) >= self.confidence_delta:
+            return True
+        return (target.pending is None and target.inflight is None and self.resend_interval > 0
+                and now - target.shown_time >= self.resend_interval)
+
+    def submit(self, url, emotion, confidence):
+        """Queues a value for `url` if it differs enough from the displayed one.
+
+        Returns True if the value was queued, False if it was skipped.
+        """
+        now = time.time()
+        with self._cond:
+            target = self._targets.get(url)
+            if target is None:
+                target = self._targets[url] = _Target(url)
+            if not self._changed(target, emotion, confidence, now):
+                target.skipped += 1
+                return False
+            if target.pending is not None:
+                # Replaced before it was sent
+                target.skipped += 1
+            target.pending = (emotion, confidence)
+            self._cond.notify()
+        self._ensure_worker()
+        return True
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="oled-sender", daemon=True)
+                    self._thread.start()
+
+    def _next_job(self):
+        """Returns (target, value) ready to send, or the seconds to wait."""
+        now = time.time()
+        wait = None
+        for target in self._targets.values():
+            if target.pending is None or target.inflight is not None:
+                continue
+            if target.next_send <= now:
+                value, target.pending = target.pending, None
+                target.inflight = value
+                target.next_send = now + self.min_interval
+                return target, value
+            delay = target.next_send - now
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                target, value = self._next_job()
+                while target is None:
+                    self._cond.wait(timeout=value)
+                    target, value = self._next_job()
+
+            ok = face_analysis.send_emotion_to_esp32(value[0], value[1], url=target.url, http=self._http)
+
+            with self._cond:
+                target.inflight = None
+                if ok:
+                    target.sent += 1
+                    target.shown = value
+                    target.shown_time = time.time()
+                else:
+                    # Not marked as shown, so the next submit() queues it again
+                    target.failed += 1
+
+    def forget(self, url):
+        """Drops the state of a target (e.g. after its URL was changed)."""
+        with self._cond:
+            self._targets.pop(url, None)
+
+    def stats(self):
+        with self._cond:
+            return {
+                t.url: {
+                    "sent": t.sent,
+                    "skipped": t.skipped,
+                    "failed": t.failed,
+                    "shown": {"emotion": t.shown[0], "confidence": t.shown[1]} if t.shown else None,
+                }
+                for t in self._targets.values()
+            }
+
+
+# Global OLED sender
+oled_sender = OledSender()
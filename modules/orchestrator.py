@@ -0,0 +1,403 @@
+"""
+Multi-camera orchestrator
+
+Manages a set of ESP32-CAM sources. Each source has its own capture +
+pipeline thread (a `FrameProcessor` on the source's session) that publishes
+annotated frames into a `FrameBuffer`; browsers only read from that buffer.
+DeepFace calls of all sources go through one `InferenceScheduler`, which
+shares a global inference budget between the cameras with weighted fair
+queuing, so one busy camera cannot starve the others.
+
+Sources are configured with `CAMERA_SOURCES` in modules/config.py or added
+at runtime (`/cameras` routes in main.py). `/video_feed?ip=` adds unknown
+IPs as on-demand sources that stop again when nobody watches them.
+
+Dropped streams are reconnected with backoff (modules/health.py); viewers
+get a "reconnecting" placeholder frame meanwhile instead of a closed stream.
+"""
+import time
+import threading
+import cv2
+from modules.config import (
+    CAMERA_SOURCES, INFERENCE_WORKERS, INFERENCE_MAX_RATE, ON_DEMAND_IDLE_TIMEOUT
+)
+from modules import esp_client, metrics
+from modules.camera import FrameProcessor, camera_stream
+from modules.face_analysis import detect_emotions
+from modules.frame_buffer import FrameBuffer
+from modules.health import RateMeter, StreamConnection, device_monitor
+from modules.inference_pool import get_pool, pool_size
+from modules.recording import recorder
+from modules.tracing import tracer
+from modules.session import sessions
+
+
+class _Client:
+    def __init__(self, client_id, weight):
+        self.client_id = client_id
+        self.weight = weight
+        self.vtime = 0.0       # virtual time (service received / weight)
+        self.pending = None    # (fn, args) - at most one, newer requests replace it
+        self.running = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+
+
+class InferenceScheduler:
+    """Weighted fair scheduler for inference jobs shared by all cameras.
+
+    - Budget: `workers` jobs run concurrently, optionally capped at
+      `max_rate` job starts per second (0 = no cap).
+    - Fairness: start-time fair queuing. Every client's virtual time grows by
+      (seconds of inference used / weight); the pending client with the
+      lowest virtual time runs next. A client that was idle rejoins at the
+      current virtual time, so idling does not bank credit.
+    - Each client has at most one job running and one pending; submitting
+      while one is pending replaces it (only the newest frame matters).
+    """
+
+    def __init__(self, workers=1, max_rate=0.0):
+        self.workers = workers
+        self.max_rate = max_rate
+        self._cond = threading.Condition()
+        self._clients = {}
+        self._vclock = 0.0
+        self._next_start = 0.0
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name=f"inference-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def register(self, client_id, weight=1.0):
+        with self._cond:
+            client = self._clients.get(client_id)
+            if client is None:
+                client = _Client(client_id, weight)
+                client.vtime = self._vclock
+                self._clients[client_id] = client
+            client.weight = max(float(weight), 1e-3)
+            return client
+
+    def unregister(self, client_id):
+        with self._cond:
+            self._clients.pop(client_id, None)
+
+    def submit(self, client_id, fn, *args):
+        """Queues `fn(*args)` for a client. Returns False if it replaced a pending job."""
+        with self._cond:
+            client = self._clients[client_id]
+            client.submitted += 1
+            replaced = client.pending is not None
+            if replaced:
+                client.coalesced += 1
+            elif not client.running:
+                client.vtime = max(client.vtime, self._vclock)
+            client.pending = (fn, args)
+            self._cond.notify()
+            return not replaced
+
+    def _pick(self):
+        ready = [c for c in self._clients.values() if c.pending is not None and not c.running]
+        if not ready:
+            return None
+        return min(ready, key=lambda c: c.vtime)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    client = self._pick()
+                    if client is not None:
+                        wait = self._next_start - time.time() if self.max_rate > 0 else 0
+                        if wait <= 0:
+                            break
+                        self._cond.wait(timeout=wait)
+                    else:
+                        self._cond.wait()
+                fn, args = client.pending
+                client.pending = None
+                client.running = True
+                self._vclock = client.vtime
+                if self.max_rate > 0:
+                    self._next_start = time.time() + 1.0 / self.max_rate
+
+            start = time.time()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ Inference job failed ({client.client_id}): {e}")
+            elapsed = time.time() - start
+
+            with self._cond:
+                client.running = False
+                client.completed += 1
+                client.busy_seconds += elapsed
+                client.vtime += elapsed / client.weight
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                c.client_id: {
+                    "weight": c.weight,
+                    "submitted": c.submitted,
+                    "coalesced": c.coalesced,
+                    "completed": c.completed,
+                    "busy_seconds": round(c.busy_seconds, 3),
+                }
+                for c in self._clients.values()
+            }
+
+
+class CameraSource:
+    """Capture + pipeline thread of one ESP32-CAM."""
+
+    def __init__(self, ip, scheduler, name=None, priority=1.0, on_demand=False):
+        self.ip = ip
+        self.name = name or ip
+        self.priority = priority
+        self.on_demand = on_demand
+        self.scheduler = scheduler
+        self.session = sessions.get_or_create(ip)
+        self.output = FrameBuffer()
+        self.state = "stopped"
+        self.last_error = None
+        self.last_frame_time = None
+        self.viewers = 0
+        self._last_viewer_time = time.time()
+        self.capture_rate = RateMeter()
+        self.analysis_rate = RateMeter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.connection = StreamConnection(self.url)
+
+    @property
+    def url(self):
+        return esp_client.stream_url(self.ip)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.scheduler.register(self.ip, self.priority)
+            device_monitor.watch(self.ip)
+            self._stop.clear()
+            # A restarted on-demand source must not count as idle since its last run
+            self._last_viewer_time = time.time()
+            self.state = "starting"
+            self._thread = threading.Thread(target=self._run, name=f"camera-{self.ip}", daemon=True)
+            self._thread.start()
+
+    def stop(self, wait=True):
+        with self._lock:
+            self._stop.set()
+            thread = self._thread
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.scheduler.unregister(self.ip)
+        self.state = "stopped"
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def set_priority(self, priority):
+        self.priority = priority
+        self.scheduler.register(self.ip, priority)
+
+    def _analyze(self, rgb):
+        """Runs on an inference worker; hands the result to the pipeline thread."""
+        metrics.set_source(self.ip)
+        self.session.post_emotions(detect_emotions(rgb))
+        self.analysis_rate.tick()
+
+    def _submit_analysis(self, rgb):
+        self.scheduler.submit(self.ip, self._analyze, rgb)
+
+    def _run(self):
+        processor = FrameProcessor(self.session, analyzer=self._submit_analysis)
+        conn = self.connection
+        try:
+            while not self._stop.is_set():
+                with tracer.frame(self.ip):
+                    with tracer.span("capture", self.ip):
+                        frame = conn.read(wait=self._stop.wait)
+                    self.state = conn.state
+                    device_monitor.report_stream_state(self.ip, conn.state)
+                    now = time.time()
+                    if frame is None:
+                        # Keep viewers connected while the stream is down
+                        self.last_error = conn.last_error
+                        self.output.publish(conn.placeholder())
+                    else:
+                        self.last_frame_time = now
+                        self.capture_rate.tick(now)
+                        device_monitor.report_frame(self.ip, now)
+                        recorder.tap_frame(self.ip, frame, now)
+
+                        with tracer.span("decode", self.ip):
+                            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                        processor.process(frame, rgb, camera_stream.is_detection_enabled())
+
+                        with tracer.span("encode", self.ip), \
+                                metrics.STAGE_SECONDS.time(stage="imencode", source=self.ip):
+                            ok, buffer = cv2.imencode('.jpg', frame)
+                        if ok:
+                            self.output.publish(buffer.tobytes(), frame)
+
+                if self.on_demand and self._idle_for(now) > ON_DEMAND_IDLE_TIMEOUT:
+                    print(f"✓ Camera {self.ip} stopped (no viewers)")
+                    # Ends streams that attached meanwhile instead of leaving them waiting
+                    self._stop.set()
+                    self.scheduler.unregister(self.ip)
+                    break
+        finally:
+            conn.release()
+            self.state = "stopped"
+            device_monitor.report_stream_state(self.ip, "stopped")
+
+    def touch(self):
+        """Counts as viewer activity (e.g. a snapshot request) for on-demand sources."""
+        self._last_viewer_time = time.time()
+
+    def _idle_for(self, now):
+        if self.viewers > 0:
+            return 0.0
+        return now - self._last_viewer_time
+
+    def add_viewer(self):
+        with self._lock:
+            self.viewers += 1
+
+    def remove_viewer(self):
+        with self._lock:
+            self.viewers = max(0, self.viewers - 1)
+            self._last_viewer_time = time.time()
+
+    def stream(self, viewer=None):
+        """MJPEG generator for one viewer, served from the output buffer.
+
+        `viewer` (output_profiles.ViewerQuality) selects the viewer's output profile.
+        """
+        self.add_viewer()
+        keep_running = lambda: not self._stop.is_set()
+        if viewer is None:
+            parts = self.output.mjpeg(keep_running=keep_running)
+        else:
+            parts = viewer.stream(self.output, keep_running=keep_running)
+        try:
+            for part in parts:
+                with tracer.span("send", self.ip):
+                    yield part
+        finally:
+            self.remove_viewer()
+
+    def health(self):
+        now = time.time()
+        return {
+            "ip": self.ip,
+            "name": self.name,
+            "priority": self.priority,
+            "on_demand": self.on_demand,
+            "state": self.state,
+            "running": self.is_running(),
+            "viewers": self.viewers,
+            "fps": round(self.capture_rate.rate(now), 2),
+            "analysis_rate": round(self.analysis_rate.rate(now), 2),
+            "frames": self.capture_rate.total,
+            "analyses": self.analysis_rate.total,
+            "last_frame_age": round(now - self.last_frame_time, 2) if self.last_frame_time else None,
+            "last_error": self.last_error,
+            "reconnects": self.connection.reconnects,
+        }
+
+
+class Orchestrator:
+    """Registry of camera sources sharing one inference scheduler."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._sources = {}
+        self._lock = threading.Lock()
+        device_monitor.add_listener(self._on_device_state)
+
+    def _on_device_state(self, ip, old, new):
+        # Device answers probes again: reconnect now instead of after the backoff
+        source = self._sources.get(ip)
+        if new == "online" and source is not None:
+            source.connection.retry_now()
+
+    def add_source(self, ip, name=None, priority=1.0, on_demand=False, start=True):
+        with self._lock:
+            source = self._sources.get(ip)
+            if source is None:
+                source = CameraSource(ip, self.scheduler, name=name, priority=priority, on_demand=on_demand)
+                self._sources[ip] = source
+            else:
+                if name:
+                    source.name = name
+                source.set_priority(priority)
+                source.on_demand = source.on_demand and on_demand
+        if start:
+            source.start()
+        return source
+
+    def remove_source(self, ip):
+        with self._lock:
+            source = self._sources.pop(ip, None)
+        if source is not None:
+            source.stop()
+            device_monitor.unwatch(ip)
+        return source
+
+    def get(self, ip):
+        return self._sources.get(ip)
+
+    def sources(self):
+        return list(self._sources.values())
+
+    def ensure_stream(self, ip):
+        """Returns a running source for `ip`, adding it on demand if unknown."""
+        source = self.get(ip) or self.add_source(ip, on_demand=True, start=False)
+        source.start()
+        return source
+
+    def start_all(self):
+        for source in self.sources():
+            source.start()
+
+    def stop_all(self):
+        for source in self.sources():
+            source.stop()
+
+    def load_config(self, entries=CAMERA_SOURCES):
+        """Adds (and starts) the configured sources."""
+        for entry in entries:
+            self.add_source(entry["ip"], name=entry.get("name"), priority=entry.get("priority", 1.0))
+
+    def health(self):
+        per_source = {s.ip: s.health() for s in self.sources()}
+        running = [h for h in per_source.values() if h["running"]]
+        pool = get_pool(create=False)
+        return {
+            "aggregate": {
+                "sources": len(per_source),
+                "running": len(running),
+                "fps": round(sum(h["fps"] for h in running), 2),
+                "analysis_rate": round(sum(h["analysis_rate"] for h in running), 2),
+                "inference_workers": self.scheduler.workers,
+                "inference_max_rate": self.scheduler.max_rate,
+            },
+            "sources": per_source,
+            "devices": device_monitor.status(),
+            "scheduler": self.scheduler.stats(),
+            "inference_pool": pool.stats() if pool is not None else None,
+        }
+
+
+# Global orchestrator
+orchestrator = Orchestrator(InferenceScheduler(workers=max(INFERENCE_WORKERS, pool_size()),
+                                               max_rate=INFERENCE_MAX_RATE))
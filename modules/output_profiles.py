@@ -0,0 +1,184 @@
+"""
+Per-viewer output quality of /video_feed
+
+Each viewer streams with an output profile (resolution scale, JPEG quality,
+max FPS; OUTPUT_PROFILES). `?profile=<name>` fixes it, `?profile=auto`
+(OUTPUT_PROFILE_DEFAULT) starts at the best profile and adapts to the
+viewer's link:
+
+- the time a `yield` of a frame takes is the time the server needed to
+  write the previous one to the socket; its moving average above
+  OUTPUT_ADAPT_DEGRADE_SECONDS steps the viewer down one profile,
+- staying below OUTPUT_ADAPT_UPGRADE_SECONDS for OUTPUT_ADAPT_UPGRADE_AFTER
+  seconds steps it up again.
+
+So a slow viewer gets fewer, smaller frames instead of holding its thread
+on a full-size frame, and with a per-viewer generator (the default local
+stream) it no longer throttles the loop it runs.
+
+Lower profiles are re-encoded through `FrameBuffer.variant()`, keyed by
+(scale, quality): ten viewers on "low" cost one extra encode per frame, not
+ten. `scale`, `quality` and `max_fps` query params override single fields
+of the chosen profile (the result is a fixed profile).
+"""
+import time
+from collections import namedtuple
+import cv2
+import numpy as np
+from modules.config import (
+    OUTPUT_PROFILES, OUTPUT_PROFILE_DEFAULT, OUTPUT_ADAPT_DEGRADE_SECONDS,
+    OUTPUT_ADAPT_UPGRADE_SECONDS, OUTPUT_ADAPT_UPGRADE_AFTER,
+)
+
+Profile = namedtuple("Profile", "name scale quality max_fps")
+
+PROFILES = [Profile(name, float(p.get("scale", 1.0)), int(p.get("quality", 0)), float(p.get("max_fps", 0)))
+            for name, p in OUTPUT_PROFILES.items()]
+_BY_NAME = {p.name: p for p in PROFILES}
+
+# Decode at 1/2, 1/4, 1/8 size when the variant is made from the JPEG
+_REDUCED_READS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                  (2, cv2.IMREAD_REDUCED_COLOR_2))
+_DEFAULT_QUALITY = 90  # quality of scaled variants of profiles with quality 0
+
+
+def _mjpeg_part(jpeg):
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+
+def encode_variant(jpeg, frame, scale, quality):
+    """`frame` (or the decoded `jpeg`) scaled by `scale` and encoded at `quality`."""
+    if frame is None:
+        flag, factor = cv2.IMREAD_COLOR, 1
+        for reduce, reduced_flag in _REDUCED_READS:
+            if scale * reduce <= 1.0:
+                flag, factor = reduced_flag, reduce
+                break
+        frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flag)
+        if frame is None:
+            return jpeg
+        scale *= factor
+    if scale < 0.999:
+        h, w = frame.shape[:2]
+        frame = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality or _DEFAULT_QUALITY])
+    return buffer.tobytes() if ok else jpeg
+
+
+class ViewerQuality:
+    """Output profile of one viewer; adapts to send backpressure when automatic."""
+
+    def __init__(self, profile=None, adaptive=False):
+        self.adaptive = adaptive
+        self.level = 0
+        self.profile = profile or PROFILES[0]
+        if profile is not None and profile.name in _BY_NAME:
+            self.level = PROFILES.index(_BY_NAME[profile.name])
+        self.send_avg = 0.0
+        self.changes = 0
+        self._next_due = 0.0
+        self._fast_since = None
+
+    def due(self, now=None):
+        """True if the profile's max FPS allows sending a frame now."""
+        return (time.monotonic() if now is None else now) >= self._next_due
+
+    def wait_due(self):
+        delay = self._next_due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def encode(self, buffer, seq, jpeg):
+        """Frame `seq` of `buffer` in this viewer's profile (shared variant encode)."""
+        p = self.profile
+        if p.scale >= 0.999 and not p.quality:
+            return jpeg
+        return buffer.variant(seq, jpeg, (p.scale, p.quality),
+                              lambda data, frame: encode_variant(data, frame, p.scale, p.quality))
+
+    def sent(self, seconds, now=None):
+        """Records how long handing one frame to the server took."""
+        now = time.monotonic() if now is None else now
+        if self.profile.max_fps > 0:
+            self._next_due = now + 1.0 / self.profile.max_fps - seconds
+        self.send_avg = 0.8 * self.send_avg + 0.2 * seconds
+        if not self.adaptive:
+            return
+        if self.send_avg > OUTPUT_ADAPT_DEGRADE_SECONDS:
+            self._fast_since = None
+            if self.level < len(PROFILES) - 1:
+                self._set_level(self.level + 1)
+        elif self.send_avg < OUTPUT_ADAPT_UPGRADE_SECONDS and self.level > 0:
+            if self._fast_since is None:
+                self._fast_since = now
+            elif now - self._fast_since >= OUTPUT_ADAPT_UPGRADE_AFTER:
+                self._set_level(self.level - 1)
+        else:
+            self._fast_since = None
+
+    def _set_level(self, level):
+        self.level = level
+        self.profile = PROFILES[level]
+        self.changes += 1
+        # Judge the new profile on its own sends
+        self.send_avg = 0.0
+        self._fast_since = None
+
+    def stream(self, buffer, timeout=5.0, keep_running=lambda: True):
+        """Multipart MJPEG generator over `buffer` in this viewer's profile."""
+        seq = 0
+        while keep_running():
+            self.wait_due()
+            new_seq, jpeg = buffer.wait_for(seq, timeout=timeout)
+            if new_seq == seq or jpeg is None:
+                continue
+            seq = new_seq
+            part = _mjpeg_part(self.encode(buffer, seq, jpeg))
+            start = time.monotonic()
+            yield part
+            self.sent(time.monotonic() - start)
+
+    def status(self):
+        return {"profile": self.profile.name, "adaptive": self.adaptive, "changes": self.changes,
+                "send_avg_ms": round(self.send_avg * 1000.0, 1)}
+
+
+def viewer_quality(args):
+    """ViewerQuality from request args (?profile=, ?scale=, ?quality=, ?max_fps=).
+
+    Raises ValueError for an unknown profile or invalid overrides.
+    """
+    name = args.get('profile') or OUTPUT_PROFILE_DEFAULT
+    adaptive = name == "auto"
+    if adaptive:
+        profile = PROFILES[0]
+    elif name in _BY_NAME:
+        profile = _BY_NAME[name]
+    else:
+        raise ValueError(f"profile must be auto or one of {', '.join(_BY_NAME)}")
+
+    overrides = {}
+    try:
+        _parse_overrides(args, overrides)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid output override: {e}") from None
+    if overrides:
+        return ViewerQuality(profile._replace(name="custom", **overrides))
+    return ViewerQuality(profile, adaptive=adaptive)
+
+
+def _parse_overrides(args, overrides):
+    if args.get('scale'):
+        overrides["scale"] = float(args['scale'])
+        if not 0.05 <= overrides["scale"] <= 1.0:
+            raise ValueError("scale must be between 0.05 and 1")
+    if args.get('quality'):
+        overrides["quality"] = int(args['quality'])
+        if not 1 <= overrides["quality"] <= 100:
+            raise ValueError("quality must be between 1 and 100")
+    if args.get('max_fps'):
+        overrides["max_fps"] = float(args['max_fps'])
+        if overrides["max_fps"] < 0:
+            raise ValueError("max_fps must be >= 0")
@@ -0,0 +1,185 @@
+"""
+Client side of the pipeline process (production mode, see serve.py)
+
+Web workers do not run cameras or models. They talk to the single pipeline
+process over a `multiprocessing` manager connection (PIPELINE_RPC_PORT) and
+get encoded frames and emotion state from it. Only light modules are
+imported here.
+
+Frames are read from shared-memory rings (`SharedFrameBuffer`, same host)
+or fetched over RPC (`RemoteFrameBuffer`, FRAME_TRANSPORT "rpc").
+"""
+import threading
+from multiprocessing.managers import BaseManager
+from modules.config import PIPELINE_HOST, PIPELINE_RPC_PORT, PIPELINE_AUTHKEY, FRAME_TRANSPORT
+from modules.frame_buffer import FrameBuffer, VariantCache
+from modules.shm_ring import SharedFrameRing
+
+
+class PipelineManager(BaseManager):
+    """Manager exposing the pipeline process' `PipelineService` as "pipeline"."""
+
+
+PipelineManager.register('pipeline')
+
+
+def rpc_address():
+    return (PIPELINE_HOST, PIPELINE_RPC_PORT)
+
+
+def rpc_authkey():
+    return PIPELINE_AUTHKEY.encode()
+
+
+class PipelineClient:
+    """Reconnecting proxy to the pipeline service (thread-safe)."""
+
+    _CONNECTION_ERRORS = (ConnectionError, EOFError, OSError)
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or rpc_address()
+        self.authkey = authkey if authkey is not None else rpc_authkey()
+        self._lock = threading.Lock()
+        self._service = None
+
+    def _connect(self):
+        with self._lock:
+            if self._service is None:
+                manager = PipelineManager(self.address, authkey=self.authkey)
+                manager.connect()
+                self._service = manager.pipeline()
+            return self._service
+
+    def call(self, method, *args):
+        """Calls a PipelineService method, reconnecting once if the pipeline restarted."""
+        service = self._service or self._connect()
+        try:
+            return getattr(service, method)(*args)
+        except self._CONNECTION_ERRORS:
+            with self._lock:
+                self._service = None
+            return getattr(self._connect(), method)(*args)
+
+
+_remote_variants = {}
+_remote_variants_lock = threading.Lock()
+
+
+class RemoteFrameBuffer(FrameBuffer):
+    """FrameBuffer view of a source's output in the pipeline process.
+
+    `source` None means the default stream (/video_feed without ip).
+    Raises LookupError (from the pipeline) for unknown sources.
+    """
+
+    def __init__(self, client, source=None):
+        super().__init__()
+        self.client = client
+        self.source = source
+        self.source_id = source
+        # Output profile variants are shared by this process' viewers of the source
+        with _remote_variants_lock:
+            self.variants = _remote_variants.setdefault(source, VariantCache())
+
+    def _fetch(self, after_seq, timeout):
+        self.source_id, self.seq, self.jpeg, self.timestamp = self.client.call(
+            'frame', self.source, after_seq, timeout)
+        return self.seq, self.jpeg
+
+    def latest(self):
+        return self._fetch(None, 0)
+
+    def wait_for(self, after_seq, timeout=None):
+        return self._fetch(after_seq, timeout)
+
+
+class _RingWatcher:
+    """Wakes this process' waiters on a ring's new frames.
+
+    One polling thread per ring and process (only while someone waits),
+    instead of every viewer thread polling the ring.
+    """
+
+    def __init__(self, ring, poll=0.002):
+        self.ring = ring
+        self.poll = poll
+        # Output profile variants, shared by this process' viewers of the ring
+        self.variants = VariantCache()
+        self._cond = threading.Condition()
+        self._waiters = 0
+        threading.Thread(target=self._run, name=f"ring-{ring.name}", daemon=True).start()
+
+    def _run(self):
+        seq = self.ring.latest_seq()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._waiters > 0)
+            new_seq = self.ring.latest_seq()
+            if new_seq != seq:
+                seq = new_seq
+                with self._cond:
+                    self._cond.notify_all()
+            self.ring.wait_for(seq, timeout=0.1, poll=self.poll)
+
+    def wait_for(self, after_seq, timeout=None):
+        with self._cond:
+            self._waiters += 1
+            self._cond.notify_all()
+            try:
+                self._cond.wait_for(lambda: self.ring.latest_seq() > after_seq, timeout=timeout)
+            finally:
+                self._waiters -= 1
+        return self.ring.latest_seq()
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def _watcher(name):
+    with _watchers_lock:
+        watcher = _watchers.get(name)
+        if watcher is None:
+            watcher = _watchers[name] = _RingWatcher(SharedFrameRing.attach(name))
+        return watcher
+
+
+class SharedFrameBuffer(FrameBuffer):
+    """FrameBuffer view of a source's output read from its shared-memory ring.
+
+    Only the ring name comes over RPC (this also counts as viewer activity
+    for on-demand sources); frames are copied once, straight from shared
+    memory. Raises LookupError (from the pipeline) for unknown sources.
+    """
+
+    def __init__(self, client, source=None):
+        super().__init__()
+        self.client = client
+        self.source = source
+        self._resolve()
+
+    def _resolve(self):
+        self.source_id, name = self.client.call('frame_ring', self.source)
+        self.watcher = _watcher(name)
+        self.variants = self.watcher.variants
+
+    def latest(self):
+        seq, jpeg, timestamp = self.watcher.ring.jpeg_bytes()
+        self.seq, self.jpeg, self.timestamp = seq, jpeg, timestamp
+        return seq, jpeg
+
+    def wait_for(self, after_seq, timeout=None):
+        if self.watcher.wait_for(after_seq, timeout) <= after_seq:
+            # Idle: re-resolve in case the pipeline restarted with new rings
+            try:
+                self._resolve()
+            except LookupError:
+                pass
+        return self.latest()
+
+
+def frame_buffer(client, source=None):
+    """FrameBuffer of `source` in the pipeline process for the configured FRAME_TRANSPORT."""
+    if FRAME_TRANSPORT == "shm":
+        return SharedFrameBuffer(client, source)
+    return RemoteFrameBuffer(client, source)
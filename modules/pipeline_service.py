@@ -0,0 +1,140 @@
+"""
+Pipeline process service (production mode, see serve.py)
+
+`PipelineService` is what the web workers see of the pipeline process:
+encoded frames and emotion state of the sources, served over a
+`multiprocessing` manager connection. `frame_source()` is also used by the
+snapshot routes of main.py.
+
+With FRAME_TRANSPORT "shm" the frames themselves do not go over RPC: each
+requested source's FrameBuffer is mirrored into a shared-memory ring
+(`frame_ring()`) and web workers read it directly; RPC only resolves names.
+"""
+import os
+import atexit
+import itertools
+import threading
+from modules.camera import camera_stream
+from modules.config import FRAME_RING_SLOTS, FRAME_RING_SLOT_BYTES
+from modules.http_views import emotion_payload
+from modules.orchestrator import orchestrator
+from modules.pipeline_client import PipelineManager, rpc_address, rpc_authkey
+from modules.session import sessions, LOCAL_SOURCE
+from modules.shm_ring import SharedFrameRing
+
+_rings = {}
+_rings_lock = threading.Lock()
+_ring_ids = itertools.count(1)
+
+
+def frame_source(source=None):
+    """Returns (source_id, FrameBuffer) holding the frames of `source`.
+
+    None is the default stream (CameraStream). ESP IPs not served by the
+    default stream are started as on-demand orchestrator sources; their
+    access counts as viewer activity. Raises LookupError for the local
+    camera when it is not the selected source.
+    """
+    if source is None or (source == camera_stream.source_id and orchestrator.get(source) is None):
+        return camera_stream.source_id, camera_stream.output
+    if source == LOCAL_SOURCE:
+        raise LookupError("Local camera is not the selected source")
+    camera = orchestrator.ensure_stream(source)
+    camera.touch()
+    return source, camera.output
+
+
+def frame_ring(source=None):
+    """Returns (source_id, ring name) of the shared-memory mirror of `source`'s frames.
+
+    Rings are created on first request, one per source (the default stream
+    has its own), and are re-attached if the source's buffer is replaced.
+    Names include the pipeline's pid, so a restarted pipeline never hands
+    out a stale ring.
+    """
+    source_id, buffer = frame_source(source)
+    key = None if buffer is camera_stream.output else source_id
+    with _rings_lock:
+        ring = _rings.get(key)
+        if ring is None:
+            ring = _rings[key] = SharedFrameRing.create(
+                f"frm{os.getpid()}-{next(_ring_ids)}", FRAME_RING_SLOTS, FRAME_RING_SLOT_BYTES)
+        buffer.mirror = ring
+    return source_id, ring.name
+
+
+@atexit.register
+def _unlink_rings():
+    with _rings_lock:
+        for ring in _rings.values():
+            ring.unlink()
+        _rings.clear()
+
+
+class PipelineService:
+    """Methods callable from web workers (arguments and results are pickled)."""
+
+    def frame(self, source, after_seq, timeout):
+        """(source_id, seq, jpeg, timestamp); waits for seq > after_seq unless after_seq is None."""
+        source_id, buffer = frame_source(source)
+        if after_seq is None:
+            seq, jpeg = buffer.latest()
+        else:
+            seq, jpeg = buffer.wait_for(after_seq, timeout=timeout)
+        return source_id, seq, jpeg, buffer.timestamp
+
+    def frame_ring(self, source):
+        """(source_id, shared-memory ring name) of `source`, see frame_ring()."""
+        return frame_ring(source)
+
+    def open_viewer(self, ip):
+        orchestrator.ensure_stream(ip).add_viewer()
+
+    def close_viewer(self, ip):
+        camera = orchestrator.get(ip)
+        if camera is not None:
+            camera.remove_viewer()
+
+    def default_source(self):
+        return camera_stream.source_id
+
+    def emotions(self, source=None, create=False):
+        """/current_emotions payload; LookupError for an unknown explicit source."""
+        source = source or camera_stream.source_id
+        session = sessions.get_or_create(source) if create else sessions.get(source)
+        if session is None and source != camera_stream.source_id:
+            raise LookupError(f"Unknown source: {source}")
+        return emotion_payload(source, session.latest_state if session else None,
+                               camera_stream.is_detection_enabled())
+
+    def wait_state(self, source, after_seq, timeout):
+        """(state seq, payload) once the state passed after_seq (or timeout).
+
+        LookupError for an unknown explicit source.
+        """
+        if source:
+            session = sessions.get(source)
+            if session is None:
+                raise LookupError(f"Unknown source: {source}")
+        else:
+            source = camera_stream.source_id
+            session = sessions.get_or_create(source)
+        seq = session.wait_state(after_seq, timeout)
+        return seq, emotion_payload(source, session.latest_state, camera_stream.is_detection_enabled())
+
+
+class _ServerManager(PipelineManager):
+    pass
+
+
+def serve_rpc(service, address=None, authkey=None):
+    """Serves `service` to web workers (blocks)."""
+    authkey = authkey or rpc_authkey()
+    if not authkey:
+        # The manager unpickles requests: never serve it without a secret
+        raise ValueError("PIPELINE_AUTHKEY must not be empty")
+    _ServerManager.register('pipeline', callable=lambda: service)
+    manager = _ServerManager(address or rpc_address(), authkey=authkey)
+    server = manager.get_server()
+    print(f"✓ Pipeline RPC on {server.address[0]}:{server.address[1]}")
+    server.serve_forever()
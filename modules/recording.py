@@ -0,0 +1,367 @@
+"""
+Record and replay of camera streams
+
+The recorder taps the capture stage of the frame loops and appends the
+captured frames (JPEG) with their capture time to an indexed, append-only
+container, so field footage can be replayed through the same pipeline:
+
+    recordings/<name>.frec       <record><record><record>...
+    recordings/<name>.frec.idx   fixed-size (offset, timestamp, length) entries
+
+Each record is `header | jpeg bytes`. Records are self-describing, so an
+index lost or torn by a crash is rebuilt from the data file on open, and an
+existing recording is appended to rather than overwritten.
+
+Taps (`recorder.tap_jpeg` / `recorder.tap_frame`) only hand the frame to a
+bounded queue; a writer thread per recording encodes raw frames and writes,
+and frames are dropped (counted) if it falls behind. With nothing
+recording a tap is one dict check.
+
+`ReplaySource` plays a recording back for `CameraStream` (/set_camera_source
+{"mode": "replay", ...}) or the benchmarks: at the recorded pace (speed=1),
+N times faster (speed=N) or as fast as possible (speed=0), reading the JPEG
+bytes straight from an `mmap` of the file.
+
+Command line:
+    python -m modules.recording info <file.frec>
+    python -m modules.recording export <file.frec> <dest_dir>
+"""
+import os
+import sys
+import mmap
+import atexit
+import time
+import queue
+import struct
+import threading
+from collections import namedtuple
+import cv2
+import numpy as np
+from modules.config import RECORDINGS_DIR, RECORD_QUEUE_SIZE, RECORD_JPEG_QUALITY
+
+_MAGIC = b"FREC"
+# magic, capture time (unix), image length
+_RECORD_HEADER = struct.Struct("<4sdI")
+# record offset, capture time, image length
+_INDEX_ENTRY = struct.Struct("<QdI")
+
+SUFFIX = ".frec"
+_INDEX_SUFFIX = ".idx"
+
+Entry = namedtuple("Entry", "offset timestamp length")
+
+
+def recording_path(name):
+    """Path of a recording by name, confined to RECORDINGS_DIR."""
+    name = os.path.basename(name)
+    if not name.endswith(SUFFIX):
+        name += SUFFIX
+    return os.path.join(RECORDINGS_DIR, name)
+
+
+def _load_index(path):
+    """Index entries of a recording, recovering records missing from the index."""
+    entries = []
+    index_path = path + _INDEX_SUFFIX
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % _INDEX_ENTRY.size
+        entries = [Entry(*e) for e in _INDEX_ENTRY.iter_unpack(data[:usable])]
+    end = entries[-1].offset + entries[-1].length if entries else 0
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if end > size:
+        # Index ahead of the data (data file replaced): rebuild from scratch
+        entries, end = [], 0
+    recovered = []
+    if end < size:
+        with open(path, "rb") as f:
+            f.seek(end)
+            data = f.read()
+        pos = 0
+        while pos + _RECORD_HEADER.size <= len(data):
+            magic, ts, length = _RECORD_HEADER.unpack_from(data, pos)
+            stop = pos + _RECORD_HEADER.size + length
+            if magic != _MAGIC or stop > len(data):
+                break
+            recovered.append(Entry(end + pos + _RECORD_HEADER.size, ts, length))
+            pos = stop
+        end += pos
+    return entries, recovered, end, size
+
+
+class FrameRecorder:
+    """Appends frames to one recording file from a background writer thread."""
+
+    def __init__(self, path, source=None, queue_size=RECORD_QUEUE_SIZE, quality=RECORD_JPEG_QUALITY):
+        self.path = path
+        self.source = source
+        self.quality = quality
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        entries, recovered, end, size = _load_index(path)
+        if end < size:
+            # Torn write at the tail: drop it so the next append starts clean
+            with open(path, "r+b") as f:
+                f.truncate(end)
+            print(f"⚠️ Recording {path} truncated to last complete frame")
+        index_path = path + _INDEX_SUFFIX
+        if recovered or not os.path.exists(index_path) or \
+                os.path.getsize(index_path) != len(entries) * _INDEX_ENTRY.size:
+            with open(index_path, "wb") as f:
+                for entry in entries + recovered:
+                    f.write(_INDEX_ENTRY.pack(*entry))
+
+        self._file = open(path, "ab")
+        self._index = open(index_path, "ab")
+        self._size = end
+        self.frames = len(entries) + len(recovered)
+        self.written = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.started = time.time()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop, name=f"recorder-{source}", daemon=True)
+        self._thread.start()
+
+    def append(self, jpeg, timestamp=None):
+        """Writes one JPEG frame (called from the writer thread)."""
+        timestamp = time.time() if timestamp is None else timestamp
+        image = memoryview(jpeg).cast("B")
+        self._file.write(_RECORD_HEADER.pack(_MAGIC, timestamp, len(image)))
+        self._file.write(image)
+        self._file.flush()
+        # Index last: a record is only listed once it is complete
+        self._index.write(_INDEX_ENTRY.pack(self._size + _RECORD_HEADER.size, timestamp, len(image)))
+        self._index.flush()
+        self._size += _RECORD_HEADER.size + len(image)
+        self.frames += 1
+        self.written += 1
+        self.bytes += len(image)
+
+    def submit(self, item):
+        """Queues ("jpeg", bytes, ts) or ("frame", ndarray, ts); drops it when full."""
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, data, ts = item
+            try:
+                if kind == "frame":
+                    ok, buffer = cv2.imencode('.jpg', data, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                    if not ok:
+                        continue
+                    data = buffer
+                self.append(data, ts)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Recording {self.path} write failed: {e}")
+                self.dropped += 1
+
+    def close(self):
+        """Writes the queued frames and closes the files."""
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        self._index.close()
+
+    def status(self):
+        return {
+            "source": self.source,
+            "path": self.path,
+            "frames": self.frames,
+            "written": self.written,
+            "dropped": self.dropped,
+            "bytes": self.bytes,
+            "queued": self._queue.qsize(),
+            "started": self.started,
+        }
+
+
+class RecordingManager:
+    """Active recordings by source id; the frame loops call the taps."""
+
+    def __init__(self):
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def start(self, source, name=None):
+        """Starts (or resumes appending to) a recording of `source`."""
+        with self._lock:
+            if source in self._active:
+                return self._active[source]
+            if not name:
+                safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in source)
+                name = f"{safe}-{time.strftime('%Y%m%d-%H%M%S')}"
+            rec = FrameRecorder(recording_path(name), source=source)
+            self._active[source] = rec
+        print(f"✓ Recording {source} -> {rec.path}")
+        return rec
+
+    def stop(self, source):
+        with self._lock:
+            rec = self._active.pop(source, None)
+        if rec is None:
+            return None
+        rec.close()
+        print(f"✓ Recording of {source} stopped ({rec.written} frames, {rec.dropped} dropped)")
+        return rec.status()
+
+    def stop_all(self):
+        return [self.stop(source) for source in list(self._active)]
+
+    def is_recording(self, source):
+        return source in self._active
+
+    def tap_jpeg(self, source, jpeg, timestamp=None):
+        """Records already encoded capture bytes of `source` (if recording)."""
+        if not self._active:
+            return
+        rec = self._active.get(source)
+        if rec is not None:
+            rec.submit(("jpeg", bytes(jpeg), time.time() if timestamp is None else timestamp))
+
+    def tap_frame(self, source, frame, timestamp=None):
+        """Records a decoded BGR capture frame of `source` (encoded off the frame loop)."""
+        if not self._active:
+            return
+        rec = self._active.get(source)
+        if rec is not None:
+            # The pipeline draws on the frame afterwards
+            rec.submit(("frame", frame.copy(), time.time() if timestamp is None else timestamp))
+
+    def status(self):
+        return {source: rec.status() for source, rec in list(self._active.items())}
+
+
+class Recording:
+    """Read-only view of a recording through an mmap of the data file."""
+
+    def __init__(self, path):
+        self.path = path
+        entries, recovered, end, _size = _load_index(path)
+        self.entries = entries + recovered
+        self._map = None
+        if end:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def duration(self):
+        if len(self.entries) < 2:
+            return 0.0
+        return self.entries[-1].timestamp - self.entries[0].timestamp
+
+    def timestamp(self, i):
+        return self.entries[i].timestamp
+
+    def jpeg(self, i):
+        """JPEG bytes of frame `i` as a memoryview of the map (no copy)."""
+        entry = self.entries[i]
+        return memoryview(self._map)[entry.offset:entry.offset + entry.length]
+
+    def frame(self, i):
+        """Decoded BGR frame `i`."""
+        return cv2.imdecode(np.frombuffer(self.jpeg(i), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A reader still holds a memoryview; the map is freed with it
+                pass
+            self._map = None
+
+    def info(self):
+        sizes = [e.length for e in self.entries]
+        return {
+            "path": self.path,
+            "frames": len(self.entries),
+            "duration": round(self.duration, 3),
+            "fps": round((len(self.entries) - 1) / self.duration, 2) if self.duration > 0 else None,
+            "bytes": sum(sizes),
+            "start": self.entries[0].timestamp if self.entries else None,
+        }
+
+
+class ReplaySource:
+    """Plays a recording back as a frame source.
+
+    speed=1 keeps the recorded timing, speed=N plays N times faster and
+    speed=0 returns frames as fast as they are read. Each `player()` is an
+    independent position in the (shared, mmapped) recording.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False):
+        self.recording = Recording(path)
+        self.closed = False
+        if not len(self.recording):
+            self.recording.close()
+            raise ValueError(f"Empty recording: {path}")
+        self.path = path
+        self.speed = max(0.0, float(speed))
+        self.loop = loop
+        name = os.path.basename(path)
+        self.source_id = "replay:" + (name[:-len(SUFFIX)] if name.endswith(SUFFIX) else name)
+
+    def player(self):
+        """Iterator of (timestamp, jpeg memoryview), paced per `speed`."""
+        rec = self.recording
+        while True:
+            start_wall = time.perf_counter()
+            start_ts = rec.timestamp(0)
+            for i in range(len(rec)):
+                if self.speed > 0:
+                    delay = (rec.timestamp(i) - start_ts) / self.speed - (time.perf_counter() - start_wall)
+                    if delay > 0:
+                        time.sleep(delay)
+                if self.closed:
+                    return
+                yield rec.timestamp(i), rec.jpeg(i)
+            if not self.loop:
+                return
+
+    def status(self):
+        return {"source": self.source_id, "speed": self.speed, "loop": self.loop, **self.recording.info()}
+
+    def close(self):
+        self.closed = True
+        self.recording.close()
+
+
+# Global recorder used by the frame loops
+recorder = RecordingManager()
+# Flush the queued frames of running recordings on shutdown
+atexit.register(recorder.stop_all)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2 or argv[0] not in ("info", "export") or (argv[0] == "export" and len(argv) < 3):
+        print(__doc__)
+        return 1
+    rec = Recording(argv[1])
+    if argv[0] == "info":
+        for key, value in rec.info().items():
+            print(f"{key:>10}: {value}")
+    else:
+        os.makedirs(argv[2], exist_ok=True)
+        for i in range(len(rec)):
+            with open(os.path.join(argv[2], f"{i:06d}_{rec.timestamp(i):.3f}.jpg"), "wb") as f:
+                f.write(rec.jpeg(i))
+        print(f"✓ {len(rec)} frames written to {argv[2]}")
+    rec.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Per-source session state
+
+Every frame source (the local camera, each ESP32-CAM) gets its own
+`SourceSession` that owns the state which used to be process-wide globals:
+emotion history, temporal smoother, danger check timer, OLED target and the
+latest state published by `/current_emotions`. Sessions are kept in the
+`sessions` registry, keyed by source id ("local" or the ESP IP), so several
+cameras can be processed concurrently without mixing their averages.
+"""
+import time
+import threading
+from modules.config import HISTORY_SIZE
+from modules import face_analysis
+from modules.oled import oled_sender
+from modules.face_analysis import (
+    EmotionHistory, TemporalSmoother, smoother_bank, analyze_emotions, record_emotions,
+    get_smoothed_emotions
+)
+
+LOCAL_SOURCE = "local"
+
+
+def _empty_state():
+    return {
+        "timestamp": None,
+        "emotions": None,
+        "main_emotion": None,
+        "danger_score": 0.0,
+    }
+
+
+class SourceSession:
+    """Analysis state of a single frame source."""
+
+    def __init__(self, source_id, oled_url=None):
+        self.source_id = source_id
+        self.history = EmotionHistory(HISTORY_SIZE)
+        self.smoother = TemporalSmoother(bank=smoother_bank)
+        self.last_danger_check = 0
+        # Own OLED target; None falls back to face_analysis.ESP32_TARGET_URL
+        self.oled_url = oled_url
+        # Replaced (never mutated) on each frame so readers get a consistent snapshot
+        self.latest_state = _empty_state()
+        self.created = time.time()
+        # Results of asynchronous analysis (latest wins), applied on the frame thread
+        self._pending_lock = threading.Lock()
+        self._pending = None
+        self.analyses = 0
+        # Bumped when latest_state changes visibly; push clients wait on it
+        self.state_seq = 0
+        self._state_cond = threading.Condition()
+        self._state_key = None
+
+    @property
+    def oled_target(self):
+        return self.oled_url or face_analysis.ESP32_TARGET_URL
+
+    def analyze(self, rgb_frame):
+        """Runs emotion analysis into this session's history."""
+        self.analyses += 1
+        return analyze_emotions(rgb_frame, history=self.history)
+
+    def post_emotions(self, emotions):
+        """Hands over a detection result from another thread (latest wins)."""
+        with self._pending_lock:
+            self._pending = (emotions,)
+
+    def apply_pending(self):
+        """Records a posted detection result into the history, if any."""
+        if self._pending is None:
+            return False
+        with self._pending_lock:
+            pending, self._pending = self._pending, None
+        if pending is None:
+            return False
+        self.analyses += 1
+        record_emotions(pending[0], history=self.history)
+        return True
+
+    def smoothed_emotions(self):
+        """Returns (probability vector or None, main_emotion, danger_score)."""
+        return get_smoothed_emotions(self.smoother, history=self.history)
+
+    def update_state(self, avg_emotions, main_emotion, danger_score):
+        self.latest_state = {
+            "timestamp": time.strftime("%Y%m%d-%H%M%S"),
+            "emotions": avg_emotions if avg_emotions else None,
+            "main_emotion": main_emotion,
+            "danger_score": float(danger_score),
+        }
+        # Only wake push clients when something visible (0.1 % steps) changed
+        key = (main_emotion, round(float(danger_score), 1),
+               tuple(round(v, 1) for v in avg_emotions.values()) if avg_emotions else None)
+        if key != self._state_key:
+            self._state_key = key
+            self._notify_state()
+
+    def _notify_state(self):
+        with self._state_cond:
+            self.state_seq += 1
+            self._state_cond.notify_all()
+
+    def wait_state(self, after_seq, timeout=None):
+        """Blocks until state_seq > after_seq (or timeout). Returns state_seq."""
+        with self._state_cond:
+            self._state_cond.wait_for(lambda: self.state_seq > after_seq, timeout=timeout)
+            return self.state_seq
+
+    def send_oled(self, main_emotion, avg_emotions):
+        """Queues the dominant emotion for this session's OLED target, if any.
+
+        No network I/O: delivery happens on the `oled_sender` thread.
+        """
+        url = self.oled_target
+        if main_emotion and avg_emotions and url:
+            confidence = avg_emotions.get(main_emotion, 0) / 100.0
+            return oled_sender.submit(url, main_emotion, confidence)
+        return False
+
+    def reset(self):
+        self.history.clear()
+        self.smoother.reset()
+        self.latest_state = _empty_state()
+        self._state_key = None
+        self._notify_state()
+
+    def close(self):
+        self.smoother.close()
+
+
+class SessionRegistry:
+    """Thread-safe map of source id -> SourceSession."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def get(self, source_id):
+        return self._sessions.get(source_id)
+
+    def get_or_create(self, source_id):
+        session = self._sessions.get(source_id)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(source_id)
+                if session is None:
+                    session = SourceSession(source_id)
+                    self._sessions[source_id] = session
+        return session
+
+    def remove(self, source_id):
+        with self._lock:
+            session = self._sessions.pop(source_id, None)
+        if session is not None:
+            session.close()
+        return session
+
+    def source_ids(self):
+        return list(self._sessions)
+
+    def items(self):
+        return list(self._sessions.items())
+
+
+# Global session registry
+sessions = SessionRegistry()
@@ -0,0 +1,241 @@
+"""
+Shared-memory frame ring
+
+A fixed number of slots in one `multiprocessing.shared_memory` block, written
+by a single producer process and read by any number of consumer processes
+without pickling or copying:
+
+    header | slot 0 (slot header | data) | slot 1 | ...
+
+- Raw BGR frames use the slot as an array of the frame's shape
+  (`write_frame()` / `frame()` give NumPy views; `reserve_frame()` lets the
+  producer decode or draw straight into shared memory).
+- Encoded JPEGs use a variable length up to `slot_bytes`
+  (`write_jpeg()` / `jpeg()` give memoryviews).
+
+Every write gets the next sequence number. The writer invalidates a slot
+(seq 0) before filling it and publishes the new seq last, so a reader that
+finds `slot seq == wanted seq` sees a complete frame. A slot is reused after
+`slots` further writes; consumers keeping a view longer should confirm with
+`valid(seq)` after using it (`jpeg_bytes()` does this for copies).
+
+There is no cross-process condition variable, so `wait_for()` polls the
+published sequence number (default every 2 ms).
+"""
+import sys
+import time
+import struct
+import multiprocessing
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy as np
+
+_MAGIC = b'FRNG'
+_VERSION = 1
+# magic, version, slots, slot_bytes, latest seq
+_HEADER = struct.Struct('<4sIIIQ')
+# seq, kind, length, height, width, channels, timestamp
+_SLOT = struct.Struct('<QB3xIIIId')
+_ALIGN = 64
+_HEADER_SIZE = _ALIGN
+_SLOT_HEADER_SIZE = _ALIGN
+
+KIND_RAW = 1
+KIND_JPEG = 2
+
+Slot = namedtuple('Slot', 'seq kind data shape timestamp')
+
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _attach(name):
+    """Attaches without registering the block with this process' resource tracker.
+
+    Otherwise (Python < 3.13) the block would be unlinked when the first
+    consumer process exits. `multiprocessing` children share their parent's
+    tracker, which already knows the block, so nothing is undone there.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if multiprocessing.parent_process() is not None:
+        return shm
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class SharedFrameRing:
+    """Single-writer / multi-reader ring of frames in shared memory."""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        magic, version, self.slots, self.slot_bytes, _ = _HEADER.unpack_from(self.buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{shm.name} is not a frame ring")
+        self._stride = _SLOT_HEADER_SIZE + _aligned(self.slot_bytes)
+        self._reserved = None
+
+    @classmethod
+    def create(cls, name, slots=8, slot_bytes=2 * 1024 * 1024):
+        """Creates a ring (the caller is the writer and should `unlink()` it)."""
+        stride = _SLOT_HEADER_SIZE + _aligned(slot_bytes)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER_SIZE + slots * stride)
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, _VERSION, slots, slot_bytes, 0)
+        for i in range(slots):
+            _SLOT.pack_into(shm.buf, _HEADER_SIZE + i * stride, 0, 0, 0, 0, 0, 0, 0.0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def for_frames(cls, name, shape, slots=4):
+        """Creates a ring sized for raw uint8 frames of `shape` (e.g. (768, 1024, 3))."""
+        return cls.create(name, slots=slots, slot_bytes=int(np.prod(shape)))
+
+    @classmethod
+    def attach(cls, name):
+        """Opens an existing ring for reading."""
+        return cls(_attach(name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # ---- layout ----------------------------------------------------------
+
+    def _slot_offset(self, seq):
+        return _HEADER_SIZE + (seq % self.slots) * self._stride
+
+    def latest_seq(self):
+        return _HEADER.unpack_from(self.buf, 0)[4]
+
+    def _publish(self, seq):
+        _HEADER.pack_into(self.buf, 0, _MAGIC, _VERSION, self.slots, self.slot_bytes, seq)
+
+    # ---- writer ----------------------------------------------------------
+
+    def _begin(self, length):
+        if length > self.slot_bytes:
+            raise ValueError(f"frame of {length} bytes does not fit slots of {self.slot_bytes}")
+        seq = self.latest_seq() + 1
+        offset = self._slot_offset(seq)
+        # Invalidate the slot while it is being filled
+        _SLOT.pack_into(self.buf, offset, 0, 0, 0, 0, 0, 0, 0.0)
+        return seq, offset + _SLOT_HEADER_SIZE
+
+    def _commit(self, seq, kind, length, shape, timestamp):
+        h, w, c = (tuple(shape) + (1, 1, 1))[:3] if shape else (0, 0, 0)
+        _SLOT.pack_into(self.buf, self._slot_offset(seq), seq, kind, length, h, w, c,
+                        time.time() if timestamp is None else timestamp)
+        self._publish(seq)
+        return seq
+
+    def write_jpeg(self, data, timestamp=None):
+        """Copies encoded bytes into the next slot. Returns its seq."""
+        length = len(data)
+        seq, start = self._begin(length)
+        self.buf[start:start + length] = data
+        return self._commit(seq, KIND_JPEG, length, None, timestamp)
+
+    def write_frame(self, frame, timestamp=None):
+        """Copies a uint8 frame into the next slot. Returns its seq."""
+        _, view = self.reserve_frame(frame.shape)
+        np.copyto(view, frame)
+        return self.commit_frame(timestamp)
+
+    def reserve_frame(self, shape):
+        """Returns (seq, writable NumPy view) of the next slot; finish with commit_frame()."""
+        length = int(np.prod(shape))
+        seq, start = self._begin(length)
+        self._reserved = (seq, length, tuple(shape))
+        return seq, np.ndarray(shape, dtype=np.uint8, buffer=self.buf, offset=start)
+
+    def commit_frame(self, timestamp=None):
+        seq, length, shape = self._reserved
+        self._reserved = None
+        return self._commit(seq, KIND_RAW, length, shape, timestamp)
+
+    # ---- readers ---------------------------------------------------------
+
+    def read(self, seq=None):
+        """Returns the Slot of `seq` (default: latest) or None if unavailable.
+
+        `data` is a memoryview into shared memory (no copy).
+        """
+        if seq is None:
+            seq = self.latest_seq()
+        if seq <= 0:
+            return None
+        offset = self._slot_offset(seq)
+        slot_seq, kind, length, h, w, c, ts = _SLOT.unpack_from(self.buf, offset)
+        if slot_seq != seq:
+            return None
+        start = offset + _SLOT_HEADER_SIZE
+        shape = (h, w, c) if c > 1 else (h, w)
+        return Slot(seq, kind, self.buf[start:start + length], shape if kind == KIND_RAW else None, ts)
+
+    def valid(self, seq):
+        """True while the slot of `seq` has not been reused."""
+        return _SLOT.unpack_from(self.buf, self._slot_offset(seq))[0] == seq
+
+    def frame(self, seq=None, writable=False):
+        """(seq, NumPy view) of a raw frame, or (seq, None).
+
+        Views are read-only unless `writable` (for a consumer that owns the
+        slot, e.g. a worker's private input ring).
+        """
+        slot = self.read(seq)
+        if slot is None or slot.kind != KIND_RAW:
+            return (seq or 0), None
+        view = np.frombuffer(slot.data, dtype=np.uint8).reshape(slot.shape)
+        view.flags.writeable = writable
+        return slot.seq, view
+
+    def jpeg(self, seq=None):
+        """(seq, memoryview) of an encoded frame, or (seq, None)."""
+        slot = self.read(seq)
+        if slot is None or slot.kind != KIND_JPEG:
+            return (seq or 0), None
+        return slot.seq, slot.data
+
+    def jpeg_bytes(self, seq=None, retries=3):
+        """(seq, bytes, timestamp) copy of the latest/given JPEG, checked against reuse."""
+        for _ in range(retries):
+            slot = self.read(seq)
+            if slot is None:
+                if seq is not None:
+                    seq = None   # overwritten meanwhile: fall back to the latest
+                    continue
+                return 0, None, None
+            data = bytes(slot.data)
+            slot.data.release()
+            if self.valid(slot.seq):
+                return slot.seq, data, slot.timestamp
+            seq = None
+        return 0, None, None
+
+    def wait_for(self, after_seq, timeout=None, poll=0.002):
+        """Blocks until a seq > after_seq is published (or timeout). Returns the latest seq."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            seq = self.latest_seq()
+            if seq > after_seq or (deadline is not None and time.time() >= deadline):
+                return seq
+            time.sleep(poll)
+
+    # ---- lifecycle -------------------------------------------------------
+
+    def close(self):
+        """Detaches. All NumPy views / memoryviews must be released first."""
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """Removes the block (writer side)."""
+        self.shm.unlink()
@@ -3,43 +3,126 @@ File saving, loading, and management operations
 """
 import os
 import json
+import time
+import threading
 import cv2
-from modules.config import CAPTURE_DIR
+import numpy as np
+from modules.config import (
+    CAPTURE_DIR, CAPTURE_BACKEND, CAPTURE_SEGMENT_DIR, CAPTURE_SEGMENT_MAX_BYTES,
+    CAPTURE_SEGMENT_MAX_AGE, CAPTURE_RETENTION_DAYS, CAPTURE_MAINTENANCE_INTERVAL,
+    THUMBNAIL_DIR
+)
 from modules.face_analysis import get_face_embedding, register_dangerous_person
+from modules import metrics
+
+# Segment stores (only opened when CAPTURE_BACKEND == "segments")
+_segment_store = None
+_thumbnail_store = None
+_segment_store_lock = threading.Lock()
+
+
+def get_segment_store():
+    """Returns the shared SegmentStore, opening it on first use."""
+    global _segment_store
+    if _segment_store is None:
+        with _segment_store_lock:
+            if _segment_store is None:
+                from modules.capture_store import SegmentStore
+                _segment_store = SegmentStore(
+                    CAPTURE_SEGMENT_DIR,
+                    max_segment_bytes=CAPTURE_SEGMENT_MAX_BYTES,
+                    max_segment_age=CAPTURE_SEGMENT_MAX_AGE,
+                )
+    return _segment_store
+
+
+def get_thumbnail_store():
+    """Returns the SegmentStore holding thumbnails (keyed `<key>@<width>`)."""
+    global _thumbnail_store
+    if _thumbnail_store is None:
+        with _segment_store_lock:
+            if _thumbnail_store is None:
+                from modules.capture_store import SegmentStore
+                _thumbnail_store = SegmentStore(
+                    os.path.join(CAPTURE_SEGMENT_DIR, "thumbs"),
+                    max_segment_bytes=CAPTURE_SEGMENT_MAX_BYTES,
+                    max_segment_age=CAPTURE_SEGMENT_MAX_AGE,
+                )
+    return _thumbnail_store
+
+
+def _use_segments():
+    return CAPTURE_BACKEND == "segments"
+
+
+def _capture_key(name):
+    """'<id>_<timestamp>.jpg' / '.json' -> '<id>_<timestamp>'"""
+    return os.path.splitext(os.path.basename(name))[0]
 
 
 def save_dangerous_person(person_id, timestamp, frame, emotions):
     """Saves the image and information of a dangerous person."""
-    # Save image
-    img_path = os.path.join(CAPTURE_DIR, f"{person_id}_{timestamp}.jpg")
-    cv2.imwrite(img_path, frame)
-    
-    # Save data as JSON
+    source = metrics.current_source()
+    metrics.CAPTURES.inc(source=source)
+    with metrics.STAGE_SECONDS.time(stage="save", source=source):
+        return _save_dangerous_person(person_id, timestamp, frame, emotions)
+
+
+def _save_dangerous_person(person_id, timestamp, frame, emotions):
     data = {
         "id": person_id,
         "timestamp": timestamp,
         "emotions": emotions
     }
-    json_path = os.path.join(CAPTURE_DIR, f"{person_id}_{timestamp}.json")
+    key = f"{person_id}_{timestamp}"
+
+    # Thumbnails are rendered by a background worker from a copy of the frame
+    from modules import thumbnails
+    thumbnails.schedule(key, frame)
+
+    if _use_segments():
+        ok, buffer = cv2.imencode('.jpg', frame)
+        if not ok:
+            return None, None
+        get_segment_store().append(key, buffer, data)
+        return f"{key}.jpg", f"{key}.json"
+
+    # Save image
+    img_path = os.path.join(CAPTURE_DIR, f"{key}.jpg")
+    cv2.imwrite(img_path, frame)
+
+    # Save data as JSON
+    json_path = os.path.join(CAPTURE_DIR, f"{key}.json")
     with open(json_path, "w") as f:
         json.dump(data, f, indent=4)
-    
+
     return img_path, json_path
 
 
 def load_existing_faces():
     """Loads previously registered dangerous persons."""
+    if _use_segments():
+        for key, data, image in get_segment_store().iter_records():
+            img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            embedding = get_face_embedding(img)
+            if embedding is not None:
+                register_dangerous_person(data["id"], embedding)
+                print(f"✓ Registered dangerous person loaded: {data['id']}")
+        return
+
     for filename in os.listdir(CAPTURE_DIR):
         if filename.endswith(".json"):
             json_path = os.path.join(CAPTURE_DIR, filename)
             with open(json_path, "r") as f:
                 data = json.load(f)
                 person_id = data["id"]
-                
+
                 # Find the related image
                 img_filename = filename.replace(".json", ".jpg")
                 img_path = os.path.join(CAPTURE_DIR, img_filename)
-                
+
                 if os.path.exists(img_path):
                     img = cv2.imread(img_path)
                     embedding = get_face_embedding(img)
@@ -50,6 +133,108 @@ def load_existing_faces():
 
 def get_captured_images():
     """Lists captured images of dangerous persons."""
+    if _use_segments():
+        return [f"{key}.jpg" for key in get_segment_store().keys()]
     files = os.listdir(CAPTURE_DIR)
     images = [f for f in files if f.endswith(".jpg")]
     return images
+
+
+def read_captured_image(name):
+    """Returns the JPEG bytes of a capture, or None."""
+    if _use_segments():
+        # Copied out of the segment map: WSGI servers only accept bytes
+        image = get_segment_store().get_image(_capture_key(name))
+        return bytes(image) if image is not None else None
+    img_path = os.path.join(CAPTURE_DIR, os.path.basename(name))
+    if not os.path.exists(img_path):
+        return None
+    with open(img_path, "rb") as f:
+        return f.read()
+
+
+def read_captured_meta(name):
+    """Returns the metadata dict of a capture, or None."""
+    if _use_segments():
+        return get_segment_store().get_meta(_capture_key(name))
+    json_path = os.path.join(CAPTURE_DIR, _capture_key(name) + ".json")
+    if not os.path.exists(json_path):
+        return None
+    with open(json_path, "r") as f:
+        return json.load(f)
+
+
+def _thumbnail_path(name, width):
+    return os.path.join(THUMBNAIL_DIR, str(width), _capture_key(name) + ".jpg")
+
+
+def has_thumbnail(name, width):
+    """Checks whether a thumbnail of the given width exists."""
+    if _use_segments():
+        return f"{_capture_key(name)}@{width}" in get_thumbnail_store()
+    return os.path.exists(_thumbnail_path(name, width))
+
+
+def save_thumbnail(name, width, jpeg_bytes):
+    """Stores an encoded thumbnail of a capture."""
+    if _use_segments():
+        key = _capture_key(name)
+        get_thumbnail_store().append(f"{key}@{width}", jpeg_bytes, {"key": key, "width": width})
+        return
+    path = _thumbnail_path(name, width)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(jpeg_bytes)
+    os.replace(tmp, path)
+
+
+def read_thumbnail(name, width):
+    """Returns the JPEG bytes of a thumbnail, or None."""
+    if _use_segments():
+        data = get_thumbnail_store().get_image(f"{_capture_key(name)}@{width}")
+        return bytes(data) if data is not None else None
+    path = _thumbnail_path(name, width)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def run_capture_maintenance():
+    """Applies retention and compaction to the segment store."""
+    if not _use_segments():
+        return
+    store = get_segment_store()
+    if CAPTURE_RETENTION_DAYS > 0:
+        removed = store.apply_retention(CAPTURE_RETENTION_DAYS * 86400)
+        if removed:
+            print(f"✓ Capture retention: {removed} old captures removed")
+    reclaimed = store.compact()
+
+    # Drop thumbnails whose capture is gone
+    thumbs = get_thumbnail_store()
+    for thumb_key in thumbs.keys():
+        if thumb_key.rsplit("@", 1)[0] not in store:
+            thumbs.delete(thumb_key)
+    reclaimed += thumbs.compact()
+    if reclaimed:
+        print(f"✓ Capture compaction: {reclaimed} bytes reclaimed")
+
+
+def start_capture_maintenance():
+    """Runs `run_capture_maintenance()` periodically on a daemon thread."""
+    if not _use_segments():
+        return None
+
+    def _loop():
+        while True:
+            try:
+                run_capture_maintenance()
+            except Exception as e:
+                print(f"⚠️ Capture maintenance failed: {e}")
+            time.sleep(CAPTURE_MAINTENANCE_INTERVAL)
+
+    thread = threading.Thread(target=_loop, name="capture-maintenance", daemon=True)
+    thread.start()
+    return thread
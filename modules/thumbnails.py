@@ -0,0 +1,136 @@
+"""
+Thumbnail pipeline for the captures dashboard
+
+Captures are stored at full camera resolution (up to XGA). The dashboard only
+needs small previews, so every capture gets JPEG thumbnails at the fixed
+widths in `THUMBNAIL_WIDTHS`. They are rendered on a background worker when a
+capture is saved, lazily on first request, or in bulk by the backfill job:
+
+    python -m modules.thumbnails backfill
+"""
+import sys
+import queue
+import threading
+import cv2
+import numpy as np
+from modules.config import THUMBNAIL_WIDTHS, THUMBNAIL_QUALITY
+from modules import storage
+
+_queue = queue.Queue(maxsize=256)
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _resize(frame, width):
+    h, w = frame.shape[:2]
+    if w <= width:
+        return frame
+    height = max(1, round(h * width / w))
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def _encode(frame):
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    return buffer.tobytes() if ok else None
+
+
+def render_thumbnail(frame, width):
+    """Resizes a BGR frame to `width` (keeping aspect) and encodes it as JPEG."""
+    return _encode(_resize(frame, width))
+
+
+def _decode_capture(name):
+    data = storage.read_captured_image(name)
+    if data is None:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def generate_thumbnails(name, frame=None, widths=THUMBNAIL_WIDTHS):
+    """Creates missing thumbnails of a capture. Returns the number written."""
+    missing = [w for w in widths if not storage.has_thumbnail(name, w)]
+    if not missing:
+        return 0
+    if frame is None:
+        frame = _decode_capture(name)
+        if frame is None:
+            return 0
+    written = 0
+    # Largest first, so each smaller thumbnail is resized from the previous one
+    for width in sorted(missing, reverse=True):
+        frame = _resize(frame, width)
+        jpeg = _encode(frame)
+        if jpeg is None:
+            continue
+        storage.save_thumbnail(name, width, jpeg)
+        written += 1
+    return written
+
+
+def get_thumbnail(name, width):
+    """Returns thumbnail bytes, rendering it synchronously if it is missing."""
+    data = storage.read_thumbnail(name, width)
+    if data is None:
+        generate_thumbnails(name, widths=(width,))
+        data = storage.read_thumbnail(name, width)
+    return data
+
+
+def _run():
+    while True:
+        name, frame = _queue.get()
+        try:
+            if name is None:
+                backfill_thumbnails()
+            else:
+                generate_thumbnails(name, frame)
+        except Exception as e:
+            print(f"⚠️ Thumbnail generation failed for {name}: {e}")
+        finally:
+            _queue.task_done()
+
+
+def start_worker():
+    """Starts the background thumbnail worker (idempotent)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name="thumbnail-worker", daemon=True)
+            _worker.start()
+    return _worker
+
+
+def schedule(name, frame=None):
+    """Queues thumbnail generation for a capture without blocking the caller.
+
+    `frame` is copied, since callers keep drawing on it after saving.
+    """
+    start_worker()
+    try:
+        _queue.put_nowait((name, frame.copy() if frame is not None else None))
+    except queue.Full:
+        # Dropped thumbnails are rendered lazily on first request
+        pass
+
+
+def schedule_backfill():
+    """Queues a backfill of thumbnails for all existing captures."""
+    start_worker()
+    _queue.put((None, None))
+
+
+def backfill_thumbnails():
+    """Generates missing thumbnails for every existing capture."""
+    written = 0
+    for name in storage.get_captured_images():
+        written += generate_thumbnails(name)
+    if written:
+        print(f"✓ Thumbnail backfill: {written} thumbnails generated")
+    return written
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        backfill_thumbnails()
+    else:
+        print(__doc__)
@@ -0,0 +1,220 @@
+"""
+Per-frame tracing and on-demand profiling of the frame loops
+
+Switched on at runtime (POST /admin/trace/start), the pipelines record one
+span per stage of every frame (capture, decode, mesh, analysis, smoothing,
+danger, overlay, encode, send) into a bounded buffer, downloadable as
+Chrome / Perfetto trace JSON (GET /admin/trace, open in ui.perfetto.dev or
+chrome://tracing):
+
+    with tracer.frame(source_id):
+        with tracer.span("capture", source_id):
+            frame = conn.read()
+        ...
+
+POST /admin/profile?seconds=N additionally runs cProfile in every frame
+loop thread for N seconds (GET /admin/profile for the merged report).
+
+When neither is on, `span()` / `frame()` return a shared no-op context
+manager after one attribute check, so the hooks stay in the hot path.
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import threading
+from collections import deque
+from modules.config import TRACE_MAX_EVENTS, PROFILE_MAX_SECONDS
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "source", "start")
+
+    def __init__(self, tracer, name, source):
+        self.tracer = tracer
+        self.name = name
+        self.source = source
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.source, self.start, time.perf_counter())
+        return False
+
+
+class _FrameSpan(_Span):
+    """Span of a whole frame; also drives per-thread profiling."""
+    __slots__ = ()
+
+    def __enter__(self):
+        tracer = self.tracer
+        if tracer.profiling:
+            tracer._profile_thread()
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        tracer = self.tracer
+        if tracer.tracing:
+            tracer.record(self.name, self.source, self.start, time.perf_counter())
+        if tracer.profiling or tracer._profiles:
+            tracer._profile_check()
+        return False
+
+
+class Tracer:
+    """Bounded in-memory span recorder plus time-boxed cProfile capture."""
+
+    def __init__(self, max_events=TRACE_MAX_EVENTS):
+        self.tracing = False
+        self.profiling = False
+        self.events = deque(maxlen=max_events)
+        self._stop_at = None
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._profiles = {}  # thread ident -> (profile run, cProfile.Profile)
+        self._profile_run = 0
+        self._profile_until = 0.0
+        self._profile_stats = None
+        self.profile_started = None
+
+    @property
+    def active(self):
+        return self.tracing or self.profiling
+
+    # ---- tracing ---------------------------------------------------------
+
+    def start(self, seconds=None, clear=True):
+        """Starts recording spans (for `seconds`, or until stop())."""
+        if clear:
+            self.events.clear()
+        self._stop_at = time.perf_counter() + seconds if seconds else None
+        self.tracing = True
+
+    def stop(self):
+        self.tracing = False
+        self._stop_at = None
+
+    def span(self, name, source=None):
+        """Context manager recording `name` while tracing (no-op otherwise)."""
+        if not self.tracing:
+            return _NOOP
+        return _Span(self, name, source)
+
+    def frame(self, source=None):
+        """Context manager around one frame loop iteration."""
+        # Threads still holding a profiler need a frame to stop it
+        if not (self.tracing or self.profiling or self._profiles):
+            return _NOOP
+        return _FrameSpan(self, "frame", source)
+
+    def record(self, name, source, start, end):
+        if self._stop_at is not None and end > self._stop_at:
+            self.stop()
+            return
+        thread = threading.current_thread()
+        self._threads.setdefault(thread.ident, thread.name)
+        self.events.append((name, source, start, end, thread.ident))
+
+    def status(self):
+        return {
+            "tracing": self.tracing,
+            "events": len(self.events),
+            "max_events": self.events.maxlen,
+            "stops_in": round(self._stop_at - time.perf_counter(), 1) if self._stop_at else None,
+            "profiling": self.profiling,
+            "profile_ready": self._profile_stats is not None,
+        }
+
+    def chrome_trace(self):
+        """Recorded spans in the Chrome trace event format."""
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in list(self._threads.items())]
+        for name, source, start, end, tid in list(self.events):
+            event = {
+                "name": name, "cat": "frame" if name == "frame" else "stage", "ph": "X",
+                "ts": round((start - self._origin) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+                "pid": pid, "tid": tid,
+            }
+            if source is not None:
+                event["args"] = {"source": source}
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    # ---- profiling -------------------------------------------------------
+
+    def profile(self, seconds):
+        """Profiles every frame loop thread for `seconds` (capped at PROFILE_MAX_SECONDS)."""
+        with self._lock:
+            # Profilers of threads that ended during an earlier run never merge
+            alive = {t.ident for t in threading.enumerate()}
+            for ident in [i for i in self._profiles if i not in alive]:
+                del self._profiles[ident]
+            self._profile_run += 1
+            self._profile_stats = None
+            self._profile_until = time.perf_counter() + min(seconds, PROFILE_MAX_SECONDS)
+            self.profile_started = time.time()
+            self.profiling = True
+
+    def _profile_thread(self):
+        ident = threading.get_ident()
+        entry = self._profiles.get(ident)
+        if entry is not None and entry[0] == self._profile_run:
+            return
+        if entry is not None:
+            # Left over from an earlier run: discard instead of mixing it in
+            entry[1].disable()
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles[ident] = (self._profile_run, profile)
+        profile.enable()
+
+    def _profile_check(self):
+        if time.perf_counter() < self._profile_until:
+            return
+        self.profiling = False
+        with self._lock:
+            entry = self._profiles.pop(threading.get_ident(), None)
+        if entry is None:
+            return
+        run, profile = entry
+        # Each thread stops its own profiler and merges it into the report
+        profile.disable()
+        with self._lock:
+            if run != self._profile_run:
+                return
+            if self._profile_stats is None:
+                self._profile_stats = pstats.Stats(profile)
+            else:
+                self._profile_stats.add(profile)
+
+    def profile_report(self, sort="cumulative", limit=60):
+        """Text report of the last profile, or None if none finished yet."""
+        with self._lock:
+            stats = self._profile_stats
+            if stats is None:
+                return None
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+tracer = Tracer()
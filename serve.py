@@ -0,0 +1,121 @@
+"""
+Production launcher
+
+    python serve.py              # pipeline process + gunicorn web workers
+    python serve.py pipeline     # only the pipeline process
+    python serve.py web          # only the web workers (pipeline already running)
+
+The pipeline process owns the cameras, models and face registry (everything
+main.py sets up) and serves the full app on PIPELINE_HTTP_PORT plus frames /
+state on PIPELINE_RPC_PORT, both on PIPELINE_HOST. WEB_WORKERS gunicorn
+gthread workers (web.py) serve SERVER_HOST:SERVER_PORT; they load no models,
+so memory does not grow with the worker count.
+
+Configuration is non-interactive: environment variables or a .env file /
+APP_CONFIG_FILE JSON with the names in modules/config.py, e.g.
+
+    CAMERA_SOURCES='[{"ip": "10.0.0.12", "priority": 2}]' LOCAL_CAMERA=false \\
+    ESP32_OLED_URL=http://10.0.0.12/face_mood WEB_WORKERS=4 python serve.py
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import secrets
+import threading
+import subprocess
+
+
+def _require_authkey():
+    from modules.config import PIPELINE_AUTHKEY
+    if not PIPELINE_AUTHKEY:
+        sys.exit("❌ PIPELINE_AUTHKEY is empty: set the same secret for the pipeline and web roles "
+                 "(e.g. PIPELINE_AUTHKEY=$(python -c 'import secrets; print(secrets.token_hex(16))'))")
+
+
+def run_pipeline():
+    from werkzeug.serving import make_server
+    import main
+    from modules.camera import camera_stream
+    from modules.config import LOCAL_CAMERA, PIPELINE_HOST, PIPELINE_HTTP_PORT
+    from modules.pipeline_service import PipelineService, serve_rpc
+
+    if LOCAL_CAMERA:
+        def _local_camera():
+            # Continuous capture into camera_stream.output (no viewer needed)
+            while True:
+                for _ in camera_stream.generate_frames():
+                    pass
+                time.sleep(2.0)
+        threading.Thread(target=_local_camera, name="local-camera", daemon=True).start()
+
+    server = make_server(PIPELINE_HOST, PIPELINE_HTTP_PORT, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="pipeline-http", daemon=True).start()
+    print(f"✓ Pipeline app on {PIPELINE_HOST}:{PIPELINE_HTTP_PORT}")
+    serve_rpc(PipelineService())
+
+
+def _wait_for_port(host, port, proc, timeout=300.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            with socket.create_connection((host, port), timeout=1.0):
+                return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def web_command():
+    from modules.config import SERVER_HOST, SERVER_PORT, WEB_WORKERS, WEB_THREADS
+    return [sys.executable, '-m', 'gunicorn', 'web:app',
+            '--worker-class', 'gthread', '--workers', str(WEB_WORKERS), '--threads', str(WEB_THREADS),
+            '--bind', f'{SERVER_HOST}:{SERVER_PORT}', '--timeout', '120', '--graceful-timeout', '5']
+
+
+def run_all():
+    from modules.config import PIPELINE_HOST, PIPELINE_RPC_PORT
+    # Shared secret of the RPC channel, inherited by all child processes
+    os.environ.setdefault('PIPELINE_AUTHKEY', secrets.token_hex(16))
+
+    pipeline = subprocess.Popen([sys.executable, __file__, 'pipeline'])
+    print("⏳ Waiting for the pipeline process (loading models)...")
+    if not _wait_for_port(PIPELINE_HOST, PIPELINE_RPC_PORT, pipeline):
+        pipeline.terminate()
+        sys.exit("❌ Pipeline process did not start")
+
+    web = subprocess.Popen(web_command())
+    children = (web, pipeline)
+
+    def _stop(*_):
+        for proc in children:
+            if proc.poll() is None:
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        # Exit (and stop the other one) as soon as either process ends
+        while all(proc.poll() is None for proc in children):
+            time.sleep(1.0)
+    finally:
+        _stop()
+        for proc in children:
+            proc.wait()
+
+
+if __name__ == "__main__":
+    role = sys.argv[1] if len(sys.argv) > 1 else "all"
+    if role == "pipeline":
+        _require_authkey()
+        run_pipeline()
+    elif role == "web":
+        _require_authkey()
+        os.execv(sys.executable, web_command())
+    elif role == "all":
+        run_all()
+    else:
+        print(__doc__)
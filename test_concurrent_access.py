@@ -2,12 +2,21 @@
 ESP32 Kamera + OLED Test Script
 Hem kameraya hem OLED ekrana aynı anda erişimi test eder
 """
+import sys
 import requests
 import time
 import threading
 
-ESP32_IP = "10.64.220.189"  # ESP32 IP adresinizi girin
-CAMERA_URL = f"http://{ESP32_IP}:81/stream"
+# ESP32 IP adresinizi girin veya argüman olarak verin:
+#   python test_concurrent_access.py 10.64.220.189
+#   python test_concurrent_access.py 127.0.0.1:8080   (python -m benchmarks.esp_simulator)
+ESP32_IP = sys.argv[1] if len(sys.argv) > 1 else "10.64.220.189"
+if ':' in ESP32_IP:
+    # Simulator: stream server on the next port
+    _host, _port = ESP32_IP.rsplit(':', 1)
+    CAMERA_URL = f"http://{_host}:{int(_port) + 1}/stream"
+else:
+    CAMERA_URL = f"http://{ESP32_IP}:81/stream"
 OLED_URL = f"http://{ESP32_IP}/face_mood"
 
 # Test duyguları
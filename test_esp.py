@@ -102,6 +102,7 @@ def main():
         print("\nExamples:")
         print("  python test_esp.py 10.64.220.189")
         print("  python test_esp.py 10.64.220.189 --apply-preset")
+        print("  python test_esp.py 127.0.0.1:8080   (python -m benchmarks.esp_simulator)")
         sys.exit(1)
     
     esp_ip = sys.argv[1]
@@ -0,0 +1,101 @@
+"""
+Lightweight web worker app (production mode, see serve.py)
+
+Runs under gunicorn (gthread) in several processes. It holds no cameras,
+models or face registry: streams, snapshots and emotion state come from the
+pipeline process (frames via shared memory or RPC, state via RPC, see
+modules/pipeline_client.py), every other route is forwarded to the full app inside the pipeline process.
+"""
+import requests
+from flask import Flask, Response, jsonify, request
+from modules.config import PIPELINE_HOST, PIPELINE_HTTP_PORT
+from modules.http_views import MJPEG_MIMETYPE, snapshot_response, emotion_event_stream
+from modules.pipeline_client import PipelineClient, frame_buffer
+from modules.output_profiles import viewer_quality
+
+app = Flask(__name__)
+pipeline = PipelineClient()
+_upstream = requests.Session()
+_UPSTREAM_URL = f"http://{PIPELINE_HOST}:{PIPELINE_HTTP_PORT}"
+_HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+               'te', 'trailers', 'transfer-encoding', 'upgrade', 'host'}
+
+
+@app.route('/video_feed')
+def video_feed():
+    """MJPEG stream from the pipeline's output buffers."""
+    ip = request.args.get('ip')
+    try:
+        viewer = viewer_quality(request.args)
+        buffer = frame_buffer(pipeline, ip)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+
+    def generate():
+        if ip:
+            pipeline.call('open_viewer', ip)
+        try:
+            for part in viewer.stream(buffer):
+                yield part
+        finally:
+            if ip:
+                pipeline.call('close_viewer', ip)
+
+    return Response(generate(), mimetype=MJPEG_MIMETYPE)
+
+
+@app.route('/snapshot.jpg')
+def snapshot():
+    return snapshot_response(pipeline.call('default_source'), frame_buffer(pipeline))
+
+
+@app.route('/snapshot/<source>.jpg')
+def source_snapshot(source):
+    try:
+        return snapshot_response(source, frame_buffer(pipeline, source))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.route('/current_emotions')
+def current_emotions():
+    try:
+        return jsonify(pipeline.call('emotions', request.args.get('source')))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.route('/emotions/stream')
+def emotions_stream():
+    source = request.args.get('source')
+    try:
+        # Unknown sources fail here instead of inside the stream
+        pipeline.call('emotions', source)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    return emotion_event_stream(lambda after_seq, timeout: pipeline.call('wait_state', source, after_seq, timeout))
+
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE'])
+@app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def forward(path):
+    """Forwards everything else to the full app in the pipeline process."""
+    headers = {k: v for k, v in request.headers if k.lower() not in _HOP_BY_HOP}
+    try:
+        upstream = _upstream.request(
+            request.method, f"{_UPSTREAM_URL}/{path}", params=request.args, headers=headers,
+            data=request.get_data(), stream=True, allow_redirects=False, timeout=(5, 60))
+    except requests.RequestException as e:
+        return jsonify({"error": f"Pipeline unavailable: {e}"}), 502
+    response_headers = [(k, v) for k, v in upstream.raw.headers.items() if k.lower() not in _HOP_BY_HOP]
+
+    def body():
+        try:
+            for chunk in upstream.raw.stream(64 * 1024, decode_content=False):
+                yield chunk
+        finally:
+            upstream.close()
+
+    return Response(body(), status=upstream.status_code, headers=response_headers)